@@ -5,6 +5,7 @@ from argparse import RawTextHelpFormatter
 from os.path import isdir
 
 from dejavu import Dejavu
+from dejavu.database_handler.mmap_database import write_index_file
 from dejavu.logic.recognizer.file_recognizer import FileRecognizer
 from dejavu.logic.recognizer.microphone_recognizer import MicrophoneRecognizer
 
@@ -47,9 +48,20 @@ if __name__ == '__main__':
                              'Usage: \n'
                              '--recognize mic number_of_seconds \n'
                              '--recognize file path/to/file \n')
+    parser.add_argument('-e', '--export-index', nargs=1,
+                        help='Export the fingerprints to an index file, opened\n'
+                             'with the "mmap" database type.\n'
+                             'Usage: \n'
+                             '--export-index path/to/index-file \n')
+    parser.add_argument('-s', '--stop-hashes', action='store_true',
+                        help='Count the stop hashes (the hashes with more fingerprints\n'
+                             'than the "stop_hashes" threshold) again, save them and\n'
+                             'report the index space they take.\n'
+                             'Usage: \n'
+                             '--stop-hashes \n')
     args = parser.parse_args()
 
-    if not args.fingerprint and not args.recognize:
+    if not args.fingerprint and not args.recognize and not args.export_index and not args.stop_hashes:
         parser.print_help()
         sys.exit(0)
 
@@ -84,3 +96,12 @@ if __name__ == '__main__':
         elif source == 'file':
             songs = djv.recognize(FileRecognizer, opt_arg)
         print(songs)
+
+    elif args.export_index:
+        # Export the database to an index file
+        print(f"Exporting the fingerprints to {args.export_index[0]}")
+        write_index_file(djv.db, args.export_index[0])
+
+    elif args.stop_hashes:
+        # Count the stop hashes again
+        print(json.dumps(djv.refresh_stop_hashes().report(), indent=4))
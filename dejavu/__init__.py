@@ -1,22 +1,36 @@
 import multiprocessing
-import sys
-import traceback
-from itertools import groupby
+import os
+from contextlib import contextmanager
 from time import time
-from typing import Dict, List, Set, Tuple
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+import numpy as np
 
 import dejavu.logic.decoder as decoder
 from dejavu.base_classes.base_database import get_database
-from dejavu.config.settings import (DEFAULT_FS, DEFAULT_OVERLAP_RATIO,
-                                    DEFAULT_WINDOW_SIZE, FIELD_FILE_SHA1,
-                                    FIELD_TOTAL_HASHES,
+from dejavu.config.settings import (CATALOG_CHANNEL_STRATEGY, CHANNEL_STRATEGY, CHANNEL_STRATEGY_LOUDEST,
+                                    CHANNEL_STRATEGY_MID, DECODER_BACKEND, DECODER_BACKEND_FFMPEG,
+                                    DEFAULT_FS, FIELD_FILE_SHA1,
+                                    FIELD_TOTAL_HASHES, FINGERPRINT_FORMAT,
                                     FINGERPRINTED_CONFIDENCE,
                                     FINGERPRINTED_HASHES, HASHES_MATCHED,
-                                    INPUT_CONFIDENCE, INPUT_HASHES, OFFSET,
-                                    OFFSET_SECS, SONG_ID, SONG_NAME, SONG_SINGER, SONG_ALBUM, SONG_LENGTH,
-                                    SONG_PUBLISHER, SONG_PUBLICTIME, SONGS_TABLENAME, TOPN)
+                                    INGESTION_WRITERS, INPUT_CONFIDENCE, INPUT_HASHES, MATCH_MODE,
+                                    MATCH_MODE_CLIENT, MATCH_MODE_SERVER, OFFSET,
+                                    OFFSET_SECS, REPLICA_READ_YOUR_WRITES, REPLICA_RETRY_INTERVAL, SONG_ID,
+                                    SONG_NAME, SONG_SINGER, SONG_ALBUM, SONG_LENGTH, SONG_PUBLISHER,
+                                    SONG_PUBLICTIME, SONGS_TABLENAME, STOP_HASH_THRESHOLD, TOPN)
+from dejavu.database_handler.replicated_database import ReplicatedDatabase
+from dejavu.logic.alignment import best_offsets
+from dejavu.logic.channels import (CHANNEL_STRATEGIES, channel_energy,
+                                   downmix, select_channels)
+from dejavu.logic.file_hash_cache import FileHashCache
 from dejavu.logic.fingerprint import fingerprint
+from dejavu.logic.fingerprint_batch import FingerprintBatch
+from dejavu.logic.fingerprint_profile import FingerprintProfile
 from dejavu.logic.information import information
+from dejavu.logic.ingestion import IngestionPipeline
+from dejavu.logic.stop_hashes import StopHashes
+from dejavu.logic.streaming import StreamingFingerprinter
 from dejavu.third_party.dejavu_timer import DejavuTimer
 
 
@@ -25,9 +39,54 @@ class Dejavu:
         self.config = config
 
         # initialize db
-        db_cls = get_database(config.get("database_type", "mysql").lower())
-
-        self.db = db_cls(**config.get("database", {}))
+        database_type = config.get("database_type", "mysql").lower()
+        read_replicas = config.get("read_replicas", None)
+        if read_replicas:
+            # the "database" config is the primary, recognition reads are balanced over the replicas.
+            self.db = ReplicatedDatabase(
+                {"database_type": database_type, "database": config.get("database", {})},
+                [{"database_type": database_type, "database": replica} for replica in read_replicas],
+                retry_interval=config.get("replica_retry_interval", REPLICA_RETRY_INTERVAL),
+                read_your_writes=config.get("read_your_writes", REPLICA_READ_YOUR_WRITES))
+        else:
+            db_cls = get_database(database_type)
+            self.db = db_cls(**config.get("database", {}))
+
+        # format of the generated hashes, "sha1" (default) or "packed",
+        # it has to match the one recorded in the database catalog.
+        self.fingerprint_format = self.config.get("fingerprint_format", FINGERPRINT_FORMAT)
+        self.db.set_fingerprint_format(self.fingerprint_format)
+
+        # "pydub" (default) decodes whole files in memory, "ffmpeg" streams them block by block.
+        self.decoder_backend = self.config.get("decoder_backend", DECODER_BACKEND)
+
+        # "client" (default) aligns the matches in Python, "server" aligns them in the database.
+        self.match_mode = self.config.get("match_mode", MATCH_MODE)
+        if self.match_mode not in (MATCH_MODE_CLIENT, MATCH_MODE_SERVER):
+            raise TypeError("Unsupported match mode supplied.")
+
+        # path to a local file caching the hashes of the files seen, None means no cache.
+        hash_cache = self.config.get("hash_cache", None)
+        self.hash_cache = FileHashCache(hash_cache) if hash_cache else None
+
+        # stop hashes pruning, a dictionary with the "threshold", the "path" of the sidecar file keeping
+        # them and whether they are pruned at "ingest" time too, None disables it.
+        self.stop_hashes_config = self.config.get("stop_hashes", None)
+        self.stop_hashes = None
+
+        # channels fingerprinted, "all" (default), "mid" (downmix) or "loudest",
+        # it has to match the one recorded in the database catalog.
+        self.channel_strategy = self.config.get("channel_strategy", CHANNEL_STRATEGY)
+        if self.channel_strategy not in CHANNEL_STRATEGIES:
+            raise TypeError("Unsupported channel strategy supplied.")
+        self.db.set_catalog_setting(CATALOG_CHANNEL_STRATEGY, self.channel_strategy)
+
+        # sampling rate, window size, overlap ratio and peak finding and hashing parameters audio is fingerprinted
+        # with, the name of one of the FINGERPRINT_PROFILES or a dictionary, it has to match the one recorded in
+        # the database catalog.
+        self.profile = FingerprintProfile.from_config(self.config.get("fingerprint_profile", None))
+        for setting, value in self.profile.catalog_settings().items():
+            self.db.set_catalog_setting(setting, value)
 
         # if we should limit seconds fingerprinted,
         # None|-1 means use entire track
@@ -37,6 +96,64 @@ class Dejavu:
 
     def setup(self) -> None:
         self.db.setup()
+        if self.stop_hashes_config is not None:
+            self.load_stop_hashes()
+
+    def load_stop_hashes(self) -> StopHashes:
+        """
+        Loads the stop hashes from their sidecar file, counting them in the database if it doesn't exist
+        or was computed with another threshold or fingerprint format.
+
+        :return: the stop hashes pruned from now on.
+        """
+        path = self.stop_hashes_config.get("path", None)
+        threshold = self.stop_hashes_config.get("threshold", STOP_HASH_THRESHOLD)
+        ingest = self.stop_hashes_config.get("ingest", False)
+
+        if path and os.path.exists(path):
+            stop_hashes = StopHashes.load(path, prune_ingest=ingest)
+            if stop_hashes.threshold == threshold and stop_hashes.fingerprint_format == self.fingerprint_format:
+                self.stop_hashes = stop_hashes
+                return stop_hashes
+
+        return self.refresh_stop_hashes()
+
+    @DejavuTimer(name=__name__ + ".refresh_stop_hashes()\t\t\t\t\t\t")
+    def refresh_stop_hashes(self) -> StopHashes:
+        """
+        Counts the stop hashes in the database again, e.g. once the catalog has grown, and saves them
+        to their sidecar file.
+
+        :return: the stop hashes pruned from now on.
+        """
+        config = self.stop_hashes_config or {}
+        stop_hashes = StopHashes.from_database(self.db, config.get("threshold", STOP_HASH_THRESHOLD),
+                                               prune_ingest=config.get("ingest", False))
+        if config.get("path", None):
+            stop_hashes.save(config["path"])
+
+        self.stop_hashes = stop_hashes
+        return stop_hashes
+
+    def __prune_stored(self, hashes: List[Tuple[str, int]]) -> List[Tuple[str, int]]:
+        return self.stop_hashes.prune_stored(hashes) if self.stop_hashes is not None else hashes
+
+    @contextmanager
+    def initial_build(self):
+        """
+        Builds the catalog from scratch with the fingerprints indexes deferred: they are built once all
+        the fingerprints are stored instead of being maintained on every insert. The database is left
+        with the same schema setup() creates, even if fingerprinting fails halfway.
+
+        # Use as:
+        with djv.initial_build():
+            djv.fingerprint_directory("mp3", [".mp3"])
+        """
+        self.db.begin_initial_build()
+        try:
+            yield self
+        finally:
+            self.db.finish_initial_build()
 
     @DejavuTimer(name=__name__ + ".__load_fingerprinted_audio_hashes()\t\t\t\t")
     def __load_fingerprinted_audio_hashes(self) -> Set[str]:
@@ -52,6 +169,19 @@ class Dejavu:
             songhashes_set.add(song_hash)
         return songhashes_set
 
+    def __known_file_hash(self, key: Optional[Tuple[str, int, int, int]]) -> Optional[str]:
+        """
+        Gets the hash of a file before fingerprinting it, to skip the files already fingerprinted.
+        Files are never read up front: the hash is only known when the hash cache has it, otherwise
+        it gets computed while decoding the file, and a duplicate is discarded once decoded.
+
+        :param key: the hash cache key of the file, None if there is no cache.
+        :return: the hash of the file contents, or None if unknown.
+        """
+        if self.hash_cache is None:
+            return None
+        return self.hash_cache.get(key)
+
     def get_fingerprinted_songs(self) -> List[Dict[str, any]]:
         """
         To pull all fingerprinted songs from the database.
@@ -68,13 +198,15 @@ class Dejavu:
         """
         self.db.delete_songs_by_id(song_ids)
 
-    def fingerprint_directory(self, path: str, extensions: list[str], nprocesses: int = None) -> None:
+    def fingerprint_directory(self, path: str, extensions: list[str], nprocesses: int = None,
+                              nwriters: int = INGESTION_WRITERS) -> None:
         """
         Given a directory and a set of extensions it fingerprints all files that match each extension specified.
 
         :param path: path to the directory.
         :param extensions: list of file extensions to consider.
         :param nprocesses: amount of processes to fingerprint the files within the directory.
+        :param nwriters: amount of threads storing the fingerprinted files in the database.
         """
         # Try to use the maximum amount of processes if not given.
         try:
@@ -84,47 +216,23 @@ class Dejavu:
         else:
             nprocesses = 1 if nprocesses <= 0 else nprocesses
 
-        pool = multiprocessing.Pool(nprocesses)
+        pipeline = IngestionPipeline(self.db, Dejavu._fingerprint_worker, self.__load_fingerprinted_audio_hashes(),
+                                     nprocesses=nprocesses, nwriters=nwriters, hash_cache=self.hash_cache,
+                                     stop_hashes=self.stop_hashes)
 
-        songhashes_set = self.__load_fingerprinted_audio_hashes()
-        filenames_to_fingerprint = []
-        for filename, _ in decoder.find_files(path, extensions):
-            # don't refingerprint already fingerprinted files
-            if decoder.unique_hash(filename) in songhashes_set:
-                print(f"{filename} already fingerprinted, continuing...")
-                continue
-
-            filenames_to_fingerprint.append(filename)
-
-        # Prepare _fingerprint_worker input
-        worker_input = list(zip(filenames_to_fingerprint, [self.limit] * len(filenames_to_fingerprint)))
-
-        # Send off our tasks
-        iterator = pool.imap_unordered(Dejavu._fingerprint_worker, worker_input)
-
-        # Loop till we have all of them
-        while True:
-            try:
-                song_name, hashes, file_hash, song_publisher, song_length, song_singer, song_album, song_public = next(
-                    iterator)
-            except multiprocessing.TimeoutError:
-                continue
-            except StopIteration:
-                break
-            except Exception:
-                print("Failed fingerprinting")
-                # Print traceback because we can't reraise it here
-                traceback.print_exc(file=sys.stdout)
-            else:
-                sid = self.db.insert_song(song_name, file_hash, len(hashes), song_publisher, song_length, song_singer,
-                                          song_album, song_public)
-
-                self.db.insert_hashes(sid, hashes)
-                self.db.set_song_fingerprinted(sid)
-                self.__load_fingerprinted_audio_hashes()
-
-        pool.close()
-        pool.join()
+        def jobs():
+            for filename, _ in decoder.find_files(path, extensions):
+                key = self.hash_cache.file_key(filename) if self.hash_cache else None
+                # don't refingerprint already fingerprinted files, files whose hash
+                # isn't cached are only known to be duplicates once decoded.
+                if pipeline.is_known(self.__known_file_hash(key)):
+                    print(f"{filename} already fingerprinted, continuing...")
+                    continue
+
+                yield filename, (filename, self.limit, self.fingerprint_format, self.decoder_backend,
+                                 self.channel_strategy, self.profile), key
+
+        pipeline.run(jobs())
 
     def fingerprint_file(self, file_path: str) -> None:
         """
@@ -133,14 +241,24 @@ class Dejavu:
 
         :param file_path: path to the file.
         """
-        song_hash = decoder.unique_hash(file_path)
+        key = self.hash_cache.file_key(file_path) if self.hash_cache else None
+        song_hash = self.__known_file_hash(key)
         # don't refingerprint already fingerprinted files
         songhashes_set = self.__load_fingerprinted_audio_hashes()
         if song_hash in songhashes_set:
             print(f"{file_path} already fingerprinted, continuing...")
+            return
+
+        song_name, hashes, file_hash, song_publisher, song_length, song_singer, song_album, song_public = \
+            Dejavu._fingerprint_worker((file_path, self.limit, self.fingerprint_format, self.decoder_backend,
+                                        self.channel_strategy, self.profile))
+        if self.hash_cache is not None:
+            self.hash_cache.set(key, file_hash)
+
+        if file_hash in songhashes_set:
+            print(f"{file_path} already fingerprinted, continuing...")
         else:
-            song_name, hashes, file_hash, song_publisher, song_length, song_singer, song_album, song_public = Dejavu._fingerprint_worker(
-                (file_path, self.limit))
+            hashes = self.__prune_stored(hashes)
             sid = self.db.insert_song(song_name, file_hash, len(hashes), song_publisher, song_length, song_singer,
                                       song_album, song_public)
 
@@ -164,13 +282,24 @@ class Dejavu:
         :param song_public: The public time of the song.
 
         """
-        song_hash = decoder.unique_hash(file_path)
+        key = self.hash_cache.file_key(file_path) if self.hash_cache else None
+        song_hash = self.__known_file_hash(key)
         # don't refingerprint already fingerprinted files
         songhashes_set = self.__load_fingerprinted_audio_hashes()
         if song_hash in songhashes_set:
             print(f"{file_path} already fingerprinted, continuing...")
+            return
+
+        hashes, file_hash = Dejavu._fingerprint_worker(
+            (file_path, self.limit, self.fingerprint_format, self.decoder_backend, self.channel_strategy,
+             self.profile), False)
+        if self.hash_cache is not None:
+            self.hash_cache.set(key, file_hash)
+
+        if file_hash in songhashes_set:
+            print(f"{file_path} already fingerprinted, continuing...")
         else:
-            hashes, file_hash = Dejavu._fingerprint_worker((file_path, self.limit), False)
+            hashes = self.__prune_stored(hashes)
             sid = self.db.insert_song(song_name, file_hash, len(hashes), song_publisher, song_length, song_singer,
                                       song_album, song_public)
 
@@ -179,16 +308,22 @@ class Dejavu:
             self.__load_fingerprinted_audio_hashes()
 
     @DejavuTimer(name=__name__ + ".generate_fingerprints()\t\t\t\t\t\t")
-    def generate_fingerprints(self, samples: List[int], Fs=DEFAULT_FS) -> Tuple[List[Tuple[str, int]], float]:
+    def generate_fingerprints(self, samples: List[int], Fs=DEFAULT_FS, as_batch: bool = False) \
+            -> Tuple[Union[List[Tuple[str, int]], FingerprintBatch], float]:
         f"""
         Generate the fingerprints for the given sample data (channel).
 
         :param samples: list of ints which represents the channel info of the given audio file.
-        :param Fs: sampling rate which defaults to {DEFAULT_FS}.
+        :param Fs: sampling rate which defaults to {DEFAULT_FS}, the samples are resampled to the one of the
+         fingerprint profile if it differs.
+        :param as_batch: return the fingerprints as a FingerprintBatch instead of a list of tuples.
         :return: a list of tuples for hash and its corresponding offset, together with the generation time.
         """
         t = time()
-        hashes = fingerprint(samples, Fs=Fs)
+        if self.profile.fs is not None and Fs != self.profile.fs:
+            samples, Fs = decoder.resample(samples, Fs, self.profile.fs), self.profile.fs
+        hashes = fingerprint(samples, Fs=Fs, fingerprint_format=self.fingerprint_format, as_batch=as_batch,
+                             profile=self.profile)
         fingerprint_time = time() - t
         return hashes, fingerprint_time
 
@@ -203,33 +338,69 @@ class Dejavu:
 
         """
         t = time()
-        matches, dedup_hashes = self.db.return_matches(hashes)
+        matches, dedup_hashes = self.db.return_matches(hashes, as_arrays=True)
         query_time = time() - t
 
         return matches, dedup_hashes, query_time
 
+    @DejavuTimer(name=__name__ + ".find_aligned_matches()\t\t\t\t\t\t")
+    def find_aligned_matches(self, hashes: List[Tuple[str, int]], topn: int = TOPN) \
+            -> Tuple[List[Tuple[int, int, int]], Dict[str, int], float]:
+        """
+        Finds the corresponding matches on the fingerprinted audios for the given hashes, aligned by
+        the database, which only returns the best candidates.
+
+        :param hashes: list of tuples for hashes and their corresponding offsets
+        :param topn: number of songs returned.
+        :return: a tuple containing the best (song id, offset difference, count) candidate of the topn songs,
+         a dictionary which counts the different hashes matched for each of them (with the song id as key),
+         and the time that the query took.
+        """
+        t = time()
+        songs_matches, dedup_hashes = self.db.return_aligned_matches(hashes, topn)
+        query_time = time() - t
+
+        return songs_matches, dedup_hashes, query_time
+
     @DejavuTimer(name=__name__ + ".align_matches()\t\t\t\t\t\t\t")
-    def align_matches(self, matches: List[Tuple[int, int]], dedup_hashes: Dict[str, int], queried_hashes: int,
-                      topn: int = TOPN) -> List[Dict[str, any]]:
+    def align_matches(self, matches: Union[List[Tuple[int, int]], Tuple[np.ndarray, np.ndarray]],
+                      dedup_hashes: Dict[str, int], queried_hashes: int, topn: int = TOPN) -> List[Dict[str, any]]:
         """
         Finds hash matches that align in time with other matches and finds
         consensus about which hashes are "true" signal from the audio.
 
-        :param matches: matches from the database
+        :param matches: matches from the database, either a list of (song id, offset difference) tuples
+         or two parallel arrays of song ids and offset differences.
         :param dedup_hashes: dictionary containing the hashes matched without duplicates for each song
         (key is the song id).
         :param queried_hashes: amount of hashes sent for matching against the db
         :param topn: number of results being returned back.
         :return: a list of dictionaries (based on topn) with match information.
         """
+        if isinstance(matches, tuple):
+            song_ids, offset_differences = matches
+        else:
+            matches = np.asarray(matches, dtype=np.int64).reshape(-1, 2)
+            song_ids, offset_differences = matches[:, 0], matches[:, 1]
+
         # count offset occurrences per song and keep only the maximum ones.
-        sorted_matches = sorted(matches, key=lambda m: (m[0], m[1]))
-        counts = [(*key, len(list(group))) for key, group in groupby(sorted_matches, key=lambda m: (m[0], m[1]))]
-        songs_matches = sorted(
-            [max(list(group), key=lambda g: g[2]) for key, group in groupby(counts, key=lambda count: count[0])],
-            key=lambda count: count[2], reverse=True
-        )
+        songs_matches = best_offsets(song_ids, offset_differences, topn)
+
+        return self.describe_matches(songs_matches, dedup_hashes, queried_hashes, topn)
 
+    def describe_matches(self, songs_matches: List[Tuple[int, int, int]], dedup_hashes: Dict[str, int],
+                         queried_hashes: int, topn: int = TOPN) -> List[Dict[str, any]]:
+        """
+        Builds the match information of the best aligned candidates.
+
+        :param songs_matches: (song id, offset difference, count) of the best candidate of each song,
+         the songs matched the most first.
+        :param dedup_hashes: dictionary containing the hashes matched without duplicates for each song
+        (key is the song id).
+        :param queried_hashes: amount of hashes sent for matching against the db
+        :param topn: number of results being returned back.
+        :return: a list of dictionaries (based on topn) with match information.
+        """
         songs_result = []
         if len(songs_matches) == 0:
             return songs_result
@@ -248,7 +419,7 @@ class Dejavu:
             song_singer = song.get(SONG_SINGER, None)
             song_album = song.get(SONG_ALBUM, None)
             song_public = song.get(SONG_PUBLICTIME, None)
-            nseconds = round(float(offset) / DEFAULT_FS * DEFAULT_WINDOW_SIZE * DEFAULT_OVERLAP_RATIO, 5)
+            nseconds = self.profile.offset_seconds(offset)
             hashes_matched = dedup_hashes[song_id]
 
             song = {
@@ -285,11 +456,15 @@ class Dejavu:
         # Pool.imap sends arguments as tuples so we have to unpack
         # them ourself.
         try:
-            file_name, limit = arguments
+            file_name, limit, fingerprint_format, decoder_backend, channel_strategy, profile = arguments
         except ValueError:
             raise
 
-        fingerprints, file_hash = Dejavu.get_file_fingerprints(file_name, limit, print_output=True)
+        fingerprints, file_hash = Dejavu.get_file_fingerprints(file_name, limit, print_output=True,
+                                                               fingerprint_format=fingerprint_format,
+                                                               decoder_backend=decoder_backend,
+                                                               channel_strategy=channel_strategy,
+                                                               profile=profile)
 
         if info:
             song_name, song_publisher, song_length, song_singer, song_album, song_public = information(file_name)
@@ -298,19 +473,73 @@ class Dejavu:
         return fingerprints, file_hash
 
     @staticmethod
-    def get_file_fingerprints(file_name: str, limit: int, print_output: bool = False):
-        channels, fs, file_hash = decoder.read(file_name, limit)
-        fingerprints = set()
+    def get_file_fingerprints(file_name: str, limit: int, print_output: bool = False,
+                              fingerprint_format: str = FINGERPRINT_FORMAT, decoder_backend: str = DECODER_BACKEND,
+                              channel_strategy: str = CHANNEL_STRATEGY, profile: FingerprintProfile = None):
+        profile = profile or FingerprintProfile.from_config()
+        if decoder_backend == DECODER_BACKEND_FFMPEG:
+            return Dejavu.stream_file_fingerprints(file_name, limit, print_output=print_output,
+                                                   fingerprint_format=fingerprint_format,
+                                                   channel_strategy=channel_strategy, profile=profile)
+
+        channels, fs, file_hash = decoder.read(file_name, limit, backend=decoder_backend, frame_rate=profile.fs)
+        channels = select_channels(channels, channel_strategy)
+        batches = []
         channel_amount = len(channels)
         for channeln, channel in enumerate(channels, start=1):
             if print_output:
                 print(f"Fingerprinting channel {channeln}/{channel_amount} for {file_name}")
 
-            hashes = fingerprint(channel, Fs=fs)
+            batches.append(fingerprint(channel, Fs=fs, fingerprint_format=fingerprint_format, as_batch=True,
+                                       profile=profile))
 
             if print_output:
                 print(f"Finished channel {channeln}/{channel_amount} for {file_name}")
 
-            fingerprints |= set(hashes)
+        # the fingerprints repeated across channels are only kept once.
+        return FingerprintBatch.concatenate(batches, fingerprint_format).unique(), file_hash
 
-        return fingerprints, file_hash
+    @staticmethod
+    def stream_file_fingerprints(file_name: str, limit: int, print_output: bool = False,
+                                 fingerprint_format: str = FINGERPRINT_FORMAT,
+                                 channel_strategy: str = CHANNEL_STRATEGY, profile: FingerprintProfile = None):
+        """
+        Same as get_file_fingerprints but the file is decoded and fingerprinted block by block, so the memory
+        used doesn't depend on the length of the file.
+
+        The loudest channel is only known once the whole file is decoded, so with the "loudest" channel
+        strategy every channel is fingerprinted and only the hashes of the loudest one are kept.
+        """
+        if channel_strategy not in CHANNEL_STRATEGIES:
+            raise TypeError("Unsupported channel strategy supplied.")
+
+        profile = profile or FingerprintProfile.from_config()
+        with decoder.open_stream(file_name, limit=limit, hash_file=True, frame_rate=profile.fs) as stream:
+            if print_output:
+                print(f"Fingerprinting {stream.channels} channels of {file_name} while decoding")
+
+            mid = channel_strategy == CHANNEL_STRATEGY_MID and stream.channels > 1
+            fingerprinters = [StreamingFingerprinter(Fs=stream.frame_rate, fingerprint_format=fingerprint_format,
+                                                     as_batch=True, profile=profile)
+                              for _ in range(1 if mid else stream.channels)]
+            batches = [[] for _ in fingerprinters]
+            energies = np.zeros(len(fingerprinters))
+            for block in stream:
+                if mid:
+                    batches[0].append(fingerprinters[0].feed(downmix(list(block.T))))
+                    continue
+                for channeln, fingerprinter in enumerate(fingerprinters):
+                    batches[channeln].append(fingerprinter.feed(block[:, channeln]))
+                    if channel_strategy == CHANNEL_STRATEGY_LOUDEST:
+                        energies[channeln] += channel_energy(block[:, channeln])
+
+        for channeln, fingerprinter in enumerate(fingerprinters):
+            batches[channeln].append(fingerprinter.flush())
+
+        if print_output:
+            print(f"Finished fingerprinting {file_name}")
+
+        if channel_strategy == CHANNEL_STRATEGY_LOUDEST:
+            batches = [batches[int(np.argmax(energies))]]
+        return FingerprintBatch.concatenate([batch for channel_batches in batches for batch in channel_batches],
+                                            fingerprint_format).unique(), stream.file_hash
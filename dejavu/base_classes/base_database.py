@@ -1,8 +1,16 @@
 import abc
 import importlib
-from typing import Dict, List, Tuple
+from typing import Dict, Iterator, List, Tuple, Type, Union
 
-from dejavu.config.settings import DATABASES
+import numpy as np
+
+from dejavu.config.settings import (CATALOG_CHANNEL_STRATEGY,
+                                    CATALOG_FINGERPRINT_FORMAT,
+                                    CHANNEL_STRATEGY_ALL, DATABASES,
+                                    FINGERPRINT_FORMAT,
+                                    FINGERPRINT_FORMAT_PACKED,
+                                    FINGERPRINT_FORMAT_SHA1)
+from dejavu.logic.fingerprint_profile import FingerprintProfile
 
 
 class BaseDatabase(object, metaclass=abc.ABCMeta):
@@ -10,8 +18,19 @@ class BaseDatabase(object, metaclass=abc.ABCMeta):
     # to refer to your class
     type = None
 
+    # Errors raised when the database can't be reached (as opposed to errors of the request itself),
+    # a replicated database fails over to the next replica on them only.
+    CONNECTION_ERRORS: Tuple[Type[Exception], ...] = ()
+
     def __init__(self):
         super().__init__()
+        # format of the fingerprints this instance stores and queries.
+        self.fingerprint_format = FINGERPRINT_FORMAT
+        # settings the catalog is expected to have been generated with.
+        self.catalog_settings = {CATALOG_FINGERPRINT_FORMAT: FINGERPRINT_FORMAT}
+        # whether the catalog was checked recording the missing settings, or only validated by a read.
+        self._catalog_checked = False
+        self._catalog_validated = False
 
     def before_fork(self) -> None:
         """
@@ -33,6 +52,53 @@ class BaseDatabase(object, metaclass=abc.ABCMeta):
         """
         pass
 
+    def set_fingerprint_format(self, fingerprint_format: str) -> None:
+        """
+        Sets the format of the fingerprints stored and queried by this instance.
+
+        :param fingerprint_format: either "sha1" or "packed".
+        """
+        if fingerprint_format not in (FINGERPRINT_FORMAT_SHA1, FINGERPRINT_FORMAT_PACKED):
+            raise TypeError("Unsupported fingerprint format supplied.")
+
+        self.fingerprint_format = fingerprint_format
+        self.catalog_settings[CATALOG_FINGERPRINT_FORMAT] = fingerprint_format
+
+    def set_catalog_setting(self, setting: str, value: any) -> None:
+        """
+        Sets a setting the catalog is expected to have been generated with, it is validated (or
+        recorded) by the next check_catalog.
+
+        :param setting: name of the setting, one of the CATALOG_* settings.
+        :param value: value of the setting.
+        """
+        self.catalog_settings[setting] = value
+        self._catalog_checked = False
+        self._catalog_validated = False
+
+    def check_catalog(self, record_missing: bool = True) -> None:
+        """
+        Validates the settings recorded in the catalog against the ones of this instance,
+        settings not recorded yet are stored.
+
+        It raises CatalogMismatchError if any of the recorded settings differs.
+
+        :param record_missing: whether the settings not recorded yet are stored, otherwise the catalog is
+         only read and they are left unchecked.
+        """
+        pass
+
+    def validate_catalog(self) -> None:
+        """
+        Validates the settings recorded in the catalog without writing to it, once per instance (until a
+        setting changes). Used by the read paths, so a read only user can recognize and queries don't pay
+        an extra round trip each.
+
+        It raises CatalogMismatchError if any of the recorded settings differs.
+        """
+        if not (self._catalog_checked or self._catalog_validated):
+            self.check_catalog(record_missing=False)
+
     @abc.abstractmethod
     def empty(self) -> None:
         """
@@ -99,7 +165,7 @@ class BaseDatabase(object, metaclass=abc.ABCMeta):
         """
         Inserts a single fingerprint into the database.
 
-        :param fingerprint: Part of a sha1 hash, in hexadecimal format
+        :param fingerprint: Part of a sha1 hash, in hexadecimal format, or a packed hash
         :param song_id: Song identifier this fingerprint is off
         :param offset: The offset this fingerprint is from.
         """
@@ -124,13 +190,23 @@ class BaseDatabase(object, metaclass=abc.ABCMeta):
         """
         pass
 
+    @abc.abstractmethod
+    def import_songs(self, songs: List[Dict[str, any]]) -> None:
+        """
+        Inserts songs read from another database (as get_songs returns them) keeping their identifiers,
+        songs already stored are left untouched.
+
+        :param songs: the songs info, considered fingerprinted unless they have a "fingerprinted" key.
+        """
+        pass
+
     @abc.abstractmethod
     def query(self, fingerprint: str = None) -> List[Tuple]:
         """
         Returns all matching fingerprint entries associated with
         the given hash as parameter, if None is passed it returns all entries.
 
-        :param fingerprint: part of a sha1 hash, in hexadecimal format
+        :param fingerprint: part of a sha1 hash, in hexadecimal format, or a packed hash
         :return: a list of fingerprint records stored in the db.
         """
         pass
@@ -144,6 +220,38 @@ class BaseDatabase(object, metaclass=abc.ABCMeta):
         """
         pass
 
+    @abc.abstractmethod
+    def iterate_fingerprints(self, batch_size: int = 10000) -> Iterator[List[Tuple[Union[str, int], int, int]]]:
+        """
+        Streams all fingerprints in the database, sorted by hash, without loading them all at once.
+
+        :param batch_size: number of fingerprints fetched at a time.
+        :return: an iterator over lists of up to batch_size (hash, song id, offset) tuples.
+        """
+        pass
+
+    def get_frequent_hashes(self, threshold: int) -> Dict[Union[str, int], int]:
+        """
+        Counts the fingerprints of every hash, streaming them sorted by hash, and keeps the frequent ones.
+        Databases able to count them in place override it.
+
+        :param threshold: hashes having more fingerprints than this one are returned.
+        :return: a dictionary with the amount of fingerprints of each frequent hash.
+        """
+        frequent = {}
+        last, count = None, 0
+        for rows in self.iterate_fingerprints():
+            for hsh, _, _ in rows:
+                if hsh == last:
+                    count += 1
+                    continue
+                if count > threshold:
+                    frequent[last] = count
+                last, count = hsh, 1
+        if count > threshold:
+            frequent[last] = count
+        return frequent
+
     @abc.abstractmethod
     def insert_hashes(self, song_id: int, hashes: List[Tuple[str, int]], batch_size: int = 10000) -> None:
         """
@@ -151,21 +259,25 @@ class BaseDatabase(object, metaclass=abc.ABCMeta):
 
         :param song_id: Song identifier the fingerprints belong to
         :param hashes: A sequence of tuples in the format (hash, offset)
-            - hash: Part of a sha1 hash, in hexadecimal format
+            - hash: Part of a sha1 hash, in hexadecimal format, or a packed hash
             - offset: Offset this hash was created from/at.
+          or a FingerprintBatch, which iterates as such tuples.
         :param batch_size: insert batches.
         """
 
     @abc.abstractmethod
-    def return_matches(self, hashes: List[Tuple[str, int]], batch_size: int = 1000) \
-            -> Tuple[List[Tuple[int, int]], Dict[int, int]]:
+    def return_matches(self, hashes: List[Tuple[str, int]], batch_size: int = 1000, as_arrays: bool = False) \
+            -> Tuple[Union[List[Tuple[int, int]], Tuple[np.ndarray, np.ndarray]], Dict[int, int]]:
         """
         Searches the database for pairs of (hash, offset) values.
 
         :param hashes: A sequence of tuples in the format (hash, offset)
-            - hash: Part of a sha1 hash, in hexadecimal format
+            - hash: Part of a sha1 hash, in hexadecimal format, or a packed hash
             - offset: Offset this hash was created from/at.
+          or a FingerprintBatch, which iterates as such tuples.
         :param batch_size: number of query's batches.
+        :param as_arrays: return the matches as two parallel arrays (song ids, offset differences)
+         instead of a list of tuples.
         :return: a list of (sid, offset_difference) tuples and a
         dictionary with the amount of hashes matched (not considering
         duplicated hashes) in each song.
@@ -174,6 +286,22 @@ class BaseDatabase(object, metaclass=abc.ABCMeta):
         """
         pass
 
+    @abc.abstractmethod
+    def return_aligned_matches(self, hashes: List[Tuple[str, int]], topn: int) \
+            -> Tuple[List[Tuple[int, int, int]], Dict[int, int]]:
+        """
+        Searches the database for pairs of (hash, offset) values, aligning the matches in the database.
+
+        :param hashes: A sequence of tuples in the format (hash, offset)
+            - hash: Part of a sha1 hash, in hexadecimal format, or a packed hash
+            - offset: Offset this hash was created from/at.
+        :param topn: number of songs returned.
+        :return: a list of (sid, offset_difference, count) tuples, with the offset difference
+        matched the most times in each of the topn songs matched the most, and a dictionary with
+        the amount of hashes matched (not considering duplicated hashes) in each of those songs.
+        """
+        pass
+
     @abc.abstractmethod
     def delete_songs_by_id(self, song_ids: List[int], batch_size: int = 1000) -> None:
         """
@@ -185,6 +313,22 @@ class BaseDatabase(object, metaclass=abc.ABCMeta):
         pass
 
 
+class CatalogMismatchError(Exception):
+    pass
+
+
+class InitialBuildError(Exception):
+    pass
+
+
+class IndexFileError(Exception):
+    pass
+
+
+class ReadOnlyDatabaseError(Exception):
+    pass
+
+
 def get_database(database_type: str = "mysql") -> BaseDatabase:
     """
     Given a database type it returns a database instance for that type.
@@ -199,3 +343,19 @@ def get_database(database_type: str = "mysql") -> BaseDatabase:
         return db_class
     except (ImportError, KeyError):
         raise TypeError("Unsupported database type supplied.")
+
+
+def legacy_catalog_settings() -> Dict[str, str]:
+    """
+    Settings the fingerprints stored before the catalog recorded them were generated with: the sha1
+    format, every channel, and the "native" profile with the peak finding and hashing settings. A catalog
+    missing some of them while holding fingerprints gets these ones recorded instead of the configured
+    ones, so a different configuration raises CatalogMismatchError.
+
+    :return: a dictionary with the value of each of those catalog settings.
+    """
+    return {
+        CATALOG_FINGERPRINT_FORMAT: FINGERPRINT_FORMAT_SHA1,
+        CATALOG_CHANNEL_STRATEGY: CHANNEL_STRATEGY_ALL,
+        **FingerprintProfile().catalog_settings()
+    }
@@ -4,7 +4,11 @@ from typing import Dict, List, Tuple
 
 import numpy as np
 
-from dejavu.config.settings import DEFAULT_FS
+from dejavu.config.settings import (DEFAULT_FS, MATCH_MODE_SERVER,
+                                    STOP_FINGERPRINTS_SKIPPED,
+                                    STOP_HASHES_PRUNED)
+from dejavu.logic.channels import select_channels
+from dejavu.logic.fingerprint_batch import FingerprintBatch
 
 from dejavu.third_party.dejavu_timer import DejavuTimer
 
@@ -13,23 +17,46 @@ class BaseRecognizer(object, metaclass=abc.ABCMeta):
     def __init__(self, dejavu):
         self.dejavu = dejavu
         self.Fs = DEFAULT_FS
+        # the fingerprint profile and the rest of the settings of the instance have to match the ones the
+        # catalog was generated with, CatalogMismatchError is raised otherwise. The catalog is only read,
+        # once per database instance.
+        self.dejavu.db.validate_catalog()
+        # stop hashes pruned from the last query.
+        self.pruning = {STOP_HASHES_PRUNED: 0, STOP_FINGERPRINTS_SKIPPED: 0}
 
     @DejavuTimer(name=__name__ + "._recognize()\t\t\t")
     def _recognize(self, *data) -> Tuple[List[Dict[str, any]], int, int, int]:
         fingerprint_times = []
-        hashes = set()  # to remove possible duplicated fingerprints we built a set.
+        batches = []
 
         with (DejavuTimer(name=__name__ + "._recognize() - for channel...\t")):
-              for channel in data:
-                    fingerprints, fingerprint_time = self.dejavu.generate_fingerprints(channel, Fs=self.Fs)
+              # the same channels the songs were fingerprinted from.
+              for channel in select_channels(data, self.dejavu.channel_strategy):
+                    fingerprints, fingerprint_time = self.dejavu.generate_fingerprints(channel, Fs=self.Fs,
+                                                                                       as_batch=True)
                     fingerprint_times.append(fingerprint_time)
-                    hashes |= set(fingerprints)
+                    batches.append(fingerprints)
 
-        matches, dedup_hashes, query_time = self.dejavu.find_matches(hashes)
+        # to remove possible duplicated fingerprints across channels.
+        hashes = FingerprintBatch.concatenate(batches, self.dejavu.fingerprint_format).unique()
 
-        t = time()
-        final_results = self.dejavu.align_matches(matches, dedup_hashes, len(hashes))
-        align_time = time() - t
+        queried_hashes = len(hashes)
+        if self.dejavu.stop_hashes is not None:
+            hashes, self.pruning = self.dejavu.stop_hashes.prune(hashes)
+
+        if self.dejavu.match_mode == MATCH_MODE_SERVER:
+            # the matches come back already aligned.
+            songs_matches, dedup_hashes, query_time = self.dejavu.find_aligned_matches(hashes)
+
+            t = time()
+            final_results = self.dejavu.describe_matches(songs_matches, dedup_hashes, queried_hashes)
+            align_time = time() - t
+        else:
+            matches, dedup_hashes, query_time = self.dejavu.find_matches(hashes)
+
+            t = time()
+            final_results = self.dejavu.align_matches(matches, dedup_hashes, queried_hashes)
+            align_time = time() - t
 
         return final_results, np.sum(fingerprint_times), query_time, align_time
 
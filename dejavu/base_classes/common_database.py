@@ -1,7 +1,21 @@
 import abc
-from typing import Dict, List, Tuple
-
-from dejavu.base_classes.base_database import BaseDatabase
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+
+import numpy as np
+
+from dejavu.base_classes.base_database import (BaseDatabase,
+                                               CatalogMismatchError,
+                                               InitialBuildError,
+                                               legacy_catalog_settings)
+from dejavu.config.settings import (FIELD_ALBUM, FIELD_FILE_SHA1,
+                                    FIELD_FINGERPRINTED, FIELD_PUBLICTIME,
+                                    FIELD_PUBLISHER, FIELD_SINGER,
+                                    FIELD_SONG_ID, FIELD_SONG_LENGTH,
+                                    FIELD_SONGNAME, FIELD_TOTAL_HASHES,
+                                    FINGERPRINT_FORMAT_PACKED,
+                                    FINGERPRINT_FORMAT_SHA1,
+                                    INITIAL_BUILD_PARALLEL_WORKERS)
+from dejavu.logic.alignment import expand_matches
 
 from dejavu.third_party.dejavu_timer import DejavuTimer
 
@@ -11,8 +25,14 @@ class CommonDatabase(BaseDatabase, metaclass=abc.ABCMeta):
     # I've built this class with the idea to reuse that logic instead of copy pasting
     # over and over the same code.
 
+    # Statements overridden when the packed fingerprint format is in use,
+    # the key is the name of the statement they replace.
+    PACKED_STATEMENTS = {}
+
     def __init__(self):
         super().__init__()
+        # whether insert_hashes goes through the bulk load path.
+        self.bulk_load = False
 
     def before_fork(self) -> None:
         """
@@ -38,6 +58,116 @@ class CommonDatabase(BaseDatabase, metaclass=abc.ABCMeta):
             cur.execute(self.CREATE_FINGERPRINTS_TABLE)
             cur.execute(self.DELETE_UNFINGERPRINTED)
 
+        self.check_catalog()
+
+    def set_fingerprint_format(self, fingerprint_format: str) -> None:
+        """
+        Sets the format of the fingerprints stored and queried by this instance.
+
+        :param fingerprint_format: either "sha1" or "packed".
+        """
+        super().set_fingerprint_format(fingerprint_format)
+
+        for name, statement in self.PACKED_STATEMENTS.items():
+            if fingerprint_format == FINGERPRINT_FORMAT_PACKED:
+                setattr(self, name, statement)
+            else:
+                # go back to the class level (sha1) statement.
+                self.__dict__.pop(name, None)
+
+        self._catalog_checked = False
+        self._catalog_validated = False
+
+    def check_catalog(self, record_missing: bool = True) -> None:
+        """
+        Validates the settings recorded in the catalog against the ones of this instance,
+        settings not recorded yet are stored.
+
+        It raises CatalogMismatchError if any of the recorded settings differs.
+
+        :param record_missing: whether the settings not recorded yet are stored, otherwise the catalog is
+         only read (with a single SELECT, the table has to exist, setup() creates it) and they are left
+         unchecked.
+        """
+        with self.cursor() as cur:
+            if record_missing:
+                cur.execute(self.CREATE_CATALOG_TABLE)
+            cur.execute(self.SELECT_CATALOG)
+            recorded = dict(cur.fetchall())
+
+        missing = {setting: str(value) for setting, value in self.catalog_settings.items() if setting not in recorded}
+
+        legacy = legacy_catalog_settings()
+        if record_missing and any(setting in legacy for setting in missing):
+            with self.cursor() as cur:
+                cur.execute(self.SELECT_ANY_FINGERPRINT)
+                if cur.fetchone() is not None:
+                    # fingerprints stored before the catalog recorded a setting were generated with its legacy value.
+                    missing.update({setting: legacy[setting] for setting in missing if setting in legacy})
+
+        if missing and record_missing:
+            with self.cursor() as cur:
+                cur.executemany(self.INSERT_CATALOG_SETTING, list(missing.items()))
+                cur.execute(self.SELECT_CATALOG)
+                recorded = dict(cur.fetchall())
+
+        mismatches = [
+            f"{setting}: catalog has '{recorded[setting]}' but '{value}' is configured"
+            for setting, value in self.catalog_settings.items() if recorded.get(setting, str(value)) != str(value)
+        ]
+        if mismatches:
+            raise CatalogMismatchError(f"Catalog settings mismatch ({', '.join(mismatches)}).")
+
+        if record_missing:
+            self._catalog_checked = True
+        self._catalog_validated = True
+
+    def begin_initial_build(self) -> None:
+        """
+        Starts an initial build of the catalog: the fingerprints table is (re)created without its unique
+        constraint, foreign key and hash index, so inserts don't pay for their maintenance. Inserts keep
+        working as usual, finish_initial_build must be called once all of them are done.
+
+        It raises InitialBuildError if the fingerprints table isn't empty.
+        """
+        with self.cursor() as cur:
+            cur.execute(self.CREATE_SONGS_TABLE)
+            cur.execute(self.CREATE_FINGERPRINTS_TABLE_UNINDEXED)
+            cur.execute(self.SELECT_ANY_FINGERPRINT)
+            if cur.fetchone() is not None:
+                raise InitialBuildError("An initial build requires an empty fingerprints table.")
+
+            # the table may have been created with its indexes by setup(), being empty it's safe to recreate it.
+            cur.execute(self.DROP_FINGERPRINTS)
+            cur.execute(self.CREATE_FINGERPRINTS_TABLE_UNINDEXED)
+            cur.execute(self.DELETE_UNFINGERPRINTED)
+
+        self.check_catalog()
+
+    @DejavuTimer(name=__name__ + ".finish_initial_build()\t\t\t")
+    def finish_initial_build(self, parallel_workers: int = INITIAL_BUILD_PARALLEL_WORKERS) -> None:
+        """
+        Ends an initial build started with begin_initial_build. Duplicated fingerprints and the ones of
+        songs no longer stored are removed in a single pass, then the unique constraint, foreign key and
+        hash index are built over the whole table, leaving it with the same schema setup() creates.
+
+        :param parallel_workers: workers the database may use to build the indexes.
+        """
+        with self.cursor() as cur:
+            cur.execute(self.DELETE_UNFINGERPRINTED)
+            self.set_parallel_maintenance(cur, parallel_workers)
+            for statement in self.FINISH_INITIAL_BUILD:
+                cur.execute(statement)
+
+    def set_parallel_maintenance(self, cur, workers: int) -> None:
+        """
+        Sets the amount of workers the session may use to build indexes.
+
+        :param cur: an open cursor, the setting applies to its session.
+        :param workers: amount of workers.
+        """
+        cur.execute(self.SET_PARALLEL_MAINTENANCE, (workers,))
+
     def empty(self) -> None:
         """
         Called when the database should be cleared of all data.
@@ -45,6 +175,7 @@ class CommonDatabase(BaseDatabase, metaclass=abc.ABCMeta):
         with self.cursor() as cur:
             cur.execute(self.DROP_FINGERPRINTS)
             cur.execute(self.DROP_SONGS)
+            cur.execute(self.DROP_CATALOG)
 
         self.setup()
 
@@ -140,7 +271,7 @@ class CommonDatabase(BaseDatabase, metaclass=abc.ABCMeta):
         """
         Inserts a single fingerprint into the database.
 
-        :param fingerprint: Part of a sha1 hash, in hexadecimal format
+        :param fingerprint: Part of a sha1 hash, in hexadecimal format, or a packed hash
         :param song_id: Song identifier this fingerprint is off
         :param offset: The offset this fingerprint is from.
         """
@@ -166,12 +297,28 @@ class CommonDatabase(BaseDatabase, metaclass=abc.ABCMeta):
         """
         pass
 
+    def import_songs(self, songs: List[Dict[str, any]]) -> None:
+        """
+        Inserts songs read from another database (as get_songs returns them) keeping their identifiers,
+        songs already stored are left untouched.
+
+        :param songs: the songs info, considered fingerprinted unless they have a "fingerprinted" key.
+        """
+        values = [
+            (song[FIELD_SONG_ID], song[FIELD_SONGNAME], song.get(FIELD_FINGERPRINTED, 1), song[FIELD_FILE_SHA1],
+             song.get(FIELD_TOTAL_HASHES, 0), song.get(FIELD_PUBLISHER, ''), song.get(FIELD_SONG_LENGTH, 0),
+             song.get(FIELD_SINGER, ''), song.get(FIELD_ALBUM, ''), song.get(FIELD_PUBLICTIME, ''))
+            for song in songs
+        ]
+        with self.cursor() as cur:
+            cur.executemany(self.IMPORT_SONG, values)
+
     def query(self, fingerprint: str = None) -> List[Tuple]:
         """
         Returns all matching fingerprint entries associated with
         the given hash as parameter, if None is passed it returns all entries.
 
-        :param fingerprint: part of a sha1 hash, in hexadecimal format
+        :param fingerprint: part of a sha1 hash, in hexadecimal format, or a packed hash
         :return: a list of fingerprint records stored in the db.
         """
         with self.cursor() as cur:
@@ -189,70 +336,217 @@ class CommonDatabase(BaseDatabase, metaclass=abc.ABCMeta):
         """
         return self.query(None)
 
+    def iterate_fingerprints(self, batch_size: int = 10000) -> Iterator[List[Tuple[Union[str, int], int, int]]]:
+        """
+        Streams all fingerprints in the database, sorted by hash, without loading them all at once.
+
+        :param batch_size: number of fingerprints fetched at a time.
+        :return: an iterator over lists of up to batch_size (hash, song id, offset) tuples.
+        """
+        with self.cursor(server_side=True) as cur:
+            cur.execute(self.SELECT_ALL_ORDERED)
+            rows = cur.fetchmany(batch_size)
+            while rows:
+                yield rows
+                rows = cur.fetchmany(batch_size)
+
+    def get_frequent_hashes(self, threshold: int) -> Dict[Union[str, int], int]:
+        """
+        Counts the fingerprints of every hash in the database and keeps the frequent ones.
+
+        :param threshold: hashes having more fingerprints than this one are returned.
+        :return: a dictionary with the amount of fingerprints of each frequent hash.
+        """
+        with self.cursor() as cur:
+            cur.execute(self.SELECT_FREQUENT_HASHES, (threshold,))
+            return {hsh: count for hsh, count in cur}
+
     def insert_hashes(self, song_id: int, hashes: List[Tuple[str, int]], batch_size: int = 10000) -> None:
         """
         Insert a multitude of fingerprints.
 
         :param song_id: Song identifier the fingerprints belong to
         :param hashes: A sequence of tuples in the format (hash, offset)
-            - hash: Part of a sha1 hash, in hexadecimal format
+            - hash: Part of a sha1 hash, in hexadecimal format, or a packed hash
             - offset: Offset this hash was created from/at.
         :param batch_size: insert batches.
         """
+        if self.bulk_load:
+            self.bulk_insert_hashes([(song_id, hashes)])
+            return
+
+        if not self._catalog_checked:
+            self.check_catalog()
+
         values = [(song_id, hsh, int(offset)) for hsh, offset in hashes]
 
         with self.cursor() as cur:
             for index in range(0, len(hashes), batch_size):
                 cur.executemany(self.INSERT_FINGERPRINT, values[index: index + batch_size])
 
+    @DejavuTimer(name=__name__ + ".bulk_insert_hashes()\t\t\t")
+    def bulk_insert_hashes(self, songs_hashes: List[Tuple[int, List[Tuple[str, int]]]]) -> None:
+        """
+        Inserts the fingerprints of one or more songs through the bulk load facility of the database.
+        All of them are loaded into a temporary staging table and then merged into the fingerprints
+        table with a single statement (ignoring duplicates), instead of going through one parameterized
+        insert per fingerprint.
+
+        :param songs_hashes: A sequence of tuples in the format (song_id, hashes)
+            - song_id: Song identifier the fingerprints belong to
+            - hashes: A sequence of tuples in the format (hash, offset)
+        """
+        if not self._catalog_checked:
+            self.check_catalog()
+
+        rows = ((song_id, hsh, int(offset)) for song_id, hashes in songs_hashes for hsh, offset in hashes)
+
+        with self.cursor() as cur:
+            # a connection reused from a pool may still hold the staging table of a failed load.
+            cur.execute(self.DROP_FINGERPRINTS_STAGING)
+            cur.execute(self.CREATE_FINGERPRINTS_STAGING)
+            self.load_staging(cur, rows)
+            cur.execute(self.MERGE_FINGERPRINTS_STAGING)
+            cur.execute(self.DROP_FINGERPRINTS_STAGING)
+
+    @abc.abstractmethod
+    def load_staging(self, cur, rows: Iterable[Tuple[int, str, int]]) -> None:
+        """
+        Bulk loads fingerprints into the staging table.
+
+        :param cur: an open cursor, the staging table exists and is empty.
+        :param rows: A sequence of tuples in the format (song_id, hash, offset)
+        """
+        pass
+
     @DejavuTimer(name=__name__ + ".return_matches()\t\t\t")
-    def return_matches(self, hashes: List[Tuple[str, int]],
-                       batch_size: int = 1000) -> Tuple[List[Tuple[int, int]], Dict[int, int]]:
+    def return_matches(self, hashes: List[Tuple[str, int]], batch_size: int = 1000, as_arrays: bool = False) \
+            -> Tuple[Union[List[Tuple[int, int]], Tuple[np.ndarray, np.ndarray]], Dict[int, int]]:
         """
         Searches the database for pairs of (hash, offset) values.
 
         :param hashes: A sequence of tuples in the format (hash, offset)
-            - hash: Part of a sha1 hash, in hexadecimal format
+            - hash: Part of a sha1 hash, in hexadecimal format, or a packed hash
             - offset: Offset this hash was created from/at.
         :param batch_size: number of query's batches.
+        :param as_arrays: return the matches as two parallel arrays (song ids, offset differences)
+         instead of a list of tuples.
         :return: a list of (sid, offset_difference) tuples and a
         dictionary with the amount of hashes matched (not considering
         duplicated hashes) in each song.
             - song id: Song identifier
             - offset_difference: (database_offset - sampled_offset)
         """
+        self.validate_catalog()
+
+        # sha1 hashes come back from the database in upper case, packed ones as plain integers.
+        normalize = str.upper if self.fingerprint_format == FINGERPRINT_FORMAT_SHA1 else int
+
         # Create a dictionary of hash => offset pairs for later lookups
         mapper = {}
         for hsh, offset in hashes:
-            if hsh.upper() in mapper.keys():
-                mapper[hsh.upper()].append(offset)
+            hsh = normalize(hsh)
+            if hsh in mapper.keys():
+                mapper[hsh].append(offset)
             else:
-                mapper[hsh.upper()] = [offset]
+                mapper[hsh] = [offset]
 
         values = list(mapper.keys())
 
+        if as_arrays:
+            with self.cursor() as cur:
+                rows = self.select_matches(cur, values, batch_size)
+            return self._matches_as_arrays(mapper, rows)
+
         # in order to count each hash only once per db offset we use the dic below
         dedup_hashes = {}
 
         results = []
         with self.cursor() as cur:
-            for index in range(0, len(values), batch_size):
-                # Create our IN part of the query
-                query = self.SELECT_MULTIPLE % (', '.join([self.IN_MATCH] * len(values[index: index + batch_size])))
-                cur.execute(query, values[index: index + batch_size])
+            for hsh, sid, offset in self.select_matches(cur, values, batch_size):
+                if sid not in dedup_hashes.keys():
+                    dedup_hashes[sid] = 1
+                else:
+                    dedup_hashes[sid] += 1
+                #  we now evaluate all offset for each  hash matched
+                for song_sampled_offset in mapper[hsh]:
+                    results.append((sid, offset - song_sampled_offset))
 
-                cur_rows = cur.fetchall()
+            return results, dedup_hashes
 
-                for hsh, sid, offset in cur_rows:
-                    if sid not in dedup_hashes.keys():
-                        dedup_hashes[sid] = 1
-                    else:
-                        dedup_hashes[sid] += 1
-                    #  we now evaluate all offset for each  hash matched
-                    for song_sampled_offset in mapper[hsh]:
-                        results.append((sid, offset - song_sampled_offset))
+    @staticmethod
+    def _matches_as_arrays(mapper: Dict[Union[str, int], List[int]], rows: Iterable[Tuple[Union[str, int], int, int]]) \
+            -> Tuple[Tuple[np.ndarray, np.ndarray], Dict[int, int]]:
+        index = {hsh: i for i, hsh in enumerate(mapper)}
 
-            return results, dedup_hashes
+        rows = list(rows)
+        hashes = np.fromiter((index[hsh] for hsh, _, _ in rows), dtype=np.int64, count=len(rows))
+        sids = np.fromiter((sid for _, sid, _ in rows), dtype=np.int64, count=len(rows))
+        offsets = np.fromiter((offset for _, _, offset in rows), dtype=np.int64, count=len(rows))
+
+        return expand_matches(hashes, sids, offsets, list(mapper.values()))
+
+    def select_matches(self, cur, hashes: List[str], batch_size: int = 1000) -> Iterable[Tuple[str, int, int]]:
+        """
+        Selects the fingerprints having any of the given hashes, in batches of IN queries.
+        Databases able to bind all the hashes at once override it.
+
+        :param cur: an open cursor.
+        :param hashes: the distinct hashes searched.
+        :param batch_size: number of hashes per query.
+        :return: the (hash, song id, offset) of every fingerprint matched.
+        """
+        rows = []
+        for index in range(0, len(hashes), batch_size):
+            # Create our IN part of the query
+            query = self.SELECT_MULTIPLE % (', '.join([self.IN_MATCH] * len(hashes[index: index + batch_size])))
+            cur.execute(query, hashes[index: index + batch_size])
+            rows.extend(cur.fetchall())
+        return rows
+
+    @DejavuTimer(name=__name__ + ".return_aligned_matches()\t\t")
+    def return_aligned_matches(self, hashes: List[Tuple[str, int]],
+                               topn: int) -> Tuple[List[Tuple[int, int, int]], Dict[int, int]]:
+        """
+        Searches the database for pairs of (hash, offset) values, counting the matches of every
+        (song, offset difference) in the database so only the best candidates cross the wire.
+
+        :param hashes: A sequence of tuples in the format (hash, offset)
+            - hash: Part of a sha1 hash, in hexadecimal format, or a packed hash
+            - offset: Offset this hash was created from/at.
+        :param topn: number of songs returned.
+        :return: a list of (sid, offset_difference, count) tuples, with the offset difference
+        matched the most times (the lowest one on ties) in each of the topn songs matched the most,
+        and a dictionary with the amount of hashes matched (not considering duplicated hashes) in
+        each of those songs.
+        """
+        self.validate_catalog()
+
+        normalize = str.upper if self.fingerprint_format == FINGERPRINT_FORMAT_SHA1 else int
+        pairs = list({(normalize(hsh), int(offset)) for hsh, offset in hashes})
+
+        songs_matches = []
+        dedup_hashes = {}
+        with self.cursor() as cur:
+            for sid, offset_difference, count, hashes_matched in self.select_aligned_matches(cur, pairs, topn):
+                songs_matches.append((sid, int(offset_difference), int(count)))
+                dedup_hashes[sid] = int(hashes_matched)
+
+        return songs_matches, dedup_hashes
+
+    @abc.abstractmethod
+    def select_aligned_matches(self, cur, hashes: List[Tuple[str, int]],
+                               topn: int) -> Iterable[Tuple[int, int, int, int]]:
+        """
+        Aligns the fingerprints matching the given (hash, offset) pairs in the database.
+
+        :param cur: an open cursor.
+        :param hashes: the distinct (hash, offset) pairs of the query.
+        :param topn: number of songs returned.
+        :return: the (song id, offset difference, count, hashes matched) of the best candidate of each
+         of the topn songs, the songs matched the most (the lowest id on ties) first.
+        """
+        pass
 
     def delete_songs_by_id(self, song_ids: List[int], batch_size: int = 1000) -> None:
         """
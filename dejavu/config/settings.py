@@ -22,6 +22,11 @@ INPUT_HASHES = 'input_total_hashes'
 # Percentage regarding hashes matched vs hashes from the input.
 INPUT_CONFIDENCE = 'input_confidence'
 
+# Distinct hashes of the input skipped for being stop hashes.
+STOP_HASHES_PRUNED = 'stop_hashes_pruned'
+# Fingerprints of the stop hashes skipped, the matches the database didn't have to return.
+STOP_FINGERPRINTS_SKIPPED = 'stop_fingerprints_skipped'
+
 TOTAL_TIME = 'total_time'
 FINGERPRINT_TIME = 'fingerprint_time'
 QUERY_TIME = 'query_time'
@@ -32,9 +37,95 @@ OFFSET_SECS = 'offset_seconds'
 # DATABASE CLASS INSTANCES:
 DATABASES = {
     'mysql': ("dejavu.database_handler.mysql_database", "MySQLDatabase"),
-    'postgres': ("dejavu.database_handler.postgres_database", "PostgreSQLDatabase")
+    'postgres': ("dejavu.database_handler.postgres_database", "PostgreSQLDatabase"),
+    'memory': ("dejavu.database_handler.memory_database", "MemoryDatabase"),
+    'mmap': ("dejavu.database_handler.mmap_database", "MmapDatabase"),
+    'sqlite': ("dejavu.database_handler.sqlite_database", "SQLiteDatabase"),
+    'sharded': ("dejavu.database_handler.sharded_database", "ShardedDatabase"),
+    'replicated': ("dejavu.database_handler.replicated_database", "ReplicatedDatabase")
 }
 
+# DATABASE CONNECTION POOL:
+# Connections each database instance keeps open and shares between its threads
+# (overridden through the "pool_size" database option).
+DATABASE_POOL_SIZE = 8
+
+# Seconds a connection can stay idle in the pool before being closed
+# (overridden through the "pool_max_idle" database option).
+DATABASE_POOL_MAX_IDLE = 300
+
+# Seconds a connection can stay idle in the pool before being checked when handed out.
+DATABASE_POOL_CHECK_INTERVAL = 30
+
+# SQLITE DATABASE:
+# Bytes per page of new database files (overridden through the "page_size" database option),
+# larger pages than the 4096 default make the wide fingerprints key shallower.
+SQLITE_PAGE_SIZE = 8192
+
+# Bytes of the database file read through memory mapping (overridden through the "mmap_size" database option),
+# the pages are then shared between the connections and processes reading it.
+SQLITE_MMAP_SIZE = 1 << 30
+
+# Kibibytes of page cache of each connection (overridden through the "cache_size" database option).
+SQLITE_CACHE_SIZE = 65536
+
+# Seconds a statement waits for the lock held by another writer (overridden through the "busy_timeout"
+# database option).
+SQLITE_BUSY_TIMEOUT = 30
+
+# SHARDED DATABASE:
+# Fingerprints read at a time from the database the fingerprints are resharded from.
+RESHARD_BATCH_SIZE = 100000
+
+# READ REPLICAS:
+# Seconds a read replica failing a read is left out of the rotation before being probed again
+# (overridden through the "replica_retry_interval" config key).
+REPLICA_RETRY_INTERVAL = 30
+
+# Seconds the reads go to the primary after a write, so they see it despite the replication lag
+# (overridden through the "read_your_writes" config key), 0 disables it.
+REPLICA_READ_YOUR_WRITES = 0
+
+# STOP HASHES:
+# Hashes having more fingerprints than this threshold are skipped when querying (overridden through the
+# "threshold" key of the "stop_hashes" config).
+STOP_HASH_THRESHOLD = 1000
+
+# DECODER BACKENDS:
+# "pydub" loads the whole decoded file in memory.
+# "ffmpeg" runs ffmpeg as a subprocess and reads raw PCM blocks from its output pipe, files are
+# fingerprinted block by block as they get decoded.
+DECODER_BACKEND_PYDUB = "pydub"
+DECODER_BACKEND_FFMPEG = "ffmpeg"
+DECODER_BACKEND = DECODER_BACKEND_PYDUB
+
+# Number of frames (one sample per channel) in each block read from ffmpeg.
+DECODER_BLOCK_FRAMES = 2 ** 16
+
+# INGESTION PIPELINE:
+# Number of threads storing fingerprinted files in the database, sharing its connection pool.
+INGESTION_WRITERS = 2
+
+# Number of fingerprinted files that can wait for a writer. Together with the number of processes,
+# it bounds the files in flight, processes wait for a free slot once it is reached.
+INGESTION_QUEUE_SIZE = 8
+
+# Seconds between ingestion throughput reports.
+INGESTION_REPORT_INTERVAL = 10
+
+# INITIAL BUILD:
+# Workers the database may use to build the fingerprints indexes at the end of an initial build
+# (max_parallel_maintenance_workers on PostgreSQL, innodb_ddl_threads on MySQL 8.0.27+).
+INITIAL_BUILD_PARALLEL_WORKERS = 4
+
+# INDEX FILE:
+# Seconds between checks of whether the index file opened by the "mmap" database was replaced
+# (overridden through the "check_interval" database option).
+INDEX_FILE_CHECK_INTERVAL = 5
+
+# Fingerprints read at a time from the database an index file is exported from.
+INDEX_FILE_EXPORT_BATCH_SIZE = 100000
+
 # TABLE SONGS
 SONGS_TABLENAME = "songs"
 
@@ -57,6 +148,57 @@ FINGERPRINTS_TABLENAME = "fingerprints"
 FIELD_HASH = 'hash'
 FIELD_OFFSET = 'offset'
 
+# TABLE FINGERPRINTS STAGING
+# Temporary table fingerprints are bulk loaded into (enabled through the "bulk_load" database option)
+# before being merged into the fingerprints table.
+FINGERPRINTS_STAGING_TABLENAME = "fingerprints_staging"
+
+# TABLE FINGERPRINTS QUERY
+# Temporary table the hashes of a query are inserted into to be joined with the fingerprints (MySQL only).
+FINGERPRINTS_QUERY_TABLENAME = "fingerprints_query"
+
+# TABLE FINGERPRINTS REBUILD
+# Table the fingerprints are deduplicated into at the end of an initial build (MySQL only),
+# it replaces the fingerprints table once filled.
+FINGERPRINTS_REBUILD_TABLENAME = "fingerprints_rebuild"
+
+# TABLE CATALOG
+# Keeps the settings the stored fingerprints were generated with, so a database
+# can't be filled or queried with incompatible fingerprints.
+CATALOG_TABLENAME = "catalog"
+
+# CATALOG FIELDS
+FIELD_SETTING = 'setting'
+FIELD_VALUE = 'value'
+
+# CATALOG SETTINGS
+CATALOG_FINGERPRINT_FORMAT = 'fingerprint_format'
+CATALOG_CHANNEL_STRATEGY = 'channel_strategy'
+CATALOG_SAMPLE_RATE = 'sample_rate'
+CATALOG_WINDOW_SIZE = 'window_size'
+CATALOG_OVERLAP_RATIO = 'overlap_ratio'
+CATALOG_FAN_VALUE = 'fan_value'
+CATALOG_AMP_MIN = 'amp_min'
+CATALOG_PEAK_NEIGHBORHOOD_SIZE = 'peak_neighborhood_size'
+CATALOG_CONNECTIVITY_MASK = 'connectivity_mask'
+CATALOG_FINGERPRINT_REDUCTION = 'fingerprint_reduction'
+CATALOG_PEAK_SORT = 'peak_sort'
+CATALOG_HASH_TIME_DELTA = 'hash_time_delta'
+# Position of a shard among the shards of a "sharded" database, as "index/amount".
+CATALOG_SHARD = 'shard'
+
+# TABLE FILE HASHES
+# Local SQLite cache (enabled through the "hash_cache" config key) mapping a file path, size,
+# modification time and inode to the SHA1 of its contents, so unchanged files aren't read again
+# to find out whether they were already fingerprinted.
+FILE_HASHES_TABLENAME = "file_hashes"
+
+# FILE HASHES FIELDS
+FIELD_PATH = 'path'
+FIELD_SIZE = 'size'
+FIELD_MTIME = 'mtime_ns'
+FIELD_INODE = 'inode'
+
 # FINGERPRINTS CONFIG:
 # This is used as connectivity parameter for scipy.generate_binary_structure function. This parameter
 # changes the morphology mask when looking for maximum peaks on the spectrogram matrix.
@@ -78,6 +220,29 @@ DEFAULT_WINDOW_SIZE = 4096
 # matching, but potentially more fingerprints.
 DEFAULT_OVERLAP_RATIO = 0.5
 
+# Fingerprint profiles, the sampling rate audio is resampled to (when decoding it) before being
+# fingerprinted, and the FFT window size and overlap ratio used at that rate. Offsets are converted
+# to seconds with them. A sampling rate of None keeps the rate of every file ("native"), offsets
+# are then converted assuming DEFAULT_FS. Peaks above the Nyquist frequency of the rate (half of it)
+# are lost, in exchange the decoding and FFT work per second of audio drops with the rate: 1024 samples
+# windows at 11025 Hz have the time and frequency resolution of DEFAULT_WINDOW_SIZE at 44100 Hz.
+# Profiles are chosen through the "fingerprint_profile" config key, by name or as a dictionary with
+# the "fs", "window_size" and "overlap_ratio" keys, together with any of the peak finding and hashing
+# parameters below ("fan_value", "amp_min", "peak_neighborhood_size", "connectivity_mask",
+# "fingerprint_reduction", "peak_sort", "min_hash_time_delta" and "max_hash_time_delta") and the name of
+# the "profile" they start from. Parameters not given take the values of this module. The profile in
+# use is recorded in the catalog table.
+FINGERPRINT_PROFILES = {
+    "native": {"fs": None, "window_size": DEFAULT_WINDOW_SIZE, "overlap_ratio": DEFAULT_OVERLAP_RATIO},
+    "11k": {"fs": 11025, "window_size": 1024, "overlap_ratio": 0.5},
+    "16k": {"fs": 16000, "window_size": 1024, "overlap_ratio": 0.5}
+}
+FINGERPRINT_PROFILE = "native"
+
+# Floating point type the spectrogram is computed with, "float32" or "float64".
+# float32 halves the memory and is faster, while keeping the spectrogram peaks stable.
+SPECTROGRAM_DTYPE = "float32"
+
 # Degree to which a fingerprint can be paired with its neighbors. Higher values will
 # cause more fingerprints, but potentially better accuracy.
 DEFAULT_FAN_VALUE = 5  # 15 was the original value.
@@ -109,5 +274,37 @@ PEAK_SORT = True
 # with potentially lesser collisions of matches.
 FINGERPRINT_REDUCTION = 20
 
+# Fingerprint formats:
+# "sha1" is the original format, the first FINGERPRINT_REDUCTION hexadecimal characters of the SHA1 of
+# "freq1|freq2|t_delta", stored as binary in the database.
+# "packed" stores the (freq1, freq2, t_delta) triple directly in a 64 bits integer, avoiding both the SHA1
+# computation and any hex conversion, and it is stored as a BIGINT in the database.
+# Both formats are incompatible between them, the one in use is recorded in the catalog table.
+FINGERPRINT_FORMAT_SHA1 = "sha1"
+FINGERPRINT_FORMAT_PACKED = "packed"
+FINGERPRINT_FORMAT = FINGERPRINT_FORMAT_SHA1
+
+# Channel strategies, which channels of an audio get fingerprinted, both when fingerprinting and
+# when recognizing. The one in use is recorded in the catalog table.
+# "all" fingerprints every channel independently and joins their hashes.
+# "mid" fingerprints the mid (average of all channels) downmix only.
+# "loudest" fingerprints the channel with the most energy only.
+CHANNEL_STRATEGY_ALL = "all"
+CHANNEL_STRATEGY_MID = "mid"
+CHANNEL_STRATEGY_LOUDEST = "loudest"
+CHANNEL_STRATEGY = CHANNEL_STRATEGY_ALL
+
+# Number of bits given to each member of the packed (freq1, freq2, t_delta) triple. 3 * 21 = 63 bits,
+# so the packed value always fits a signed BIGINT column.
+PACKED_FIELD_BITS = 21
+
 # Number of results being returned for file recognition
 TOPN = 2
+
+# Match modes:
+# "client" fetches every fingerprint matching the query hashes and aligns their offsets in Python.
+# "server" sends the query (hash, offset) pairs to the database, which aligns the offsets and only
+# returns the best offset of the TOPN songs matched.
+MATCH_MODE_CLIENT = "client"
+MATCH_MODE_SERVER = "server"
+MATCH_MODE = MATCH_MODE_CLIENT
@@ -0,0 +1,202 @@
+import os
+import threading
+from collections import deque
+from time import time
+from typing import Any, Callable, Dict
+
+from dejavu.config.settings import (DATABASE_POOL_CHECK_INTERVAL,
+                                    DATABASE_POOL_MAX_IDLE,
+                                    DATABASE_POOL_SIZE)
+
+
+class ConnectionPool(object):
+    """
+    Thread-safe pool of database connections, shared by all the cursors of a database instance.
+
+    - at most `size` connections are open at once, checkouts wait for one to be released beyond that.
+    - the most recently released connection is handed out first, so the ones left over after a burst
+    stay idle and get closed once idle longer than `max_idle` seconds.
+    - connections idle longer than `check_interval` seconds are checked with `is_alive` before being
+    handed out, dead ones are replaced by new connections.
+    - the pool is fork-aware: a process other than the one which created it never gets the inherited
+    connections, it starts from an empty pool (reset() does it explicitly, e.g. from after_fork).
+
+    # Use as:
+    pool = ConnectionPool(lambda: driver.connect(**options), is_alive)
+    conn = pool.acquire()
+    try:
+        ...
+    finally:
+        pool.release(conn)
+    """
+    def __init__(self, connect: Callable[[], Any], is_alive: Callable[[Any], bool],
+                 size: int = DATABASE_POOL_SIZE, max_idle: float = DATABASE_POOL_MAX_IDLE,
+                 check_interval: float = DATABASE_POOL_CHECK_INTERVAL):
+        """
+        :param connect: function returning a new connection.
+        :param is_alive: function telling whether a connection is still usable.
+        :param size: maximum amount of connections open at once.
+        :param max_idle: seconds a connection can stay idle in the pool before being closed.
+        :param check_interval: seconds a connection can stay idle before being checked on checkout.
+        """
+        super().__init__()
+        self.connect = connect
+        self.is_alive = is_alive
+        self.size = max(size, 1)
+        self.max_idle = max_idle
+        self.check_interval = check_interval
+
+        self._condition = threading.Condition()
+        # connections inherited from the parent process, kept referenced so they are never closed
+        # (not even by the garbage collector), which would also end the parent sessions.
+        self._inherited = []
+        self._init_state()
+
+    def _init_state(self) -> None:
+        self._pid = os.getpid()
+        # idle connections with the time they were released, the most recent last.
+        self._idle = deque()
+        # connections open, either idle or checked out.
+        self._open = 0
+
+        self.connects = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.evictions = 0
+        self.discards = 0
+
+    def reset(self) -> None:
+        """
+        Forgets every connection without closing them, to be called in a new process.
+        """
+        # another thread of the parent process may have held the lock when forking.
+        self._condition = threading.Condition()
+        self._inherited.extend(conn for conn, _ in self._idle)
+        self._init_state()
+
+    def acquire(self) -> Any:
+        """
+        Checks a connection out of the pool, opening a new one if none is idle and the pool isn't full.
+
+        :return: a connection, to be given back through release.
+        """
+        if self._pid != os.getpid():
+            self.reset()
+
+        with self._condition:
+            expired = self._evict_idle()
+
+            if not self._idle and self._open >= self.size:
+                self.waits += 1
+                start = time()
+                while not self._idle and self._open >= self.size:
+                    self._condition.wait()
+                self.wait_time += time() - start
+
+            self.checkouts += 1
+            if self._idle:
+                conn, released = self._idle.pop()
+            else:
+                conn, released = None, None
+                self._open += 1
+
+        for stale in expired:
+            self._close(stale)
+
+        if conn is not None and time() - released > self.check_interval and not self.is_alive(conn):
+            self._close(conn)
+            with self._condition:
+                self.discards += 1
+            conn = None
+
+        if conn is None:
+            try:
+                conn = self.connect()
+            except Exception:
+                with self._condition:
+                    self._open -= 1
+                    self._condition.notify()
+                raise
+
+            with self._condition:
+                self.connects += 1
+
+        return conn
+
+    def release(self, conn: Any, discard: bool = False) -> None:
+        """
+        Gives a connection back to the pool.
+
+        :param conn: a connection obtained from acquire.
+        :param discard: closes the connection instead of keeping it, for connections that may be broken
+         or left in an unknown state.
+        """
+        if self._pid != os.getpid():
+            # checked out before a fork, it belongs to the parent.
+            self._inherited.append(conn)
+            return
+
+        with self._condition:
+            if discard:
+                self._open -= 1
+                self.discards += 1
+            else:
+                self._idle.append((conn, time()))
+            self._condition.notify()
+
+        if discard:
+            self._close(conn)
+
+    def close(self) -> None:
+        """
+        Closes all the idle connections.
+        """
+        with self._condition:
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._open -= len(idle)
+            self._condition.notify_all()
+
+        for conn in idle:
+            self._close(conn)
+
+    def statistics(self) -> Dict[str, Any]:
+        """
+        Counters to size the pool: many waits (or a long wait time) mean the pool is too small, while
+        connects growing along with checkouts mean connections don't live long enough to be reused.
+
+        :return: a dictionary with the pool size, the connections open, idle and in use, and the amount of
+         checkouts, waits for a connection, seconds spent waiting, connections opened, closed for being idle
+         too long and discarded (dead or failed).
+        """
+        with self._condition:
+            return {
+                "size": self.size,
+                "open": self._open,
+                "idle": len(self._idle),
+                "in_use": self._open - len(self._idle),
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "wait_time": self.wait_time,
+                "connects": self.connects,
+                "evictions": self.evictions,
+                "discards": self.discards
+            }
+
+    def _evict_idle(self) -> list:
+        # called holding the lock, the oldest connections are at the left.
+        expired = []
+        limit = time() - self.max_idle
+        while self._idle and self._idle[0][1] < limit:
+            expired.append(self._idle.popleft()[0])
+        self._open -= len(expired)
+        self.evictions += len(expired)
+        return expired
+
+    @staticmethod
+    def _close(conn: Any) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
@@ -0,0 +1,583 @@
+import json
+import os
+import threading
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+
+import numpy as np
+
+from dejavu.base_classes.base_database import (BaseDatabase,
+                                               CatalogMismatchError,
+                                               InitialBuildError,
+                                               legacy_catalog_settings)
+from dejavu.config.settings import (CATALOG_FINGERPRINT_FORMAT,
+                                    FIELD_ALBUM, FIELD_FILE_SHA1,
+                                    FIELD_FINGERPRINTED, FIELD_PUBLICTIME,
+                                    FIELD_PUBLISHER, FIELD_SINGER,
+                                    FIELD_SONG_ID, FIELD_SONG_LENGTH,
+                                    FIELD_SONGNAME, FIELD_TOTAL_HASHES,
+                                    FINGERPRINT_FORMAT_SHA1)
+from dejavu.logic.alignment import best_offsets, expand_matches
+from dejavu.logic.fingerprint_batch import (FingerprintBatch, hashes_to_keys,
+                                            key_dtype, keys_to_hashes)
+
+from dejavu.third_party.dejavu_timer import DejavuTimer
+
+
+def songs_to_json(songs: List[Dict[str, any]], catalog: Dict[str, str]) -> str:
+    """
+    :return: the songs table and the catalog, as a JSON document.
+    """
+    def default(value):
+        if isinstance(value, datetime):
+            return value.isoformat()
+        if isinstance(value, Decimal):
+            return float(value)
+        raise TypeError(f"Unsupported value {value!r} supplied.")
+
+    return json.dumps({"songs": [dict(song) for song in songs], "catalog": catalog}, default=default)
+
+
+def songs_from_json(document: str) -> Tuple[List[Dict[str, any]], Dict[str, str]]:
+    """
+    :return: the songs table and the catalog saved by songs_to_json.
+    """
+    data = json.loads(document)
+    for song in data["songs"]:
+        if song.get("date_created"):
+            song["date_created"] = datetime.fromisoformat(song["date_created"])
+    return data["songs"], data["catalog"]
+
+
+class MemoryDatabase(BaseDatabase):
+    """
+    In-process database keeping the fingerprints as a columnar inverted index:
+
+    - `keys`: the distinct hashes, sorted.
+    - `indptr`: CSR style pointers, the postings of keys[i] being at [indptr[i], indptr[i + 1]).
+    - `song_ids` and `offsets`: the postings, in (hash, song id, offset) order.
+
+    Queries look all their hashes up at once with np.searchsorted, without any network hop.
+    Inserted fingerprints are buffered and merged into the index (dropping duplicates) by the next
+    query, and deleted songs are tombstoned, their postings being skipped until the next merge.
+
+    The index and the songs table can be saved to (and loaded from) a NumPy .npz file given as the
+    "path" database option.
+    """
+    type = "memory"
+
+    def __init__(self, path: str = None):
+        """
+        :param path: .npz file the database is loaded from, if it exists, and saved to.
+        """
+        super().__init__()
+        self.path = path
+        self._lock = threading.RLock()
+        self._clear()
+
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def _clear(self) -> None:
+        self.songs = {}
+        self.catalog = {}
+        self._next_song_id = 1
+        self._catalog_checked = False
+        self._catalog_validated = False
+        self._set_index(self._empty_keys(), np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int32),
+                        np.empty(0, dtype=np.int32))
+        # fingerprints inserted since the last merge, as (keys, song ids, offsets) arrays.
+        self._pending = []
+        self._tombstones = set()
+
+    def _set_index(self, keys: np.ndarray, indptr: np.ndarray, song_ids: np.ndarray, offsets: np.ndarray) -> None:
+        # arrays are never modified in place, queries work on the ones they got.
+        self.keys, self.indptr, self.song_ids, self.offsets = keys, indptr, song_ids, offsets
+
+    def __copy__(self):
+        # copies (e.g. the ingestion writers' ones) must write to the same index.
+        return self
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def setup(self) -> None:
+        """
+        Called on creation or shortly afterwards.
+        """
+        self.check_catalog()
+
+    def set_fingerprint_format(self, fingerprint_format: str) -> None:
+        """
+        Sets the format of the fingerprints stored and queried by this instance.
+
+        :param fingerprint_format: either "sha1" or "packed".
+        """
+        super().set_fingerprint_format(fingerprint_format)
+
+        with self._lock:
+            if len(self.keys) == 0 and not self._pending:
+                self._set_index(self._empty_keys(), self.indptr, self.song_ids, self.offsets)
+            self._catalog_checked = False
+            self._catalog_validated = False
+
+    def check_catalog(self, record_missing: bool = True) -> None:
+        """
+        Validates the settings recorded in the catalog against the ones of this instance,
+        settings not recorded yet are stored.
+
+        It raises CatalogMismatchError if any of the recorded settings differs.
+
+        :param record_missing: whether the settings not recorded yet are stored, otherwise they are left
+         unchecked.
+        """
+        with self._lock:
+            if record_missing:
+                # fingerprints stored before the catalog recorded a setting were generated with its legacy value.
+                legacy = legacy_catalog_settings() if len(self.keys) or self._pending else {}
+                for setting, value in self.catalog_settings.items():
+                    self.catalog.setdefault(setting, legacy.get(setting, str(value)))
+
+            mismatches = [
+                f"{setting}: catalog has '{self.catalog[setting]}' but '{value}' is configured"
+                for setting, value in self.catalog_settings.items()
+                if self.catalog.get(setting, str(value)) != str(value)
+            ]
+            if mismatches:
+                raise CatalogMismatchError(f"Catalog settings mismatch ({', '.join(mismatches)}).")
+
+            if record_missing:
+                self._catalog_checked = True
+            self._catalog_validated = True
+
+    def empty(self) -> None:
+        """
+        Called when the database should be cleared of all data.
+        """
+        with self._lock:
+            self._clear()
+        self.setup()
+
+    def begin_initial_build(self) -> None:
+        """
+        Starts an initial build, fingerprints are merged into the index only once it ends.
+
+        It raises InitialBuildError if the database has fingerprints.
+        """
+        if self.get_num_fingerprints() > 0:
+            raise InitialBuildError("An initial build requires an empty fingerprints table.")
+        self.check_catalog()
+
+    def finish_initial_build(self, parallel_workers: int = None) -> None:
+        """
+        Ends an initial build, merging all the fingerprints inserted into the index.
+
+        :param parallel_workers: unused, kept for compatibility with the SQL databases.
+        """
+        self.delete_unfingerprinted_songs()
+        self.compact()
+
+    def delete_unfingerprinted_songs(self) -> None:
+        """
+        Called to remove any song entries that do not have any fingerprints
+        associated with them.
+        """
+        with self._lock:
+            song_ids = [song_id for song_id, song in self.songs.items() if not song[FIELD_FINGERPRINTED]]
+        self.delete_songs_by_id(song_ids)
+
+    def get_num_songs(self) -> int:
+        """
+        Returns the song's count stored.
+
+        :return: the amount of songs in the database.
+        """
+        with self._lock:
+            return sum(1 for song in self.songs.values() if song[FIELD_FINGERPRINTED])
+
+    def get_num_fingerprints(self) -> int:
+        """
+        Returns the fingerprints' count stored.
+
+        :return: the number of fingerprints in the database.
+        """
+        self.compact()
+        return len(self.song_ids)
+
+    def set_song_fingerprinted(self, song_id: int):
+        """
+        Sets a specific song as having all fingerprints in the database.
+
+        :param song_id: song identifier.
+        """
+        with self._lock:
+            self.songs[song_id][FIELD_FINGERPRINTED] = 1
+
+    def get_songs(self) -> List[Dict[str, str]]:
+        """
+        Returns all fully fingerprinted songs in the database
+
+        :return: a dictionary with the songs info.
+        """
+        with self._lock:
+            return [self._song_info(song) for song in self.songs.values() if song[FIELD_FINGERPRINTED]]
+
+    def get_song_by_id(self, song_id: int) -> Dict[str, str]:
+        """
+        Brings the song info from the database.
+
+        :param song_id: song identifier.
+        :return: a song by its identifier. Result must be a Dictionary.
+        """
+        with self._lock:
+            song = self.songs.get(song_id)
+            return self._song_info(song) if song is not None else None
+
+    def get_songs_by_ids(self, song_ids: List[int]) -> List[Dict[str, str]]:
+        """
+        Brings the song info from the database.
+
+        :param song_ids: song identifiers.
+        :return: songs by their identifiers. Result must be a List of Dictionaries.
+        """
+        with self._lock:
+            return [self._song_info(self.songs[song_id]) for song_id in song_ids if song_id in self.songs]
+
+    @staticmethod
+    def _song_info(song: Dict[str, any]) -> Dict[str, any]:
+        return {field: value for field, value in song.items() if field != FIELD_FINGERPRINTED}
+
+    def insert(self, fingerprint: str, song_id: int, offset: int):
+        """
+        Inserts a single fingerprint into the database.
+
+        :param fingerprint: Part of a sha1 hash, in hexadecimal format, or a packed hash
+        :param song_id: Song identifier this fingerprint is off
+        :param offset: The offset this fingerprint is from.
+        """
+        self.insert_hashes(song_id, [(fingerprint, offset)])
+
+    def insert_song(self, song_name: str, file_hash: str, total_hashes: int, song_publisher: str = '',
+                    song_length: float = 0, song_singer: str = '', song_album: str = '', song_public: str = '') -> int:
+        """
+        Inserts a song name into the database, returns the new
+        identifier of the song.
+
+        :param song_name: The name of the song.
+        :param file_hash: Hash from the fingerprinted file.
+        :param total_hashes: amount of hashes to be inserted on fingerprint table.
+        :param song_publisher: The publisher of the song.
+        :param song_length: The length of the song.
+        :param song_singer: The singer of the song.
+        :param song_album: The album of the song.
+        :param song_public: The public time of the song.
+        :return: the inserted id.
+        """
+        with self._lock:
+            song_id = self._next_song_id
+            self._next_song_id += 1
+            self.songs[song_id] = {
+                FIELD_SONG_ID: song_id,
+                FIELD_SONGNAME: song_name,
+                FIELD_PUBLISHER: song_publisher,
+                FIELD_SONG_LENGTH: song_length,
+                FIELD_SINGER: song_singer,
+                FIELD_ALBUM: song_album,
+                FIELD_PUBLICTIME: song_public,
+                FIELD_FILE_SHA1: file_hash.upper(),
+                FIELD_TOTAL_HASHES: total_hashes,
+                FIELD_FINGERPRINTED: 0,
+                "date_created": datetime.now()
+            }
+            return song_id
+
+    def import_songs(self, songs: List[Dict[str, any]]) -> None:
+        """
+        Inserts songs read from another database (as get_songs returns them) keeping their identifiers,
+        songs already stored are left untouched.
+
+        :param songs: the songs info, considered fingerprinted unless they have a "fingerprinted" key.
+        """
+        with self._lock:
+            for song in songs:
+                song = {FIELD_FINGERPRINTED: 1, "date_created": datetime.now(), **dict(song)}
+                song[FIELD_FILE_SHA1] = song[FIELD_FILE_SHA1].upper()
+                self.songs.setdefault(song[FIELD_SONG_ID], song)
+            self._next_song_id = max(self._next_song_id, max(self.songs, default=0) + 1)
+
+    def query(self, fingerprint: str = None) -> List[Tuple]:
+        """
+        Returns all matching fingerprint entries associated with
+        the given hash as parameter, if None is passed it returns all entries.
+
+        :param fingerprint: part of a sha1 hash, in hexadecimal format, or a packed hash
+        :return: a list of fingerprint records stored in the db.
+        """
+        self.compact()
+        keys, indptr, song_ids, offsets = self.keys, self.indptr, self.song_ids, self.offsets
+        if fingerprint:
+            key = self._to_keys([fingerprint])[0]
+            index = np.searchsorted(keys, key)
+            if index == len(keys) or keys[index] != key:
+                return []
+            song_ids, offsets = song_ids[indptr[index]: indptr[index + 1]], offsets[indptr[index]: indptr[index + 1]]
+        return list(zip(song_ids.tolist(), offsets.tolist()))
+
+    def get_iterable_kv_pairs(self) -> List[Tuple]:
+        """
+        Returns all fingerprints in the database.
+
+        :return: a list containing all fingerprints stored in the db.
+        """
+        return self.query(None)
+
+    def iterate_fingerprints(self, batch_size: int = 10000) -> Iterator[List[Tuple[Union[str, int], int, int]]]:
+        """
+        Streams all fingerprints in the database, sorted by hash.
+
+        :param batch_size: number of fingerprints yielded at a time.
+        :return: an iterator over lists of up to batch_size (hash, song id, offset) tuples.
+        """
+        self.compact()
+        keys, indptr, song_ids, offsets = self.keys, self.indptr, self.song_ids, self.offsets
+        for start in range(0, len(song_ids), batch_size):
+            end = min(start + batch_size, len(song_ids))
+            # key of every posting of the batch, postings of keys[i] starting at indptr[i].
+            batch_keys = keys[np.searchsorted(indptr, np.arange(start, end), side="right") - 1]
+            yield list(zip(keys_to_hashes(batch_keys, self.fingerprint_format), song_ids[start:end].tolist(),
+                           offsets[start:end].tolist()))
+
+    def get_frequent_hashes(self, threshold: int) -> Dict[Union[str, int], int]:
+        """
+        Counts the fingerprints of every hash in the index and keeps the frequent ones.
+
+        :param threshold: hashes having more fingerprints than this one are returned.
+        :return: a dictionary with the amount of fingerprints of each frequent hash.
+        """
+        # merging drops the postings of the deleted songs, the index then holds the exact counts.
+        self.compact()
+        with self._lock:
+            keys, indptr = self.keys, self.indptr
+
+        counts = np.diff(indptr)
+        frequent = np.flatnonzero(counts > threshold)
+        return dict(zip(keys_to_hashes(keys[frequent], self.fingerprint_format), counts[frequent].tolist()))
+
+    def insert_hashes(self, song_id: int, hashes: List[Tuple[str, int]], batch_size: int = 10000) -> None:
+        """
+        Insert a multitude of fingerprints, they are merged into the index by the next query.
+
+        :param song_id: Song identifier the fingerprints belong to
+        :param hashes: A sequence of tuples in the format (hash, offset)
+            - hash: Part of a sha1 hash, in hexadecimal format, or a packed hash
+            - offset: Offset this hash was created from/at.
+        :param batch_size: unused, all the fingerprints are inserted at once.
+        """
+        if not self._catalog_checked:
+            self.check_catalog()
+
+        if isinstance(hashes, FingerprintBatch):
+            keys, offsets = self._to_keys(hashes), hashes.offsets.astype(np.int32)
+        else:
+            hashes = list(hashes)
+            keys = self._to_keys([hsh for hsh, _ in hashes])
+            offsets = np.fromiter((int(offset) for _, offset in hashes), dtype=np.int32, count=len(hashes))
+
+        with self._lock:
+            self._pending.append((keys, np.full(len(hashes), song_id, dtype=np.int32), offsets))
+
+    @DejavuTimer(name=__name__ + ".compact()\t\t\t")
+    def compact(self) -> None:
+        """
+        Merges the fingerprints inserted into the index and drops the postings of the deleted songs.
+        """
+        with self._lock:
+            if not self._pending and not self._tombstones:
+                return
+
+            counts = np.diff(self.indptr)
+            keys = np.concatenate([np.repeat(self.keys, counts)] + [keys for keys, _, _ in self._pending])
+            song_ids = np.concatenate([self.song_ids] + [song_ids for _, song_ids, _ in self._pending])
+            offsets = np.concatenate([self.offsets] + [offsets for _, _, offsets in self._pending])
+
+            if self._tombstones:
+                alive = ~np.isin(song_ids, np.fromiter(self._tombstones, dtype=np.int32))
+                keys, song_ids, offsets = keys[alive], song_ids[alive], offsets[alive]
+
+            order = np.lexsort((offsets, song_ids, keys))
+            keys, song_ids, offsets = keys[order], song_ids[order], offsets[order]
+
+            # duplicated fingerprints are ignored, as the unique constraint of the SQL databases does.
+            unique = np.r_[True, (keys[1:] != keys[:-1]) | (song_ids[1:] != song_ids[:-1]) |
+                           (offsets[1:] != offsets[:-1])]
+            keys, song_ids, offsets = keys[unique], song_ids[unique], offsets[unique]
+
+            firsts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.empty(0, dtype=np.int64)
+            indptr = np.r_[firsts, len(keys)].astype(np.int64)
+
+            self._set_index(keys[firsts], indptr, song_ids, offsets)
+            self._pending = []
+            self._tombstones = set()
+
+    def _lookup(self, hashes: Union[List[Union[str, int]], np.ndarray]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Looks up the postings of the given distinct hashes, or of their keys.
+
+        :return: three parallel arrays with the index (within hashes), song id and offset of every posting.
+        """
+        self.compact()
+        with self._lock:
+            keys, indptr, song_ids, offsets = self.keys, self.indptr, self.song_ids, self.offsets
+            tombstones = np.fromiter(self._tombstones, dtype=np.int32)
+
+        query = hashes if isinstance(hashes, np.ndarray) else self._to_keys(hashes)
+        positions = np.searchsorted(keys, query)
+        found = positions < len(keys)
+        found[found] = keys[positions[found]] == query[found]
+
+        hash_indexes = np.flatnonzero(found)
+        starts, ends = indptr[positions[found]], indptr[positions[found] + 1]
+        counts = ends - starts
+
+        # postings of every hash found, one after another.
+        postings = np.arange(int(counts.sum())) + np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        hash_indexes = np.repeat(hash_indexes, counts)
+        song_ids, offsets = song_ids[postings], offsets[postings]
+
+        if len(tombstones):
+            alive = ~np.isin(song_ids, tombstones)
+            hash_indexes, song_ids, offsets = hash_indexes[alive], song_ids[alive], offsets[alive]
+
+        return hash_indexes, song_ids, offsets
+
+    def _query_keys(self, batch: FingerprintBatch) -> Tuple[np.ndarray, List[np.ndarray]]:
+        # distinct keys of the batch, each one with the offsets it was sampled at.
+        keys, inverse = np.unique(self._to_keys(batch), return_inverse=True)
+        order = np.argsort(inverse, kind="stable")
+        return keys, np.split(batch.offsets[order], np.flatnonzero(np.diff(inverse[order])) + 1)
+
+    def _query_mapper(self, hashes: List[Tuple[str, int]]) -> Dict[Union[str, int], List[int]]:
+        # sha1 hashes are compared in upper case, packed ones as plain integers.
+        normalize = str.upper if self.fingerprint_format == FINGERPRINT_FORMAT_SHA1 else int
+
+        mapper = {}
+        for hsh, offset in hashes:
+            mapper.setdefault(normalize(hsh), []).append(offset)
+        return mapper
+
+    @DejavuTimer(name=__name__ + ".return_matches()\t\t\t")
+    def return_matches(self, hashes: List[Tuple[str, int]], batch_size: int = 1000, as_arrays: bool = False) \
+            -> Tuple[Union[List[Tuple[int, int]], Tuple[np.ndarray, np.ndarray]], Dict[int, int]]:
+        """
+        Searches the database for pairs of (hash, offset) values.
+
+        :param hashes: A sequence of tuples in the format (hash, offset)
+            - hash: Part of a sha1 hash, in hexadecimal format, or a packed hash
+            - offset: Offset this hash was created from/at.
+        :param batch_size: unused, all the hashes are looked up at once.
+        :param as_arrays: return the matches as two parallel arrays (song ids, offset differences)
+         instead of a list of tuples.
+        :return: a list of (sid, offset_difference) tuples and a
+        dictionary with the amount of hashes matched (not considering
+        duplicated hashes) in each song.
+            - song id: Song identifier
+            - offset_difference: (database_offset - sampled_offset)
+        """
+        self.validate_catalog()
+
+        if isinstance(hashes, FingerprintBatch):
+            query, sampled_offsets = self._query_keys(hashes)
+        else:
+            mapper = self._query_mapper(hashes)
+            query, sampled_offsets = list(mapper), list(mapper.values())
+        (song_ids, offset_differences), dedup_hashes = expand_matches(*self._lookup(query), sampled_offsets)
+        if as_arrays:
+            return (song_ids, offset_differences), dedup_hashes
+        return list(zip(song_ids.tolist(), offset_differences.tolist())), dedup_hashes
+
+    @DejavuTimer(name=__name__ + ".return_aligned_matches()\t\t")
+    def return_aligned_matches(self, hashes: List[Tuple[str, int]],
+                               topn: int) -> Tuple[List[Tuple[int, int, int]], Dict[int, int]]:
+        """
+        Searches the database for pairs of (hash, offset) values, aligning the matches.
+
+        :param hashes: A sequence of tuples in the format (hash, offset)
+            - hash: Part of a sha1 hash, in hexadecimal format, or a packed hash
+            - offset: Offset this hash was created from/at.
+        :param topn: number of songs returned.
+        :return: a list of (sid, offset_difference, count) tuples, with the offset difference
+        matched the most times in each of the topn songs matched the most, and a dictionary with
+        the amount of hashes matched (not considering duplicated hashes) in each of those songs.
+        """
+        (song_ids, offset_differences), dedup_hashes = self.return_matches(hashes, as_arrays=True)
+        songs_matches = best_offsets(song_ids, offset_differences, topn)
+        return songs_matches, {sid: dedup_hashes[sid] for sid, _, _ in songs_matches}
+
+    def delete_songs_by_id(self, song_ids: List[int], batch_size: int = 1000) -> None:
+        """
+        Given a list of song ids it deletes all songs specified and their corresponding fingerprints.
+        Fingerprints are tombstoned and dropped from the index by the next merge.
+
+        :param song_ids: song ids to be deleted from the database.
+        :param batch_size: unused, all the songs are deleted at once.
+        """
+        with self._lock:
+            for song_id in song_ids:
+                if self.songs.pop(song_id, None) is not None:
+                    self._tombstones.add(song_id)
+
+    def _empty_keys(self) -> np.ndarray:
+        return np.empty(0, dtype=key_dtype(self.fingerprint_format))
+
+    def _to_keys(self, hashes: Iterable[Union[str, int]]) -> np.ndarray:
+        if isinstance(hashes, FingerprintBatch):
+            if hashes.fingerprint_format != self.fingerprint_format:
+                raise TypeError("Unsupported fingerprint format supplied.")
+            return hashes.keys
+        return hashes_to_keys(hashes, self.fingerprint_format)
+
+    def save(self, path: str = None) -> None:
+        """
+        Saves the index and the songs table, merging the pending fingerprints first.
+
+        :param path: .npz file written, the "path" database option if None.
+        """
+        path = path or self.path
+        if not path:
+            raise TypeError("Unsupported path supplied.")
+
+        self.compact()
+        with self._lock:
+            with open(path, "wb") as f:
+                np.savez(f, keys=self.keys, indptr=self.indptr, song_ids=self.song_ids, offsets=self.offsets,
+                         songs=np.array(songs_to_json(list(self.songs.values()), self.catalog)))
+
+    def load(self, path: str) -> None:
+        """
+        Loads the index and the songs table saved by save, replacing the current ones.
+
+        :param path: .npz file read.
+        """
+        with np.load(path, allow_pickle=False) as data:
+            songs, catalog = songs_from_json(str(data["songs"]))
+            index = data["keys"], data["indptr"], data["song_ids"], data["offsets"]
+
+        with self._lock:
+            self._clear()
+            self._set_index(*index)
+            self.catalog = catalog
+            for song in songs:
+                self.songs[song[FIELD_SONG_ID]] = song
+            self._next_song_id = max(self.songs, default=0) + 1
+
+            # the fingerprints are stored in the format recorded in the catalog.
+            fingerprint_format = self.catalog.get(CATALOG_FINGERPRINT_FORMAT)
+            if fingerprint_format is not None:
+                super().set_fingerprint_format(fingerprint_format)
@@ -0,0 +1,281 @@
+import hashlib
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from time import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from dejavu.base_classes.base_database import (BaseDatabase, IndexFileError,
+                                               ReadOnlyDatabaseError)
+from dejavu.config.settings import (FIELD_FINGERPRINTED, FIELD_SONG_ID,
+                                    FINGERPRINT_FORMAT_PACKED,
+                                    FINGERPRINT_FORMAT_SHA1,
+                                    INDEX_FILE_CHECK_INTERVAL,
+                                    INDEX_FILE_EXPORT_BATCH_SIZE)
+from dejavu.database_handler.memory_database import (MemoryDatabase,
+                                                     songs_from_json,
+                                                     songs_to_json)
+from dejavu.logic.fingerprint_batch import hashes_to_keys, key_dtype
+
+# INDEX FILE FORMAT (little endian, every section aligned to SECTION_ALIGNMENT bytes):
+# - header: magic, format version, fingerprint format, key size, amount of keys and postings,
+#   (offset, length) of every section and the SHA-256 of everything after the header.
+# - postings: (song id, offset) int32 pairs, sorted by (hash, song id, offset).
+# - keys: the distinct hashes, sorted, as in the "memory" database.
+# - indptr: int64 pointers, the postings of keys[i] being at [indptr[i], indptr[i + 1]).
+# - metadata: the songs table and the catalog, as a UTF-8 JSON document.
+INDEX_FILE_MAGIC = b"DJVINDEX"
+INDEX_FILE_VERSION = 1
+HEADER = struct.Struct("<8sIIII QQ QQ QQ QQ QQ 32s")
+SECTION_ALIGNMENT = 64
+POSTING_DTYPE = np.dtype([("song_id", "<i4"), ("offset", "<i4")])
+INDPTR_DTYPE = np.dtype("<i8")
+
+FINGERPRINT_FORMAT_CODES = {FINGERPRINT_FORMAT_SHA1: 0, FINGERPRINT_FORMAT_PACKED: 1}
+
+
+class _SectionWriter(object):
+    """
+    Appends the sections of an index file, keeping track of their position and of the file checksum.
+    """
+    def __init__(self, f):
+        super().__init__()
+        self.f = f
+        self.position = HEADER.size
+        self.digest = hashlib.sha256()
+        f.seek(self.position)
+
+    def write(self, data: bytes) -> None:
+        self.f.write(data)
+        self.digest.update(data)
+        self.position += len(data)
+
+    def align(self) -> int:
+        self.write(b"\0" * (-self.position % SECTION_ALIGNMENT))
+        return self.position
+
+    def copy(self, source) -> Tuple[int, int]:
+        start = self.align()
+        source.seek(0)
+        shutil.copyfileobj(source, self)
+        return start, self.position - start
+
+
+def write_index_file(db: BaseDatabase, path: str, batch_size: int = INDEX_FILE_EXPORT_BATCH_SIZE) -> None:
+    """
+    Exports the fingerprints and the songs of a database to an index file, streaming the fingerprints
+    (sorted by hash) instead of loading them all at once. Only fully fingerprinted songs are exported.
+
+    The file is written next to the destination and moved over it once complete, so processes with the
+    previous index open keep using it and pick the new one up on their next check.
+
+    :param db: database exported.
+    :param path: index file written.
+    :param batch_size: number of fingerprints read at a time.
+    """
+    db.check_catalog()
+    fingerprint_format = db.fingerprint_format
+    dtype = key_dtype(fingerprint_format)
+
+    songs = [{**dict(song), FIELD_FINGERPRINTED: 1} for song in db.get_songs()]
+    song_ids = np.array([song[FIELD_SONG_ID] for song in songs], dtype=np.int32)
+
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w+b") as f, tempfile.TemporaryFile() as keys_file, \
+                tempfile.TemporaryFile() as indptr_file:
+            writer = _SectionWriter(f)
+
+            # postings are written straight to the file, keys and pointers go to temporary files
+            # and are appended after them.
+            n_keys, n_postings, last_key = 0, 0, None
+            for rows in db.iterate_fingerprints(batch_size):
+                hashes, sids, offsets = zip(*rows)
+                keys = hashes_to_keys(hashes, fingerprint_format)
+                postings = np.empty(len(rows), dtype=POSTING_DTYPE)
+                postings["song_id"], postings["offset"] = sids, offsets
+
+                exported = np.isin(postings["song_id"], song_ids)
+                keys, postings = keys[exported], postings[exported]
+                if len(keys) == 0:
+                    continue
+
+                if np.any(keys[1:] < keys[:-1]) or (last_key is not None and keys[0] < last_key):
+                    raise IndexFileError("Fingerprints weren't streamed sorted by hash.")
+
+                firsts = np.r_[last_key is None or keys[0] != last_key, keys[1:] != keys[:-1]]
+                keys_file.write(keys[firsts].tobytes())
+                indptr_file.write((np.flatnonzero(firsts) + n_postings).astype(INDPTR_DTYPE).tobytes())
+                writer.write(postings.tobytes())
+
+                n_keys += int(firsts.sum())
+                n_postings += len(postings)
+                last_key = keys[-1]
+
+            indptr_file.write(np.array([n_postings], dtype=INDPTR_DTYPE).tobytes())
+
+            postings_section = (HEADER.size, writer.position - HEADER.size)
+            keys_section = writer.copy(keys_file)
+            indptr_section = writer.copy(indptr_file)
+
+            metadata = songs_to_json(songs, {setting: str(value) for setting, value in db.catalog_settings.items()})
+            metadata_start = writer.align()
+            writer.write(metadata.encode("utf-8"))
+            metadata_section = (metadata_start, writer.position - metadata_start)
+
+            f.seek(0)
+            f.write(HEADER.pack(INDEX_FILE_MAGIC, INDEX_FILE_VERSION, FINGERPRINT_FORMAT_CODES[fingerprint_format],
+                                dtype.itemsize, 0, n_keys, n_postings, *postings_section, *keys_section,
+                                *indptr_section, *metadata_section, writer.digest.digest()))
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    # makes the rename itself durable.
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def read_index_file(path: str, verify: bool = True) -> Dict[str, any]:
+    """
+    Maps an index file in memory, the arrays returned are read-only views over the page cache.
+
+    It raises IndexFileError if the file isn't a valid index file or its checksum doesn't match.
+
+    :param path: index file read.
+    :param verify: whether the checksum is validated, which reads the whole file.
+    :return: a dictionary with the fingerprint format, the index arrays (keys, indptr, song_ids,
+     offsets), the songs, the catalog and the identity (device, inode, modification time and size) of
+     the file mapped.
+    """
+    with open(path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        if stat.st_size < HEADER.size:
+            raise IndexFileError(f"{path} is too short to be an index file.")
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    (magic, version, format_code, key_size, _, n_keys, n_postings, *sections,
+     digest) = HEADER.unpack_from(mapped, 0)
+    if magic != INDEX_FILE_MAGIC:
+        raise IndexFileError(f"{path} isn't an index file.")
+    if version != INDEX_FILE_VERSION:
+        raise IndexFileError(f"{path} has format version {version}, {INDEX_FILE_VERSION} is supported.")
+
+    formats = {code: fingerprint_format for fingerprint_format, code in FINGERPRINT_FORMAT_CODES.items()}
+    if format_code not in formats or key_dtype(formats[format_code]).itemsize != key_size:
+        raise IndexFileError(f"{path} has fingerprints of an unsupported format or size.")
+    fingerprint_format = formats[format_code]
+
+    (postings_start, postings_length), (keys_start, keys_length), (indptr_start, indptr_length), \
+        (metadata_start, metadata_length) = zip(sections[::2], sections[1::2])
+    expected = [(postings_length, n_postings * POSTING_DTYPE.itemsize), (keys_length, n_keys * key_size),
+                (indptr_length, (n_keys + 1) * INDPTR_DTYPE.itemsize)]
+    if any(length != size for length, size in expected) or \
+            any(start + length > stat.st_size for start, length in zip(sections[::2], sections[1::2])):
+        raise IndexFileError(f"{path} is truncated or has inconsistent sections.")
+
+    if verify and hashlib.sha256(memoryview(mapped)[HEADER.size:]).digest() != digest:
+        raise IndexFileError(f"{path} checksum doesn't match, the file is corrupted.")
+
+    postings = np.frombuffer(mapped, dtype=POSTING_DTYPE, count=n_postings, offset=postings_start)
+    songs, catalog = songs_from_json(mapped[metadata_start: metadata_start + metadata_length].decode("utf-8"))
+
+    return {
+        "fingerprint_format": fingerprint_format,
+        "keys": np.frombuffer(mapped, dtype=key_dtype(fingerprint_format), count=n_keys, offset=keys_start),
+        "indptr": np.frombuffer(mapped, dtype=INDPTR_DTYPE, count=n_keys + 1, offset=indptr_start),
+        "song_ids": postings["song_id"],
+        "offsets": postings["offset"],
+        "songs": songs,
+        "catalog": catalog,
+        "identity": (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    }
+
+
+class MmapDatabase(MemoryDatabase):
+    """
+    Read-only database answering queries from an index file mapped in memory: every process opening
+    the same file shares its pages through the page cache instead of holding a private copy.
+
+    Index files are exported from another database with write_index_file. When the file is replaced
+    (write_index_file swaps it atomically), the new one is opened on the next check, queries running
+    meanwhile keep using the previous mapping.
+    """
+    type = "mmap"
+
+    # the index file can't be read, e.g. a network file system not mounted.
+    CONNECTION_ERRORS = (OSError,)
+
+    def __init__(self, path: str, verify: bool = True, check_interval: float = INDEX_FILE_CHECK_INTERVAL):
+        """
+        :param path: index file opened.
+        :param verify: whether the checksum of the index file is validated when opening it.
+        :param check_interval: seconds between checks of whether the index file was replaced.
+        """
+        super().__init__()
+        self.path = path
+        self.verify = verify
+        self.check_interval = check_interval
+        self._identity = None
+        self._last_check = 0
+        self.reload()
+
+    def __getstate__(self):
+        # mappings can't be pickled, the file is opened again on the other side.
+        return self.path, self.verify, self.check_interval, self.fingerprint_format, self.catalog_settings
+
+    def __setstate__(self, state):
+        path, verify, check_interval, fingerprint_format, catalog_settings = state
+        self.__init__(path, verify, check_interval)
+        self.set_fingerprint_format(fingerprint_format)
+        self.catalog_settings = catalog_settings
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Opens the index file again if it was replaced since it was opened.
+
+        :param force: opens it again even if it wasn't replaced.
+        :return: whether the index file was opened again.
+        """
+        self._last_check = time()
+        stat = os.stat(self.path)
+        if not force and (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size) == self._identity:
+            return False
+
+        index = read_index_file(self.path, self.verify)
+        with self._lock:
+            # previous mappings are closed once the last query using them is done.
+            self._set_index(index["keys"], index["indptr"], index["song_ids"], index["offsets"])
+            self.songs = {song[FIELD_SONG_ID]: song for song in index["songs"]}
+            self.catalog = index["catalog"]
+            self._identity = index["identity"]
+            self._catalog_checked = False
+            self._catalog_validated = False
+        return True
+
+    def _lookup(self, hashes: List) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if time() - self._last_check > self.check_interval:
+            self.reload()
+        return super()._lookup(hashes)
+
+    def _read_only(self, *args, **kwargs):
+        raise ReadOnlyDatabaseError(f"{self.path} is a read-only index file, export a new one with "
+                                    f"write_index_file instead.")
+
+    empty = insert = insert_song = import_songs = insert_hashes = set_song_fingerprinted = _read_only
+    delete_songs_by_id = delete_unfingerprinted_songs = begin_initial_build = finish_initial_build = _read_only
+    save = load = _read_only
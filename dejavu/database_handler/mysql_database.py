@@ -1,11 +1,23 @@
+import os
+import tempfile
+from functools import partial
+from typing import Iterable, List, Tuple
+
 import mysql.connector
-from mysql.connector.errors import DatabaseError
+from mysql.connector.errors import (DatabaseError, InterfaceError,
+                                    OperationalError)
 
 from dejavu.base_classes.common_database import CommonDatabase
-from dejavu.config.settings import (FIELD_FILE_SHA1, FIELD_FINGERPRINTED,
-                                    FIELD_HASH, FIELD_OFFSET, FIELD_SONG_ID,
+from dejavu.database_handler.connection_pool import ConnectionPool
+from dejavu.config.settings import (CATALOG_TABLENAME, DATABASE_POOL_MAX_IDLE,
+                                    DATABASE_POOL_SIZE, FIELD_FILE_SHA1,
+                                    FIELD_FINGERPRINTED, FIELD_HASH,
+                                    FIELD_OFFSET, FIELD_SETTING, FIELD_SONG_ID,
                                     FIELD_SONGNAME, FIELD_TOTAL_HASHES, FIELD_PUBLISHER, FIELD_SONG_LENGTH,
-                                    FIELD_SINGER, FIELD_ALBUM, FIELD_PUBLICTIME,
+                                    FIELD_SINGER, FIELD_ALBUM, FIELD_PUBLICTIME, FIELD_VALUE,
+                                    FINGERPRINTS_QUERY_TABLENAME,
+                                    FINGERPRINTS_REBUILD_TABLENAME,
+                                    FINGERPRINTS_STAGING_TABLENAME,
                                     FINGERPRINTS_TABLENAME, SONGS_TABLENAME)
 
 from dejavu.third_party.dejavu_timer import DejavuTimer
@@ -14,6 +26,8 @@ from dejavu.third_party.dejavu_timer import DejavuTimer
 class MySQLDatabase(CommonDatabase):
     type = "mysql"
 
+    CONNECTION_ERRORS = (OperationalError, InterfaceError)
+
     # CREATES
     CREATE_SONGS_TABLE = f"""
         CREATE TABLE IF NOT EXISTS `{SONGS_TABLENAME}` (
@@ -49,6 +63,48 @@ class MySQLDatabase(CommonDatabase):
     ) ENGINE=INNODB;
     """
 
+    # Same table without its indexes and constraints, used during an initial build.
+    CREATE_FINGERPRINTS_TABLE_UNINDEXED = f"""
+        CREATE TABLE IF NOT EXISTS `{FINGERPRINTS_TABLENAME}` (
+            `{FIELD_HASH}` BINARY(10) NOT NULL
+        ,   `{FIELD_SONG_ID}` MEDIUMINT UNSIGNED NOT NULL
+        ,   `{FIELD_OFFSET}` INT UNSIGNED NOT NULL
+        ,   `date_created` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ,   `date_modified` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    ) ENGINE=INNODB;
+    """
+
+    CREATE_CATALOG_TABLE = f"""
+        CREATE TABLE IF NOT EXISTS `{CATALOG_TABLENAME}` (
+            `{FIELD_SETTING}` VARCHAR(64) NOT NULL
+        ,   `{FIELD_VALUE}` VARCHAR(250) NOT NULL
+        ,   CONSTRAINT `pk_{CATALOG_TABLENAME}_{FIELD_SETTING}` PRIMARY KEY (`{FIELD_SETTING}`)
+        ) ENGINE=INNODB;
+    """
+
+    CREATE_FINGERPRINTS_STAGING = f"""
+        CREATE TEMPORARY TABLE `{FINGERPRINTS_STAGING_TABLENAME}` (
+            `{FIELD_HASH}` BINARY(10) NOT NULL
+        ,   `{FIELD_SONG_ID}` MEDIUMINT UNSIGNED NOT NULL
+        ,   `{FIELD_OFFSET}` INT UNSIGNED NOT NULL
+        ) ENGINE=INNODB;
+    """
+
+    CREATE_FINGERPRINTS_QUERY = f"""
+        CREATE TEMPORARY TABLE `{FINGERPRINTS_QUERY_TABLENAME}` (
+            `{FIELD_HASH}` BINARY(10) NOT NULL
+        ,   PRIMARY KEY (`{FIELD_HASH}`)
+        ) ENGINE=MEMORY;
+    """
+
+    CREATE_FINGERPRINTS_QUERY_OFFSETS = f"""
+        CREATE TEMPORARY TABLE `{FINGERPRINTS_QUERY_TABLENAME}` (
+            `{FIELD_HASH}` BINARY(10) NOT NULL
+        ,   `{FIELD_OFFSET}` INT NOT NULL
+        ,   INDEX (`{FIELD_HASH}`)
+        ) ENGINE=MEMORY;
+    """
+
     # INSERTS (IGNORES DUPLICATES)
     INSERT_FINGERPRINT = f"""
         INSERT IGNORE INTO `{FINGERPRINTS_TABLENAME}` (
@@ -64,6 +120,37 @@ class MySQLDatabase(CommonDatabase):
         VALUES (%s, UNHEX(%s), %s, %s, %s, %s, %s, %s);
     """
 
+    IMPORT_SONG = f"""
+        INSERT IGNORE INTO `{SONGS_TABLENAME}` (`{FIELD_SONG_ID}`, `{FIELD_SONGNAME}`, `{FIELD_FINGERPRINTED}`,
+            `{FIELD_FILE_SHA1}`, `{FIELD_TOTAL_HASHES}`, `{FIELD_PUBLISHER}`, `{FIELD_SONG_LENGTH}`, `{FIELD_SINGER}`,
+            `{FIELD_ALBUM}`, `{FIELD_PUBLICTIME}`)
+        VALUES (%s, %s, %s, UNHEX(%s), %s, %s, %s, %s, %s, %s);
+    """
+
+    INSERT_CATALOG_SETTING = f"""
+        INSERT IGNORE INTO `{CATALOG_TABLENAME}` (`{FIELD_SETTING}`, `{FIELD_VALUE}`) VALUES (%s, %s);
+    """
+
+    LOAD_FINGERPRINTS_STAGING = f"""
+        LOAD DATA LOCAL INFILE %s INTO TABLE `{FINGERPRINTS_STAGING_TABLENAME}`
+        (`{FIELD_SONG_ID}`, @hash, `{FIELD_OFFSET}`)
+        SET `{FIELD_HASH}` = UNHEX(@hash);
+    """
+
+    MERGE_FINGERPRINTS_STAGING = f"""
+        INSERT IGNORE INTO `{FINGERPRINTS_TABLENAME}` (`{FIELD_SONG_ID}`, `{FIELD_HASH}`, `{FIELD_OFFSET}`)
+        SELECT `{FIELD_SONG_ID}`, `{FIELD_HASH}`, `{FIELD_OFFSET}`
+        FROM `{FINGERPRINTS_STAGING_TABLENAME}`;
+    """
+
+    INSERT_FINGERPRINTS_QUERY = f"""
+        INSERT IGNORE INTO `{FINGERPRINTS_QUERY_TABLENAME}` (`{FIELD_HASH}`) VALUES (UNHEX(%s));
+    """
+
+    INSERT_FINGERPRINTS_QUERY_OFFSET = f"""
+        INSERT INTO `{FINGERPRINTS_QUERY_TABLENAME}` (`{FIELD_HASH}`, `{FIELD_OFFSET}`) VALUES (UNHEX(%s), %s);
+    """
+
     # SELECTS
     SELECT = f"""
         SELECT `{FIELD_SONG_ID}`, `{FIELD_OFFSET}`
@@ -77,8 +164,67 @@ class MySQLDatabase(CommonDatabase):
         WHERE `{FIELD_HASH}` IN (%s);
     """
 
+    SELECT_MATCHES = f"""
+        SELECT HEX(f.`{FIELD_HASH}`), f.`{FIELD_SONG_ID}`, f.`{FIELD_OFFSET}`
+        FROM `{FINGERPRINTS_QUERY_TABLENAME}` AS q
+        INNER JOIN `{FINGERPRINTS_TABLENAME}` AS f ON f.`{FIELD_HASH}` = q.`{FIELD_HASH}`;
+    """
+
+    # the offsets are aligned in the database (window functions need MySQL 8.0).
+    SELECT_ALIGNED_MATCHES = f"""
+        WITH matched AS (
+            SELECT
+                f.`{FIELD_SONG_ID}`
+            ,   f.`{FIELD_HASH}`
+            ,   f.`{FIELD_OFFSET}`
+            ,   CAST(f.`{FIELD_OFFSET}` AS SIGNED) - q.`{FIELD_OFFSET}` AS `offset_difference`
+            FROM `{FINGERPRINTS_QUERY_TABLENAME}` AS q
+            INNER JOIN `{FINGERPRINTS_TABLENAME}` AS f ON f.`{FIELD_HASH}` = q.`{FIELD_HASH}`
+        )
+    ,   candidates AS (
+            SELECT
+                `{FIELD_SONG_ID}`
+            ,   `offset_difference`
+            ,   COUNT(*) AS `count`
+            ,   ROW_NUMBER() OVER (
+                    PARTITION BY `{FIELD_SONG_ID}` ORDER BY COUNT(*) DESC, `offset_difference`
+                ) AS `candidate`
+            FROM matched
+            GROUP BY `{FIELD_SONG_ID}`, `offset_difference`
+        )
+    ,   hashes_matched AS (
+            SELECT `{FIELD_SONG_ID}`, COUNT(DISTINCT `{FIELD_HASH}`, `{FIELD_OFFSET}`) AS `count`
+            FROM matched
+            GROUP BY `{FIELD_SONG_ID}`
+        )
+        SELECT c.`{FIELD_SONG_ID}`, c.`offset_difference`, c.`count`, h.`count`
+        FROM candidates AS c
+        INNER JOIN hashes_matched AS h ON h.`{FIELD_SONG_ID}` = c.`{FIELD_SONG_ID}`
+        WHERE c.`candidate` = 1
+        ORDER BY c.`count` DESC, c.`{FIELD_SONG_ID}`
+        LIMIT %s;
+    """
+
     SELECT_ALL = f"SELECT `{FIELD_SONG_ID}`, `{FIELD_OFFSET}` FROM `{FINGERPRINTS_TABLENAME}`;"
 
+    SELECT_ALL_ORDERED = f"""
+        SELECT HEX(`{FIELD_HASH}`), `{FIELD_SONG_ID}`, `{FIELD_OFFSET}`
+        FROM `{FINGERPRINTS_TABLENAME}`
+        ORDER BY `{FIELD_HASH}`, `{FIELD_SONG_ID}`, `{FIELD_OFFSET}`;
+    """
+
+    # hashes having more fingerprints than the threshold given, with their amount of fingerprints.
+    SELECT_FREQUENT_HASHES = f"""
+        SELECT HEX(`{FIELD_HASH}`), COUNT(*)
+        FROM `{FINGERPRINTS_TABLENAME}`
+        GROUP BY `{FIELD_HASH}`
+        HAVING COUNT(*) > %s;
+    """
+
+    SELECT_ANY_FINGERPRINT = f"SELECT 1 FROM `{FINGERPRINTS_TABLENAME}` LIMIT 1;"
+
+    SELECT_CATALOG = f"SELECT `{FIELD_SETTING}`, `{FIELD_VALUE}` FROM `{CATALOG_TABLENAME}`;"
+
     SELECT_SONG = f"""
         SELECT `{FIELD_SONGNAME}`, `{FIELD_PUBLISHER}`, `{FIELD_SONG_LENGTH}`, `{FIELD_SINGER}`, `{FIELD_ALBUM}`,
         `{FIELD_PUBLICTIME}`, HEX(`{FIELD_FILE_SHA1}`) AS `{FIELD_FILE_SHA1}`, `{FIELD_TOTAL_HASHES}`
@@ -122,6 +268,9 @@ class MySQLDatabase(CommonDatabase):
     # DROPS
     DROP_FINGERPRINTS = f"DROP TABLE IF EXISTS `{FINGERPRINTS_TABLENAME}`;"
     DROP_SONGS = f"DROP TABLE IF EXISTS `{SONGS_TABLENAME}`;"
+    DROP_CATALOG = f"DROP TABLE IF EXISTS `{CATALOG_TABLENAME}`;"
+    DROP_FINGERPRINTS_STAGING = f"DROP TEMPORARY TABLE IF EXISTS `{FINGERPRINTS_STAGING_TABLENAME}`;"
+    DROP_FINGERPRINTS_QUERY = f"DROP TEMPORARY TABLE IF EXISTS `{FINGERPRINTS_QUERY_TABLENAME}`;"
 
     # UPDATE
     UPDATE_SONG_FINGERPRINTED = f"""
@@ -137,18 +286,170 @@ class MySQLDatabase(CommonDatabase):
         DELETE FROM `{SONGS_TABLENAME}` WHERE `{FIELD_SONG_ID}` IN (%s);
     """
 
+    # INITIAL BUILD
+    SET_PARALLEL_MAINTENANCE = "SET SESSION innodb_ddl_threads = %s;"
+
+    # Run in order by finish_initial_build, the indexes and constraints get the same names setup() gives them.
+    FINISH_INITIAL_BUILD = [
+        # duplicates and fingerprints whose song was deleted (no foreign key cascades during the build) are
+        # left out while copying the table once, InnoDB has nothing like a row address to delete them in place.
+        f"DROP TABLE IF EXISTS `{FINGERPRINTS_REBUILD_TABLENAME}`;",
+        f"CREATE TABLE `{FINGERPRINTS_REBUILD_TABLENAME}` LIKE `{FINGERPRINTS_TABLENAME}`;",
+        f"""
+            INSERT INTO `{FINGERPRINTS_REBUILD_TABLENAME}` (
+                `{FIELD_HASH}`, `{FIELD_SONG_ID}`, `{FIELD_OFFSET}`, `date_created`, `date_modified`
+            )
+            SELECT f.`{FIELD_HASH}`, f.`{FIELD_SONG_ID}`, f.`{FIELD_OFFSET}`, MIN(f.`date_created`)
+            ,   MAX(f.`date_modified`)
+            FROM `{FINGERPRINTS_TABLENAME}` AS f
+            INNER JOIN `{SONGS_TABLENAME}` AS s ON s.`{FIELD_SONG_ID}` = f.`{FIELD_SONG_ID}`
+            GROUP BY f.`{FIELD_SONG_ID}`, f.`{FIELD_OFFSET}`, f.`{FIELD_HASH}`;
+        """,
+        f"DROP TABLE `{FINGERPRINTS_TABLENAME}`;",
+        f"RENAME TABLE `{FINGERPRINTS_REBUILD_TABLENAME}` TO `{FINGERPRINTS_TABLENAME}`;",
+        # both indexes are built in place with a single sorted pass over the table.
+        f"""
+            ALTER TABLE `{FINGERPRINTS_TABLENAME}`
+                ADD INDEX `ix_{FINGERPRINTS_TABLENAME}_{FIELD_HASH}` (`{FIELD_HASH}`)
+            ,   ADD CONSTRAINT `uq_{FINGERPRINTS_TABLENAME}_{FIELD_SONG_ID}_{FIELD_OFFSET}_{FIELD_HASH}`
+                    UNIQUE KEY  (`{FIELD_SONG_ID}`, `{FIELD_OFFSET}`, `{FIELD_HASH}`);
+        """,
+        # the rows were already checked against the songs above, skipping the checks keeps the foreign key
+        # from copying the whole table again.
+        "SET SESSION foreign_key_checks = 0;",
+        f"""
+            ALTER TABLE `{FINGERPRINTS_TABLENAME}`
+                ADD CONSTRAINT `fk_{FINGERPRINTS_TABLENAME}_{FIELD_SONG_ID}` FOREIGN KEY (`{FIELD_SONG_ID}`)
+                    REFERENCES `{SONGS_TABLENAME}`(`{FIELD_SONG_ID}`) ON DELETE CASCADE;
+        """,
+        "SET SESSION foreign_key_checks = 1;",
+        f"ANALYZE TABLE `{FINGERPRINTS_TABLENAME}`;"
+    ]
+
     # IN
     IN_MATCH = f"UNHEX(%s)"
 
+    # PACKED FINGERPRINT FORMAT (hashes are stored as plain integers)
+    PACKED_STATEMENTS = {
+        "CREATE_FINGERPRINTS_TABLE": f"""
+            CREATE TABLE IF NOT EXISTS `{FINGERPRINTS_TABLENAME}` (
+                `{FIELD_HASH}` BIGINT NOT NULL
+            ,   `{FIELD_SONG_ID}` MEDIUMINT UNSIGNED NOT NULL
+            ,   `{FIELD_OFFSET}` INT UNSIGNED NOT NULL
+            ,   `date_created` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+            ,   `date_modified` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+            ,   INDEX `ix_{FINGERPRINTS_TABLENAME}_{FIELD_HASH}` (`{FIELD_HASH}`)
+            ,   CONSTRAINT `uq_{FINGERPRINTS_TABLENAME}_{FIELD_SONG_ID}_{FIELD_OFFSET}_{FIELD_HASH}`
+                    UNIQUE KEY  (`{FIELD_SONG_ID}`, `{FIELD_OFFSET}`, `{FIELD_HASH}`)
+            ,   CONSTRAINT `fk_{FINGERPRINTS_TABLENAME}_{FIELD_SONG_ID}` FOREIGN KEY (`{FIELD_SONG_ID}`)
+                    REFERENCES `{SONGS_TABLENAME}`(`{FIELD_SONG_ID}`) ON DELETE CASCADE
+        ) ENGINE=INNODB;
+        """,
+        "CREATE_FINGERPRINTS_TABLE_UNINDEXED": f"""
+            CREATE TABLE IF NOT EXISTS `{FINGERPRINTS_TABLENAME}` (
+                `{FIELD_HASH}` BIGINT NOT NULL
+            ,   `{FIELD_SONG_ID}` MEDIUMINT UNSIGNED NOT NULL
+            ,   `{FIELD_OFFSET}` INT UNSIGNED NOT NULL
+            ,   `date_created` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+            ,   `date_modified` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=INNODB;
+        """,
+        "CREATE_FINGERPRINTS_STAGING": f"""
+            CREATE TEMPORARY TABLE `{FINGERPRINTS_STAGING_TABLENAME}` (
+                `{FIELD_HASH}` BIGINT NOT NULL
+            ,   `{FIELD_SONG_ID}` MEDIUMINT UNSIGNED NOT NULL
+            ,   `{FIELD_OFFSET}` INT UNSIGNED NOT NULL
+            ) ENGINE=INNODB;
+        """,
+        "LOAD_FINGERPRINTS_STAGING": f"""
+            LOAD DATA LOCAL INFILE %s INTO TABLE `{FINGERPRINTS_STAGING_TABLENAME}`
+            (`{FIELD_SONG_ID}`, `{FIELD_HASH}`, `{FIELD_OFFSET}`);
+        """,
+        "CREATE_FINGERPRINTS_QUERY": f"""
+            CREATE TEMPORARY TABLE `{FINGERPRINTS_QUERY_TABLENAME}` (
+                `{FIELD_HASH}` BIGINT NOT NULL
+            ,   PRIMARY KEY (`{FIELD_HASH}`)
+            ) ENGINE=MEMORY;
+        """,
+        "INSERT_FINGERPRINTS_QUERY": f"""
+            INSERT IGNORE INTO `{FINGERPRINTS_QUERY_TABLENAME}` (`{FIELD_HASH}`) VALUES (%s);
+        """,
+        "SELECT_MATCHES": f"""
+            SELECT f.`{FIELD_HASH}`, f.`{FIELD_SONG_ID}`, f.`{FIELD_OFFSET}`
+            FROM `{FINGERPRINTS_QUERY_TABLENAME}` AS q
+            INNER JOIN `{FINGERPRINTS_TABLENAME}` AS f ON f.`{FIELD_HASH}` = q.`{FIELD_HASH}`;
+        """,
+        "CREATE_FINGERPRINTS_QUERY_OFFSETS": f"""
+            CREATE TEMPORARY TABLE `{FINGERPRINTS_QUERY_TABLENAME}` (
+                `{FIELD_HASH}` BIGINT NOT NULL
+            ,   `{FIELD_OFFSET}` INT NOT NULL
+            ,   INDEX (`{FIELD_HASH}`)
+            ) ENGINE=MEMORY;
+        """,
+        "INSERT_FINGERPRINTS_QUERY_OFFSET": f"""
+            INSERT INTO `{FINGERPRINTS_QUERY_TABLENAME}` (`{FIELD_HASH}`, `{FIELD_OFFSET}`) VALUES (%s, %s);
+        """,
+        "INSERT_FINGERPRINT": f"""
+            INSERT IGNORE INTO `{FINGERPRINTS_TABLENAME}` (
+                    `{FIELD_SONG_ID}`
+                ,   `{FIELD_HASH}`
+                ,   `{FIELD_OFFSET}`)
+            VALUES (%s, %s, %s);
+        """,
+        "SELECT": f"""
+            SELECT `{FIELD_SONG_ID}`, `{FIELD_OFFSET}`
+            FROM `{FINGERPRINTS_TABLENAME}`
+            WHERE `{FIELD_HASH}` = %s;
+        """,
+        "SELECT_MULTIPLE": f"""
+            SELECT `{FIELD_HASH}`, `{FIELD_SONG_ID}`, `{FIELD_OFFSET}`
+            FROM `{FINGERPRINTS_TABLENAME}`
+            WHERE `{FIELD_HASH}` IN (%s);
+        """,
+        "SELECT_FREQUENT_HASHES": f"""
+            SELECT `{FIELD_HASH}`, COUNT(*)
+            FROM `{FINGERPRINTS_TABLENAME}`
+            GROUP BY `{FIELD_HASH}`
+            HAVING COUNT(*) > %s;
+        """,
+        "SELECT_ALL_ORDERED": f"""
+            SELECT `{FIELD_HASH}`, `{FIELD_SONG_ID}`, `{FIELD_OFFSET}`
+            FROM `{FINGERPRINTS_TABLENAME}`
+            ORDER BY `{FIELD_HASH}`, `{FIELD_SONG_ID}`, `{FIELD_OFFSET}`;
+        """,
+        "IN_MATCH": "%s"
+    }
+
     def __init__(self, **options):
         super().__init__()
-        self.cursor = cursor_factory(**options)
+        self._set_options(options)
+
+    def _set_options(self, options) -> None:
         self._options = options
+        connection_options = dict(options)
+        # "bulk_load" switches insert_hashes to LOAD DATA LOCAL INFILE, it isn't a connection option
+        # but it requires local infile to be allowed on the connection (and the server).
+        self.bulk_load = connection_options.pop("bulk_load", False)
+        if self.bulk_load:
+            connection_options["allow_local_infile"] = True
+        # connections are pooled per instance, shared by its copies and threads.
+        pool_size = connection_options.pop("pool_size", DATABASE_POOL_SIZE)
+        pool_max_idle = connection_options.pop("pool_max_idle", DATABASE_POOL_MAX_IDLE)
+        self.pool = ConnectionPool(partial(mysql.connector.connect, **connection_options), is_alive, size=pool_size,
+                                   max_idle=pool_max_idle)
+        self.cursor = cursor_factory(self.pool)
+
+    def set_parallel_maintenance(self, cur, workers: int) -> None:
+        try:
+            super().set_parallel_maintenance(cur, workers)
+        except DatabaseError:
+            # innodb_ddl_threads only exists since MySQL 8.0.27, older servers build indexes with a single thread.
+            pass
 
     def after_fork(self) -> None:
-        # Clear the cursor cache, we don't want any stale connections from
+        # Forget the pooled connections, we don't want any stale connections from
         # the previous process.
-        Cursor.clear_cache()
+        self.pool.reset()
 
     def insert_song(self, song_name: str, file_hash: str, total_hashes: int, song_publisher: str = '',
                     song_length: float = 0, song_singer: str = '', song_album: str = '', song_public: str = '') -> int:
@@ -171,40 +472,114 @@ class MySQLDatabase(CommonDatabase):
                                            song_album, song_public))
             return cur.lastrowid
 
+    def load_staging(self, cur, rows: Iterable[Tuple[int, str, int]]) -> None:
+        """
+        Bulk loads fingerprints into the staging table with LOAD DATA LOCAL INFILE, from a temporary
+        tab separated file.
+
+        :param cur: an open cursor, the staging table exists and is empty.
+        :param rows: A sequence of tuples in the format (song_id, hash, offset)
+        """
+        with tempfile.NamedTemporaryFile("w", suffix=".tsv", delete=False) as f:
+            f.writelines(f"{song_id}\t{hsh}\t{offset}\n" for song_id, hsh, offset in rows)
+
+        try:
+            cur.execute(self.LOAD_FINGERPRINTS_STAGING, (f.name,))
+        finally:
+            os.remove(f.name)
+
+    def select_matches(self, cur, hashes: List[str], batch_size: int = 1000) -> Iterable[Tuple[str, int, int]]:
+        """
+        Selects the fingerprints having any of the given hashes by inserting them into a temporary table
+        joined with the fingerprints table, which takes the same few statements whatever the amount of hashes.
+
+        :param cur: an open cursor.
+        :param hashes: the distinct hashes searched.
+        :param batch_size: number of hashes per insert into the temporary table.
+        :return: the (hash, song id, offset) of every fingerprint matched.
+        """
+        # a connection reused from the pool may still hold the table of a failed query.
+        cur.execute(self.DROP_FINGERPRINTS_QUERY)
+        cur.execute(self.CREATE_FINGERPRINTS_QUERY)
+        for index in range(0, len(hashes), batch_size):
+            # executemany sends each batch as a single multiple row insert.
+            cur.executemany(self.INSERT_FINGERPRINTS_QUERY, [(hsh,) for hsh in hashes[index: index + batch_size]])
+        cur.execute(self.SELECT_MATCHES)
+        rows = cur.fetchall()
+        cur.execute(self.DROP_FINGERPRINTS_QUERY)
+        return rows
+
+    def select_aligned_matches(self, cur, hashes: List[Tuple[str, int]], topn: int,
+                               batch_size: int = 1000) -> Iterable[Tuple[int, int, int, int]]:
+        """
+        Aligns the fingerprints matching the given (hash, offset) pairs by inserting them into a temporary
+        table joined with the fingerprints table.
+
+        :param cur: an open cursor.
+        :param hashes: the distinct (hash, offset) pairs of the query.
+        :param topn: number of songs returned.
+        :param batch_size: number of pairs per insert into the temporary table.
+        :return: the (song id, offset difference, count, hashes matched) of the best candidate of each
+         of the topn songs.
+        """
+        # a connection reused from the pool may still hold the table of a failed query.
+        cur.execute(self.DROP_FINGERPRINTS_QUERY)
+        cur.execute(self.CREATE_FINGERPRINTS_QUERY_OFFSETS)
+        for index in range(0, len(hashes), batch_size):
+            cur.executemany(self.INSERT_FINGERPRINTS_QUERY_OFFSET, hashes[index: index + batch_size])
+        cur.execute(self.SELECT_ALIGNED_MATCHES, (topn,))
+        rows = cur.fetchall()
+        cur.execute(self.DROP_FINGERPRINTS_QUERY)
+        return rows
+
+    def __copy__(self):
+        # copies (e.g. the ingestion writers' ones) check connections out of the same pool.
+        clone = self.__class__.__new__(self.__class__)
+        clone.__dict__.update(self.__dict__)
+        clone.catalog_settings = dict(self.catalog_settings)
+        return clone
+
     def __getstate__(self):
-        return self._options,
+        return self._options, self.fingerprint_format, self.catalog_settings
 
     def __setstate__(self, state):
-        self._options, = state
-        self.cursor = cursor_factory(**self._options)
+        options, fingerprint_format, self.catalog_settings = state
+        self._set_options(options)
+        self.set_fingerprint_format(fingerprint_format)
 
 
-def cursor_factory(**factory_options):
+def cursor_factory(pool: ConnectionPool):
     def cursor(**options):
-        options.update(factory_options)
-        return Cursor(**options)
+        return Cursor(pool, **options)
     return cursor
 
 
+def is_alive(conn) -> bool:
+    return conn.is_connected()
+
+
 class Cursor(object):
     """
-    Establishes a connection to the database and returns an open cursor.
+    Checks a connection out of the pool and returns an open cursor. The transaction is committed
+    on exit and the connection given back to the pool, unless an exception was raised: the transaction
+    is then rolled back and the connection discarded, as it may be broken or hold session state.
     # Use as context manager
-    with Cursor() as cur:
+    with Cursor(pool) as cur:
         cur.execute(query)
         ...
     """
 
     @DejavuTimer(name=__name__ + ".Cursor.__init__()\t\t[agg]")
-    def __init__(self, dictionary=False, **options):
+    def __init__(self, pool: ConnectionPool, dictionary=False, buffered=False, server_side=False):
         super().__init__()
-        #  https://dev.mysql.com/doc/connector-python/en/connector-python-connection-pooling.html
-        options.update({'pool_name': "dejavu-pool", 'pool_size': 1})
-        self.conn = mysql.connector.connect(**options)  # Cursor._conn
+        self.pool = pool
+        self.conn = pool.acquire()
         self.dictionary = dictionary
+        # unbuffered cursors already stream the result, "server_side" is there for PostgreSQL compatibility.
+        self.buffered = buffered
 
     def __enter__(self):
-        self.cursor = self.conn.cursor(dictionary=self.dictionary)
+        self.cursor = self.conn.cursor(dictionary=self.dictionary, buffered=self.buffered)
         return self
 
     @DejavuTimer(name=__name__ + ".Cursor.execute()\t\t\t[agg]")
@@ -222,6 +597,9 @@ class Cursor(object):
     def fetchall(self):
         return self.cursor.fetchall()
 
+    def fetchmany(self, size=1):
+        return self.cursor.fetchmany(size)
+
     @property
     def lastrowid(self):
         return self.cursor.lastrowid
@@ -233,10 +611,16 @@ class Cursor(object):
         return self.cursor.__next__()
 
     def __exit__(self, extype, exvalue, traceback):
-        # if we had a MySQL related error we try to rollback the cursor.
-        if extype is DatabaseError:
-            self.cursor.rollback()
-
-        self.cursor.close()
-        self.conn.commit()
-        self.conn.close()
+        if extype is not None:
+            # the connection may be broken, closing it rolls the transaction back.
+            self.pool.release(self.conn, discard=True)
+            return
+
+        try:
+            self.cursor.close()
+            self.conn.commit()
+        except mysql.connector.Error:
+            self.pool.release(self.conn, discard=True)
+            raise
+
+        self.pool.release(self.conn)
@@ -1,19 +1,28 @@
-import queue
+import io
+from functools import partial
+from typing import Dict, Iterable, List, Tuple
 
 import psycopg2
 from psycopg2.extras import DictCursor
 
 from dejavu.base_classes.common_database import CommonDatabase
-from dejavu.config.settings import (FIELD_FILE_SHA1, FIELD_FINGERPRINTED,
-                                    FIELD_HASH, FIELD_OFFSET, FIELD_SONG_ID,
+from dejavu.database_handler.connection_pool import ConnectionPool
+from dejavu.config.settings import (CATALOG_TABLENAME, DATABASE_POOL_MAX_IDLE,
+                                    DATABASE_POOL_SIZE, FIELD_FILE_SHA1,
+                                    FIELD_FINGERPRINTED, FIELD_HASH,
+                                    FIELD_OFFSET, FIELD_SETTING, FIELD_SONG_ID,
                                     FIELD_SONGNAME, FIELD_TOTAL_HASHES, FIELD_PUBLISHER, FIELD_SONG_LENGTH,
-                                    FIELD_SINGER, FIELD_ALBUM, FIELD_PUBLICTIME,
-                                    FINGERPRINTS_TABLENAME, SONGS_TABLENAME)
+                                    FIELD_SINGER, FIELD_ALBUM, FIELD_PUBLICTIME, FIELD_VALUE,
+                                    FINGERPRINTS_STAGING_TABLENAME,
+                                    FINGERPRINTS_TABLENAME, FINGERPRINT_FORMAT_SHA1,
+                                    SONGS_TABLENAME)
 
 
 class PostgreSQLDatabase(CommonDatabase):
     type = "postgres"
 
+    CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
     # CREATES
     CREATE_SONGS_TABLE = f"""
         CREATE TABLE IF NOT EXISTS "{SONGS_TABLENAME}" (
@@ -55,6 +64,33 @@ class PostgreSQLDatabase(CommonDatabase):
         USING hash ("{FIELD_HASH}");
     """
 
+    # Same table without its constraints and index, used during an initial build.
+    CREATE_FINGERPRINTS_TABLE_UNINDEXED = f"""
+        CREATE TABLE IF NOT EXISTS "{FINGERPRINTS_TABLENAME}" (
+            "{FIELD_HASH}" BYTEA NOT NULL
+        ,   "{FIELD_SONG_ID}" INT NOT NULL
+        ,   "{FIELD_OFFSET}" INT NOT NULL
+        ,   "date_created" TIMESTAMP NOT NULL DEFAULT now()
+        ,   "date_modified" TIMESTAMP NOT NULL DEFAULT now()
+        );
+    """
+
+    CREATE_CATALOG_TABLE = f"""
+        CREATE TABLE IF NOT EXISTS "{CATALOG_TABLENAME}" (
+            "{FIELD_SETTING}" VARCHAR(64) NOT NULL
+        ,   "{FIELD_VALUE}" VARCHAR(250) NOT NULL
+        ,   CONSTRAINT "pk_{CATALOG_TABLENAME}_{FIELD_SETTING}" PRIMARY KEY ("{FIELD_SETTING}")
+        );
+    """
+
+    CREATE_FINGERPRINTS_STAGING = f"""
+        CREATE TEMPORARY TABLE "{FINGERPRINTS_STAGING_TABLENAME}" (
+            "{FIELD_HASH}" BYTEA NOT NULL
+        ,   "{FIELD_SONG_ID}" INT NOT NULL
+        ,   "{FIELD_OFFSET}" INT NOT NULL
+        );
+    """
+
     # INSERTS (IGNORES DUPLICATES)
     INSERT_FINGERPRINT = f"""
         INSERT INTO "{FINGERPRINTS_TABLENAME}" (
@@ -71,6 +107,38 @@ class PostgreSQLDatabase(CommonDatabase):
         RETURNING "{FIELD_SONG_ID}";
     """
 
+    IMPORT_SONG = f"""
+        INSERT INTO "{SONGS_TABLENAME}" ("{FIELD_SONG_ID}", "{FIELD_SONGNAME}", "{FIELD_FINGERPRINTED}",
+            "{FIELD_FILE_SHA1}", "{FIELD_TOTAL_HASHES}", "{FIELD_PUBLISHER}", "{FIELD_SONG_LENGTH}", "{FIELD_SINGER}",
+            "{FIELD_ALBUM}", "{FIELD_PUBLICTIME}")
+        VALUES (%s, %s, %s, decode(%s, 'hex'), %s, %s, %s, %s, %s, %s)
+        ON CONFLICT DO NOTHING;
+    """
+
+    # songs imported with their identifiers don't advance the sequence.
+    SYNC_SONG_ID_SEQUENCE = f"""
+        SELECT setval(
+            pg_get_serial_sequence('"{SONGS_TABLENAME}"', '{FIELD_SONG_ID}')
+        ,   GREATEST((SELECT MAX("{FIELD_SONG_ID}") FROM "{SONGS_TABLENAME}"), 1)
+        );
+    """
+
+    INSERT_CATALOG_SETTING = f"""
+        INSERT INTO "{CATALOG_TABLENAME}" ("{FIELD_SETTING}", "{FIELD_VALUE}") VALUES (%s, %s)
+        ON CONFLICT DO NOTHING;
+    """
+
+    COPY_FINGERPRINTS_STAGING = f"""
+        COPY "{FINGERPRINTS_STAGING_TABLENAME}" ("{FIELD_SONG_ID}", "{FIELD_HASH}", "{FIELD_OFFSET}") FROM STDIN;
+    """
+
+    MERGE_FINGERPRINTS_STAGING = f"""
+        INSERT INTO "{FINGERPRINTS_TABLENAME}" ("{FIELD_SONG_ID}", "{FIELD_HASH}", "{FIELD_OFFSET}")
+        SELECT "{FIELD_SONG_ID}", "{FIELD_HASH}", "{FIELD_OFFSET}"
+        FROM "{FINGERPRINTS_STAGING_TABLENAME}"
+        ON CONFLICT DO NOTHING;
+    """
+
     # SELECTS
     SELECT = f"""
         SELECT "{FIELD_SONG_ID}", "{FIELD_OFFSET}"
@@ -84,8 +152,72 @@ class PostgreSQLDatabase(CommonDatabase):
         WHERE "{FIELD_HASH}" IN (%s);
     """
 
+    # all the hashes are bound at once as a single array.
+    SELECT_MATCHES = f"""
+        SELECT upper(encode(f."{FIELD_HASH}", 'hex')), f."{FIELD_SONG_ID}", f."{FIELD_OFFSET}"
+        FROM unnest(%s::text[]) AS q("{FIELD_HASH}")
+        INNER JOIN "{FINGERPRINTS_TABLENAME}" AS f ON f."{FIELD_HASH}" = decode(q."{FIELD_HASH}", 'hex');
+    """
+
+    # the query (hash, offset) pairs are bound as two arrays, the offsets are aligned in the database.
+    SELECT_ALIGNED_MATCHES = f"""
+        WITH q AS (
+            SELECT decode(h, 'hex') AS "{FIELD_HASH}", o AS "{FIELD_OFFSET}"
+            FROM unnest(%s::text[], %s::int[]) AS pairs(h, o)
+        )
+    ,   matched AS (
+            SELECT
+                f."{FIELD_SONG_ID}"
+            ,   f."{FIELD_HASH}"
+            ,   f."{FIELD_OFFSET}"
+            ,   f."{FIELD_OFFSET}" - q."{FIELD_OFFSET}" AS "offset_difference"
+            FROM q
+            INNER JOIN "{FINGERPRINTS_TABLENAME}" AS f ON f."{FIELD_HASH}" = q."{FIELD_HASH}"
+        )
+    ,   candidates AS (
+            SELECT
+                "{FIELD_SONG_ID}"
+            ,   "offset_difference"
+            ,   COUNT(*) AS "count"
+            ,   row_number() OVER (
+                    PARTITION BY "{FIELD_SONG_ID}" ORDER BY COUNT(*) DESC, "offset_difference"
+                ) AS "candidate"
+            FROM matched
+            GROUP BY "{FIELD_SONG_ID}", "offset_difference"
+        )
+    ,   hashes_matched AS (
+            SELECT "{FIELD_SONG_ID}", COUNT(DISTINCT ("{FIELD_HASH}", "{FIELD_OFFSET}")) AS "count"
+            FROM matched
+            GROUP BY "{FIELD_SONG_ID}"
+        )
+        SELECT c."{FIELD_SONG_ID}", c."offset_difference", c."count", h."count"
+        FROM candidates AS c
+        INNER JOIN hashes_matched AS h ON h."{FIELD_SONG_ID}" = c."{FIELD_SONG_ID}"
+        WHERE c."candidate" = 1
+        ORDER BY c."count" DESC, c."{FIELD_SONG_ID}"
+        LIMIT %s;
+    """
+
     SELECT_ALL = f'SELECT "{FIELD_SONG_ID}", "{FIELD_OFFSET}" FROM "{FINGERPRINTS_TABLENAME}";'
 
+    SELECT_ALL_ORDERED = f"""
+        SELECT upper(encode("{FIELD_HASH}", 'hex')), "{FIELD_SONG_ID}", "{FIELD_OFFSET}"
+        FROM "{FINGERPRINTS_TABLENAME}"
+        ORDER BY "{FIELD_HASH}", "{FIELD_SONG_ID}", "{FIELD_OFFSET}";
+    """
+
+    # hashes having more fingerprints than the threshold given, with their amount of fingerprints.
+    SELECT_FREQUENT_HASHES = f"""
+        SELECT upper(encode("{FIELD_HASH}", 'hex')), COUNT(*)
+        FROM "{FINGERPRINTS_TABLENAME}"
+        GROUP BY "{FIELD_HASH}"
+        HAVING COUNT(*) > %s;
+    """
+
+    SELECT_ANY_FINGERPRINT = f'SELECT 1 FROM "{FINGERPRINTS_TABLENAME}" LIMIT 1;'
+
+    SELECT_CATALOG = f'SELECT "{FIELD_SETTING}", "{FIELD_VALUE}" FROM "{CATALOG_TABLENAME}";'
+
     SELECT_SONG = f"""
         SELECT
             "{FIELD_SONGNAME}", `{FIELD_PUBLISHER}`, `{FIELD_SONG_LENGTH}`, `{FIELD_SINGER}`, `{FIELD_ALBUM}`
@@ -122,6 +254,8 @@ class PostgreSQLDatabase(CommonDatabase):
     # DROPS
     DROP_FINGERPRINTS = F'DROP TABLE IF EXISTS "{FINGERPRINTS_TABLENAME}";'
     DROP_SONGS = F'DROP TABLE IF EXISTS "{SONGS_TABLENAME}";'
+    DROP_CATALOG = F'DROP TABLE IF EXISTS "{CATALOG_TABLENAME}";'
+    DROP_FINGERPRINTS_STAGING = F'DROP TABLE IF EXISTS "{FINGERPRINTS_STAGING_TABLENAME}";'
 
     # UPDATE
     UPDATE_SONG_FINGERPRINTED = f"""
@@ -140,18 +274,172 @@ class PostgreSQLDatabase(CommonDatabase):
         DELETE FROM "{SONGS_TABLENAME}" WHERE "{FIELD_SONG_ID}" IN (%s);
     """
 
+    # INITIAL BUILD
+    SET_PARALLEL_MAINTENANCE = "SET max_parallel_maintenance_workers = %s;"
+
+    # Run in order by finish_initial_build, the constraints and index get the same names setup() gives them.
+    FINISH_INITIAL_BUILD = [
+        # fingerprints whose song was deleted (no foreign key cascades during the build).
+        f"""
+            DELETE FROM "{FINGERPRINTS_TABLENAME}" AS f
+            WHERE NOT EXISTS (
+                SELECT 1 FROM "{SONGS_TABLENAME}" AS s WHERE s."{FIELD_SONG_ID}" = f."{FIELD_SONG_ID}"
+            );
+        """,
+        # duplicates, keeping the first physical copy of each fingerprint.
+        f"""
+            DELETE FROM "{FINGERPRINTS_TABLENAME}"
+            WHERE ctid IN (
+                SELECT ctid
+                FROM (
+                    SELECT
+                        ctid
+                    ,   row_number() OVER (PARTITION BY "{FIELD_SONG_ID}", "{FIELD_OFFSET}", "{FIELD_HASH}") AS n
+                    FROM "{FINGERPRINTS_TABLENAME}"
+                ) AS numbered
+                WHERE n > 1
+            );
+        """,
+        f"""
+            ALTER TABLE "{FINGERPRINTS_TABLENAME}"
+                ADD CONSTRAINT "uq_{FINGERPRINTS_TABLENAME}"
+                    UNIQUE ("{FIELD_SONG_ID}", "{FIELD_OFFSET}", "{FIELD_HASH}")
+            ,   ADD CONSTRAINT "fk_{FINGERPRINTS_TABLENAME}_{FIELD_SONG_ID}" FOREIGN KEY ("{FIELD_SONG_ID}")
+                    REFERENCES "{SONGS_TABLENAME}"("{FIELD_SONG_ID}") ON DELETE CASCADE;
+        """,
+        CREATE_FINGERPRINTS_TABLE_INDEX,
+        f'ANALYZE "{FINGERPRINTS_TABLENAME}";'
+    ]
+
     # IN
     IN_MATCH = f"decode(%s, 'hex')"
 
+    # PACKED FINGERPRINT FORMAT (hashes are stored as plain integers)
+    PACKED_STATEMENTS = {
+        "CREATE_FINGERPRINTS_TABLE": f"""
+            CREATE TABLE IF NOT EXISTS "{FINGERPRINTS_TABLENAME}" (
+                "{FIELD_HASH}" BIGINT NOT NULL
+            ,   "{FIELD_SONG_ID}" INT NOT NULL
+            ,   "{FIELD_OFFSET}" INT NOT NULL
+            ,   "date_created" TIMESTAMP NOT NULL DEFAULT now()
+            ,   "date_modified" TIMESTAMP NOT NULL DEFAULT now()
+            ,   CONSTRAINT "uq_{FINGERPRINTS_TABLENAME}" UNIQUE  ("{FIELD_SONG_ID}", "{FIELD_OFFSET}", "{FIELD_HASH}")
+            ,   CONSTRAINT "fk_{FINGERPRINTS_TABLENAME}_{FIELD_SONG_ID}" FOREIGN KEY ("{FIELD_SONG_ID}")
+                    REFERENCES "{SONGS_TABLENAME}"("{FIELD_SONG_ID}") ON DELETE CASCADE
+            );
+
+            CREATE INDEX IF NOT EXISTS "ix_{FINGERPRINTS_TABLENAME}_{FIELD_HASH}" ON "{FINGERPRINTS_TABLENAME}"
+            USING hash ("{FIELD_HASH}");
+        """,
+        "CREATE_FINGERPRINTS_TABLE_UNINDEXED": f"""
+            CREATE TABLE IF NOT EXISTS "{FINGERPRINTS_TABLENAME}" (
+                "{FIELD_HASH}" BIGINT NOT NULL
+            ,   "{FIELD_SONG_ID}" INT NOT NULL
+            ,   "{FIELD_OFFSET}" INT NOT NULL
+            ,   "date_created" TIMESTAMP NOT NULL DEFAULT now()
+            ,   "date_modified" TIMESTAMP NOT NULL DEFAULT now()
+            );
+        """,
+        "CREATE_FINGERPRINTS_STAGING": f"""
+            CREATE TEMPORARY TABLE "{FINGERPRINTS_STAGING_TABLENAME}" (
+                "{FIELD_HASH}" BIGINT NOT NULL
+            ,   "{FIELD_SONG_ID}" INT NOT NULL
+            ,   "{FIELD_OFFSET}" INT NOT NULL
+            );
+        """,
+        "INSERT_FINGERPRINT": f"""
+            INSERT INTO "{FINGERPRINTS_TABLENAME}" (
+                    "{FIELD_SONG_ID}"
+                ,   "{FIELD_HASH}"
+                ,   "{FIELD_OFFSET}")
+            VALUES (%s, %s, %s) ON CONFLICT DO NOTHING;
+        """,
+        "SELECT": f"""
+            SELECT "{FIELD_SONG_ID}", "{FIELD_OFFSET}"
+            FROM "{FINGERPRINTS_TABLENAME}"
+            WHERE "{FIELD_HASH}" = %s;
+        """,
+        "SELECT_MULTIPLE": f"""
+            SELECT "{FIELD_HASH}", "{FIELD_SONG_ID}", "{FIELD_OFFSET}"
+            FROM "{FINGERPRINTS_TABLENAME}"
+            WHERE "{FIELD_HASH}" IN (%s);
+        """,
+        "SELECT_FREQUENT_HASHES": f"""
+            SELECT "{FIELD_HASH}", COUNT(*)
+            FROM "{FINGERPRINTS_TABLENAME}"
+            GROUP BY "{FIELD_HASH}"
+            HAVING COUNT(*) > %s;
+        """,
+        "SELECT_ALL_ORDERED": f"""
+            SELECT "{FIELD_HASH}", "{FIELD_SONG_ID}", "{FIELD_OFFSET}"
+            FROM "{FINGERPRINTS_TABLENAME}"
+            ORDER BY "{FIELD_HASH}", "{FIELD_SONG_ID}", "{FIELD_OFFSET}";
+        """,
+        "SELECT_MATCHES": f"""
+            SELECT f."{FIELD_HASH}", f."{FIELD_SONG_ID}", f."{FIELD_OFFSET}"
+            FROM unnest(%s::bigint[]) AS q("{FIELD_HASH}")
+            INNER JOIN "{FINGERPRINTS_TABLENAME}" AS f ON f."{FIELD_HASH}" = q."{FIELD_HASH}";
+        """,
+        "SELECT_ALIGNED_MATCHES": f"""
+            WITH q AS (
+                SELECT h AS "{FIELD_HASH}", o AS "{FIELD_OFFSET}"
+                FROM unnest(%s::bigint[], %s::int[]) AS pairs(h, o)
+            )
+        ,   matched AS (
+                SELECT
+                    f."{FIELD_SONG_ID}"
+                ,   f."{FIELD_HASH}"
+                ,   f."{FIELD_OFFSET}"
+                ,   f."{FIELD_OFFSET}" - q."{FIELD_OFFSET}" AS "offset_difference"
+                FROM q
+                INNER JOIN "{FINGERPRINTS_TABLENAME}" AS f ON f."{FIELD_HASH}" = q."{FIELD_HASH}"
+            )
+        ,   candidates AS (
+                SELECT
+                    "{FIELD_SONG_ID}"
+                ,   "offset_difference"
+                ,   COUNT(*) AS "count"
+                ,   row_number() OVER (
+                        PARTITION BY "{FIELD_SONG_ID}" ORDER BY COUNT(*) DESC, "offset_difference"
+                    ) AS "candidate"
+                FROM matched
+                GROUP BY "{FIELD_SONG_ID}", "offset_difference"
+            )
+        ,   hashes_matched AS (
+                SELECT "{FIELD_SONG_ID}", COUNT(DISTINCT ("{FIELD_HASH}", "{FIELD_OFFSET}")) AS "count"
+                FROM matched
+                GROUP BY "{FIELD_SONG_ID}"
+            )
+            SELECT c."{FIELD_SONG_ID}", c."offset_difference", c."count", h."count"
+            FROM candidates AS c
+            INNER JOIN hashes_matched AS h ON h."{FIELD_SONG_ID}" = c."{FIELD_SONG_ID}"
+            WHERE c."candidate" = 1
+            ORDER BY c."count" DESC, c."{FIELD_SONG_ID}"
+            LIMIT %s;
+        """,
+        "IN_MATCH": "%s"
+    }
+
     def __init__(self, **options):
         super().__init__()
-        self.cursor = cursor_factory(**options)
+        self._set_options(options)
+
+    def _set_options(self, options) -> None:
         self._options = options
+        connection_options = dict(options)
+        # "bulk_load" switches insert_hashes to COPY, it isn't a connection option.
+        self.bulk_load = connection_options.pop("bulk_load", False)
+        # connections are pooled per instance, shared by its copies and threads.
+        pool_size = connection_options.pop("pool_size", DATABASE_POOL_SIZE)
+        pool_max_idle = connection_options.pop("pool_max_idle", DATABASE_POOL_MAX_IDLE)
+        self.pool = ConnectionPool(partial(psycopg2.connect, **connection_options), is_alive, size=pool_size,
+                                   max_idle=pool_max_idle)
+        self.cursor = cursor_factory(self.pool)
 
     def after_fork(self) -> None:
-        # Clear the cursor cache, we don't want any stale connections from
+        # Forget the pooled connections, we don't want any stale connections from
         # the previous process.
-        Cursor.clear_cache()
+        self.pool.reset()
 
     def insert_song(self, song_name: str, file_hash: str, total_hashes: int, song_publisher: str = '',
                     song_length: float = 0, song_singer: str = '', song_album: str = '', song_public: str = '') -> int:
@@ -174,65 +462,132 @@ class PostgreSQLDatabase(CommonDatabase):
                                            song_album, song_public))
             return cur.fetchone()[0]
 
+    def import_songs(self, songs: List[Dict[str, any]]) -> None:
+        """
+        Inserts songs read from another database (as get_songs returns them) keeping their identifiers,
+        songs already stored are left untouched.
+
+        :param songs: the songs info, considered fingerprinted unless they have a "fingerprinted" key.
+        """
+        super().import_songs(songs)
+        with self.cursor() as cur:
+            cur.execute(self.SYNC_SONG_ID_SEQUENCE)
+
+    def load_staging(self, cur, rows: Iterable[Tuple[int, str, int]]) -> None:
+        """
+        Bulk loads fingerprints into the staging table with COPY, streamed in text format from an
+        in-memory buffer.
+
+        :param cur: an open cursor, the staging table exists and is empty.
+        :param rows: A sequence of tuples in the format (song_id, hash, offset)
+        """
+        if self.fingerprint_format == FINGERPRINT_FORMAT_SHA1:
+            # bytea in hex format, the backslash is escaped for COPY.
+            lines = (f"{song_id}\t\\\\x{hsh}\t{offset}\n" for song_id, hsh, offset in rows)
+        else:
+            lines = (f"{song_id}\t{hsh}\t{offset}\n" for song_id, hsh, offset in rows)
+
+        cur.copy_expert(self.COPY_FINGERPRINTS_STAGING, io.StringIO("".join(lines)))
+
+    def select_matches(self, cur, hashes: List[str], batch_size: int = 1000) -> Iterable[Tuple[str, int, int]]:
+        """
+        Selects the fingerprints having any of the given hashes with a single query, binding them
+        as one array joined with the fingerprints table, so its text is the same whatever the amount of hashes.
+
+        :param cur: an open cursor.
+        :param hashes: the distinct hashes searched.
+        :param batch_size: unused, all the hashes are searched at once.
+        :return: the (hash, song id, offset) of every fingerprint matched.
+        """
+        cur.execute(self.SELECT_MATCHES, (list(hashes),))
+        return cur.fetchall()
+
+    def select_aligned_matches(self, cur, hashes: List[Tuple[str, int]],
+                               topn: int) -> Iterable[Tuple[int, int, int, int]]:
+        """
+        Aligns the fingerprints matching the given (hash, offset) pairs with a single query,
+        binding the hashes and offsets as two arrays.
+
+        :param cur: an open cursor.
+        :param hashes: the distinct (hash, offset) pairs of the query.
+        :param topn: number of songs returned.
+        :return: the (song id, offset difference, count, hashes matched) of the best candidate of each
+         of the topn songs.
+        """
+        cur.execute(self.SELECT_ALIGNED_MATCHES, ([hsh for hsh, _ in hashes], [offset for _, offset in hashes], topn))
+        return cur.fetchall()
+
+    def __copy__(self):
+        # copies (e.g. the ingestion writers' ones) check connections out of the same pool.
+        clone = self.__class__.__new__(self.__class__)
+        clone.__dict__.update(self.__dict__)
+        clone.catalog_settings = dict(self.catalog_settings)
+        return clone
+
     def __getstate__(self):
-        return self._options,
+        return self._options, self.fingerprint_format, self.catalog_settings
 
     def __setstate__(self, state):
-        self._options, = state
-        self.cursor = cursor_factory(**self._options)
+        options, fingerprint_format, self.catalog_settings = state
+        self._set_options(options)
+        self.set_fingerprint_format(fingerprint_format)
 
 
-def cursor_factory(**factory_options):
+def cursor_factory(pool: ConnectionPool):
     def cursor(**options):
-        options.update(factory_options)
-        return Cursor(**options)
+        return Cursor(pool, **options)
     return cursor
 
 
+def is_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1;")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
 class Cursor(object):
     """
-    Establishes a connection to the database and returns an open cursor.
+    Checks a connection out of the pool and returns an open cursor. The transaction is committed
+    on exit and the connection given back to the pool, unless an exception was raised: the transaction
+    is then rolled back and the connection discarded, as it may be broken.
     # Use as context manager
-    with Cursor() as cur:
+    with Cursor(pool) as cur:
         cur.execute(query)
         ...
     """
-    def __init__(self, dictionary=False, **options):
+    def __init__(self, pool: ConnectionPool, dictionary=False, buffered=False, server_side=False):
         super().__init__()
-
-        self._cache = queue.Queue(maxsize=5)
-
-        try:
-            conn = self._cache.get_nowait()
-            # Ping the connection before using it from the cache.
-            conn.ping(True)
-        except queue.Empty:
-            conn = psycopg2.connect(**options)
-
-        self.conn = conn
+        # psycopg2 cursors always fetch the whole result, "buffered" is there for MySQL compatibility.
+        self.pool = pool
+        self.conn = pool.acquire()
         self.dictionary = dictionary
-
-    @classmethod
-    def clear_cache(cls):
-        cls._cache = queue.Queue(maxsize=5)
+        # server side (named) cursors stream the result, fetched by batches of itersize rows.
+        self.server_side = server_side
 
     def __enter__(self):
+        options = {"name": f"dejavu_cursor_{id(self)}"} if self.server_side else {}
         if self.dictionary:
-            self.cursor = self.conn.cursor(cursor_factory=DictCursor)
-        else:
-            self.cursor = self.conn.cursor()
+            options["cursor_factory"] = DictCursor
+        self.cursor = self.conn.cursor(**options)
         return self.cursor
 
     def __exit__(self, extype, exvalue, traceback):
-        # if we had a PostgreSQL related error we try to rollback the cursor.
-        if extype is psycopg2.DatabaseError:
-            self.cursor.rollback()
+        if extype is not None:
+            # the connection may be broken, closing it rolls the transaction back.
+            self.pool.release(self.conn, discard=True)
+            return
 
-        self.cursor.close()
-        self.conn.commit()
-
-        # Put it back on the queue
         try:
-            self._cache.put_nowait(self.conn)
-        except queue.Full:
-            self.conn.close()
+            self.cursor.close()
+            self.conn.commit()
+        except psycopg2.Error:
+            self.pool.release(self.conn, discard=True)
+            raise
+
+        self.pool.release(self.conn)
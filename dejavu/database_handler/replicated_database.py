@@ -0,0 +1,435 @@
+import copy
+import threading
+from time import time
+from typing import Callable, Dict, Iterator, List, Tuple, Union
+
+import numpy as np
+
+from dejavu.base_classes.base_database import BaseDatabase, get_database
+from dejavu.config.settings import (REPLICA_READ_YOUR_WRITES,
+                                    REPLICA_RETRY_INTERVAL)
+
+
+class ReplicatedDatabase(BaseDatabase):
+    """
+    Sends the writes to a primary database and balances the recognition reads over its read replicas,
+    so recognition traffic doesn't compete with ingestion on the primary.
+
+    - reads go to the replicas in turn. A replica failing a read because it can't be reached (one of the
+    CONNECTION_ERRORS of its database type) is taken out of the rotation for `retry_interval` seconds
+    and the read is retried on the next one, the primary answering when none is left. Once that time
+    is over, the replica is probed before getting reads again. Any other error is raised as is, the
+    replica staying in the rotation.
+    - the ingestion path (songs table reads included, to find out the files already fingerprinted)
+    stays on the primary.
+    - replicas lag behind the primary: with `read_your_writes`, reads go to the primary for that many
+    seconds after any write of this instance (or its copies), so a file just fingerprinted is found.
+    - the catalog is checked (and the missing settings recorded) on the primary only, replicas being
+    read-only copies of it. Reads only validate it, once, on the database answering them.
+    """
+    type = "replicated"
+
+    def __init__(self, primary: Dict[str, any], replicas: List[Dict[str, any]],
+                 retry_interval: float = REPLICA_RETRY_INTERVAL, read_your_writes: float = REPLICA_READ_YOUR_WRITES):
+        """
+        :param primary: configuration of the primary, a dictionary with the "database_type" and the
+         "database" options, as in the Dejavu configuration.
+        :param replicas: configuration of each read replica, as for the primary.
+        :param retry_interval: seconds a failed replica is left out of the rotation.
+        :param read_your_writes: seconds the reads go to the primary after a write, 0 to disable it.
+        """
+        super().__init__()
+        self.primary = self._open(primary)
+        self.replicas = [self._open(replica) for replica in replicas]
+        self.retry_interval = retry_interval
+        self.read_your_writes = read_your_writes
+
+        # shared with the copies: next replica read, time each replica is out of the rotation until
+        # and time of the last write.
+        self._state = {"next": 0, "down_until": [0.0] * len(self.replicas), "last_write": 0.0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _open(config: Dict[str, any]) -> BaseDatabase:
+        return get_database(config.get("database_type", "mysql").lower())(**config.get("database", {}))
+
+    def __copy__(self):
+        # copies (e.g. the ingestion writers' ones) write through a copy of the primary.
+        clone = self.__class__.__new__(self.__class__)
+        clone.__dict__.update(self.__dict__)
+        clone.primary = copy.copy(self.primary)
+        return clone
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _written(self) -> None:
+        with self._lock:
+            self._state["last_write"] = time()
+
+    def _candidates(self) -> List[int]:
+        """
+        :return: the indexes of the replicas a read can be sent to, in the order they are tried.
+        """
+        now = time()
+        with self._lock:
+            if now - self._state["last_write"] < self.read_your_writes:
+                return []
+
+            start = self._state["next"]
+            self._state["next"] = (start + 1) % max(len(self.replicas), 1)
+            order = [(start + i) % len(self.replicas) for i in range(len(self.replicas))]
+            down_until = list(self._state["down_until"])
+
+        candidates = []
+        for index in order:
+            if down_until[index] > now:
+                continue
+            if down_until[index] and not self._probe(index):
+                continue
+            candidates.append(index)
+        return candidates
+
+    def _probe(self, index: int) -> bool:
+        """
+        Checks whether a replica taken out of the rotation answers again.
+
+        :return: whether it's back in the rotation.
+        """
+        try:
+            self.replicas[index].get_num_songs()
+        except self.replicas[index].CONNECTION_ERRORS:
+            self._failed(index)
+            return False
+
+        with self._lock:
+            self._state["down_until"][index] = 0.0
+        return True
+
+    def _failed(self, index: int) -> None:
+        with self._lock:
+            self._state["down_until"][index] = time() + self.retry_interval
+
+    def _read(self, function: Callable[[BaseDatabase], any]) -> any:
+        """
+        Runs a read on the replicas in turn, failing over to the next one (and finally the primary).
+
+        :param function: called with the database answering the read.
+        :return: the result of the read.
+        """
+        self.validate_catalog()
+        return self._failover(function)
+
+    def _failover(self, function: Callable[[BaseDatabase], any]) -> any:
+        for index in self._candidates():
+            try:
+                return function(self.replicas[index])
+            except self.replicas[index].CONNECTION_ERRORS:
+                self._failed(index)
+        return function(self.primary)
+
+    def replica_status(self) -> List[Dict[str, any]]:
+        """
+        :return: for each replica, whether it is in the rotation and the seconds left until it's
+         probed again otherwise.
+        """
+        now = time()
+        with self._lock:
+            return [{"healthy": down_until <= now, "retry_in": max(down_until - now, 0.0)}
+                    for down_until in self._state["down_until"]]
+
+    def before_fork(self) -> None:
+        """
+        Called before the database instance is given to the new process
+        """
+        for db in [self.primary] + self.replicas:
+            db.before_fork()
+
+    def after_fork(self) -> None:
+        """
+        Called after the database instance has been given to the new process
+
+        This will be called in the new process.
+        """
+        # another thread of the parent process may have held the lock when forking.
+        self._lock = threading.Lock()
+        for db in [self.primary] + self.replicas:
+            db.after_fork()
+
+    def setup(self) -> None:
+        """
+        Called on creation or shortly afterwards.
+        """
+        self.primary.setup()
+        self.check_catalog()
+
+    def set_fingerprint_format(self, fingerprint_format: str) -> None:
+        """
+        Sets the format of the fingerprints stored and queried by this instance.
+
+        :param fingerprint_format: either "sha1" or "packed".
+        """
+        super().set_fingerprint_format(fingerprint_format)
+        for db in [self.primary] + self.replicas:
+            db.set_fingerprint_format(fingerprint_format)
+        self._catalog_checked = False
+        self._catalog_validated = False
+
+    def set_catalog_setting(self, setting: str, value: any) -> None:
+        """
+        Sets a setting the catalog is expected to have been generated with, on this instance and on
+        every database it wraps.
+
+        :param setting: name of the setting, one of the CATALOG_* settings.
+        :param value: value of the setting.
+        """
+        super().set_catalog_setting(setting, value)
+        for db in [self.primary] + self.replicas:
+            db.set_catalog_setting(setting, value)
+
+    def check_catalog(self, record_missing: bool = True) -> None:
+        """
+        Validates the settings recorded in the catalog of the primary against the ones of this instance,
+        settings not recorded yet are stored.
+
+        It raises CatalogMismatchError if any of the recorded settings differs.
+
+        :param record_missing: whether the settings not recorded yet are stored, otherwise the catalog is
+         only read, from a replica as any other read, and they are left unchecked.
+        """
+        if record_missing:
+            self.primary.check_catalog()
+            self._catalog_checked = True
+        else:
+            self._failover(lambda db: db.check_catalog(record_missing=False))
+
+        # replicas serve the catalog validated, they can't record anything themselves.
+        for replica in self.replicas:
+            replica._catalog_validated = True
+        self._catalog_validated = True
+
+    def begin_initial_build(self) -> None:
+        """
+        Starts an initial build on the primary.
+
+        It raises InitialBuildError if the primary has fingerprints.
+        """
+        self._written()
+        self.primary.begin_initial_build()
+
+    def finish_initial_build(self, *args) -> None:
+        """
+        Ends the initial build of the primary.
+        """
+        self._written()
+        self.primary.finish_initial_build(*args)
+
+    def empty(self) -> None:
+        """
+        Called when the database should be cleared of all data.
+        """
+        self._written()
+        self.primary.empty()
+
+    def delete_unfingerprinted_songs(self) -> None:
+        """
+        Called to remove any song entries that do not have any fingerprints
+        associated with them.
+        """
+        self._written()
+        self.primary.delete_unfingerprinted_songs()
+
+    def get_num_songs(self) -> int:
+        """
+        Returns the song's count stored.
+
+        :return: the amount of songs in the database.
+        """
+        return self._read(lambda db: db.get_num_songs())
+
+    def get_num_fingerprints(self) -> int:
+        """
+        Returns the fingerprints' count stored.
+
+        :return: the number of fingerprints in the database.
+        """
+        return self._read(lambda db: db.get_num_fingerprints())
+
+    def set_song_fingerprinted(self, song_id: int):
+        """
+        Sets a specific song as having all fingerprints in the database.
+
+        :param song_id: song identifier.
+        """
+        self._written()
+        self.primary.set_song_fingerprinted(song_id)
+
+    def get_songs(self) -> List[Dict[str, str]]:
+        """
+        Returns all fully fingerprinted songs in the database, read from the primary as they
+        tell which files are already fingerprinted.
+
+        :return: a dictionary with the songs info.
+        """
+        return self.primary.get_songs()
+
+    def get_song_by_id(self, song_id: int) -> Dict[str, str]:
+        """
+        Brings the song info from the database.
+
+        :param song_id: song identifier.
+        :return: a song by its identifier. Result must be a Dictionary.
+        """
+        return self._read(lambda db: db.get_song_by_id(song_id))
+
+    def get_songs_by_ids(self, song_ids: List[int]) -> List[Dict[str, str]]:
+        """
+        Brings the song info from the database.
+
+        :param song_ids: song identifiers.
+        :return: songs by their identifiers. Result must be a List of Dictionaries.
+        """
+        return self._read(lambda db: db.get_songs_by_ids(song_ids))
+
+    def insert(self, fingerprint: str, song_id: int, offset: int):
+        """
+        Inserts a single fingerprint into the database.
+
+        :param fingerprint: Part of a sha1 hash, in hexadecimal format, or a packed hash
+        :param song_id: Song identifier this fingerprint is off
+        :param offset: The offset this fingerprint is from.
+        """
+        self._written()
+        self.primary.insert(fingerprint, song_id, offset)
+
+    def insert_song(self, song_name: str, file_hash: str, total_hashes: int, song_publisher: str = '',
+                    song_length: float = 0, song_singer: str = '', song_album: str = '', song_public: str = '') -> int:
+        """
+        Inserts a song name into the database, returns the new
+        identifier of the song.
+
+        :param song_name: The name of the song.
+        :param file_hash: Hash from the fingerprinted file.
+        :param total_hashes: amount of hashes to be inserted on fingerprint table.
+        :param song_publisher: The publisher of the song.
+        :param song_length: The length of the song.
+        :param song_singer: The singer of the song.
+        :param song_album: The album of the song.
+        :param song_public: The public time of the song.
+        :return: the inserted id.
+        """
+        self._written()
+        return self.primary.insert_song(song_name, file_hash, total_hashes, song_publisher, song_length, song_singer,
+                                        song_album, song_public)
+
+    def import_songs(self, songs: List[Dict[str, any]]) -> None:
+        """
+        Inserts songs read from another database (as get_songs returns them) keeping their identifiers,
+        songs already stored are left untouched.
+
+        :param songs: the songs info, considered fingerprinted unless they have a "fingerprinted" key.
+        """
+        self._written()
+        self.primary.import_songs(songs)
+
+    def query(self, fingerprint: str = None) -> List[Tuple]:
+        """
+        Returns all matching fingerprint entries associated with
+        the given hash as parameter, if None is passed it returns all entries.
+
+        :param fingerprint: part of a sha1 hash, in hexadecimal format, or a packed hash
+        :return: a list of fingerprint records stored in the db.
+        """
+        return self._read(lambda db: db.query(fingerprint))
+
+    def get_iterable_kv_pairs(self) -> List[Tuple]:
+        """
+        Returns all fingerprints in the database.
+
+        :return: a list containing all fingerprints stored in the db.
+        """
+        return self._read(lambda db: db.get_iterable_kv_pairs())
+
+    def iterate_fingerprints(self, batch_size: int = 10000) -> Iterator[List[Tuple[Union[str, int], int, int]]]:
+        """
+        Streams all fingerprints in the database, sorted by hash, from the first replica in the rotation.
+        A replica failing halfway isn't failed over, as the stream can't be resumed elsewhere.
+
+        :param batch_size: number of fingerprints fetched at a time.
+        :return: an iterator over lists of up to batch_size (hash, song id, offset) tuples.
+        """
+        candidates = self._candidates()
+        db = self.replicas[candidates[0]] if candidates else self.primary
+        return db.iterate_fingerprints(batch_size)
+
+    def get_frequent_hashes(self, threshold: int) -> Dict[Union[str, int], int]:
+        """
+        Counts the fingerprints of every hash in the database and keeps the frequent ones.
+
+        :param threshold: hashes having more fingerprints than this one are returned.
+        :return: a dictionary with the amount of fingerprints of each frequent hash.
+        """
+        return self._read(lambda db: db.get_frequent_hashes(threshold))
+
+    def insert_hashes(self, song_id: int, hashes: List[Tuple[str, int]], batch_size: int = 10000) -> None:
+        """
+        Insert a multitude of fingerprints.
+
+        :param song_id: Song identifier the fingerprints belong to
+        :param hashes: A sequence of tuples in the format (hash, offset)
+            - hash: Part of a sha1 hash, in hexadecimal format, or a packed hash
+            - offset: Offset this hash was created from/at.
+        :param batch_size: insert batches.
+        """
+        self._written()
+        self.primary.insert_hashes(song_id, hashes, batch_size)
+
+    def return_matches(self, hashes: List[Tuple[str, int]], batch_size: int = 1000, as_arrays: bool = False) \
+            -> Tuple[Union[List[Tuple[int, int]], Tuple[np.ndarray, np.ndarray]], Dict[int, int]]:
+        """
+        Searches the database for pairs of (hash, offset) values.
+
+        :param hashes: A sequence of tuples in the format (hash, offset)
+            - hash: Part of a sha1 hash, in hexadecimal format, or a packed hash
+            - offset: Offset this hash was created from/at.
+        :param batch_size: number of query's batches.
+        :param as_arrays: return the matches as two parallel arrays (song ids, offset differences)
+         instead of a list of tuples.
+        :return: a list of (sid, offset_difference) tuples and a
+        dictionary with the amount of hashes matched (not considering
+        duplicated hashes) in each song.
+            - song id: Song identifier
+            - offset_difference: (database_offset - sampled_offset)
+        """
+        return self._read(lambda db: db.return_matches(hashes, batch_size, as_arrays))
+
+    def return_aligned_matches(self, hashes: List[Tuple[str, int]],
+                               topn: int) -> Tuple[List[Tuple[int, int, int]], Dict[int, int]]:
+        """
+        Searches the database for pairs of (hash, offset) values, aligning the matches in the database.
+
+        :param hashes: A sequence of tuples in the format (hash, offset)
+            - hash: Part of a sha1 hash, in hexadecimal format, or a packed hash
+            - offset: Offset this hash was created from/at.
+        :param topn: number of songs returned.
+        :return: a list of (sid, offset_difference, count) tuples, with the offset difference
+        matched the most times in each of the topn songs matched the most, and a dictionary with
+        the amount of hashes matched (not considering duplicated hashes) in each of those songs.
+        """
+        return self._read(lambda db: db.return_aligned_matches(hashes, topn))
+
+    def delete_songs_by_id(self, song_ids: List[int], batch_size: int = 1000) -> None:
+        """
+        Given a list of song ids it deletes all songs specified and their corresponding fingerprints.
+
+        :param song_ids: song ids to be deleted from the database.
+        :param batch_size: number of query's batches.
+        """
+        self._written()
+        self.primary.delete_songs_by_id(song_ids, batch_size)
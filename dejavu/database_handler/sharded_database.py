@@ -0,0 +1,484 @@
+import copy
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from operator import itemgetter
+from typing import Callable, Dict, Iterator, List, Tuple, Union
+
+import numpy as np
+
+from dejavu.base_classes.base_database import BaseDatabase, get_database
+from dejavu.config.settings import (CATALOG_SHARD, FIELD_ALBUM,
+                                    FIELD_FILE_SHA1, FIELD_FINGERPRINTED,
+                                    FIELD_PUBLICTIME, FIELD_PUBLISHER,
+                                    FIELD_SINGER, FIELD_SONG_ID,
+                                    FIELD_SONG_LENGTH, FIELD_SONGNAME,
+                                    FIELD_TOTAL_HASHES,
+                                    FINGERPRINT_FORMAT_SHA1,
+                                    RESHARD_BATCH_SIZE)
+from dejavu.logic.alignment import best_offsets
+from dejavu.logic.fingerprint_batch import FingerprintBatch
+from dejavu.third_party.dejavu_timer import DejavuTimer
+
+# Fibonacci hashing constant, spreads the packed hashes (whose low bits are the time delta) over the shards.
+PACKED_SHARD_MULTIPLIER = 0x9E3779B97F4A7C15
+PACKED_SHARD_MASK = (1 << 64) - 1
+
+
+class ShardedDatabase(BaseDatabase):
+    """
+    Splits the fingerprints among several databases (the shards) by hash, so each one only stores and
+    searches a fraction of them. Queries are scattered to every shard concerned in parallel and their
+    matches gathered back.
+
+    - a hash always goes to the same shard, so each shard answers for the hashes it owns and the amount
+    of hashes matched in each song is the sum over the shards.
+    - the songs table is replicated to every shard, so their fingerprints can reference them. The first
+    shard owns it: it assigns the song identifiers and answers the songs reads.
+    - each shard records its position (e.g. "2/4") in its catalog, so shards listed in another order or
+    in a different amount are refused. Use reshard to move the fingerprints to another layout.
+    """
+    type = "sharded"
+
+    def __init__(self, shards: List[Dict[str, any]], max_workers: int = None):
+        """
+        :param shards: configuration of each shard, a dictionary with the "database_type" and the
+         "database" options of the shard, as in the Dejavu configuration.
+        :param max_workers: threads querying the shards, one per shard if None.
+        """
+        super().__init__()
+        if not shards:
+            raise TypeError("Unsupported shards supplied.")
+
+        self.shards = []
+        for index, shard in enumerate(shards):
+            db = get_database(shard.get("database_type", "mysql").lower())(**shard.get("database", {}))
+            db.catalog_settings[CATALOG_SHARD] = f"{index}/{len(shards)}"
+            self.shards.append(db)
+
+        self.max_workers = max_workers or len(self.shards)
+        self._executor = None
+
+    @property
+    def owner(self) -> BaseDatabase:
+        # shard assigning the song identifiers and answering the songs reads.
+        return self.shards[0]
+
+    def __copy__(self):
+        # copies (e.g. the ingestion writers' ones) work on copies of the shards, sharing the threads.
+        clone = self.__class__.__new__(self.__class__)
+        clone.__dict__.update(self.__dict__)
+        clone.shards = [copy.copy(shard) for shard in self.shards]
+        return clone
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_executor"] = None
+        return state
+
+    def _map(self, function: Callable, *iterables) -> List:
+        """
+        Runs the function over the given arguments in the shards threads.
+
+        :return: the results, in the same order as the arguments.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="dejavu-shard")
+        return list(self._executor.map(function, *iterables))
+
+    def _all(self, method: str, *args) -> List:
+        """
+        Calls the same method, with the same arguments, on every shard.
+
+        :return: the results of each shard.
+        """
+        return self._map(lambda shard: getattr(shard, method)(*args), self.shards)
+
+    def shard_index(self, fingerprint: Union[str, int]) -> int:
+        """
+        :param fingerprint: part of a sha1 hash, in hexadecimal format, or a packed hash.
+        :return: the index of the shard the fingerprint belongs to.
+        """
+        if self.fingerprint_format == FINGERPRINT_FORMAT_SHA1:
+            return int(fingerprint[:8], 16) % len(self.shards)
+        return (((int(fingerprint) * PACKED_SHARD_MULTIPLIER) & PACKED_SHARD_MASK) >> 32) % len(self.shards)
+
+    def shard_indexes(self, batch: FingerprintBatch) -> np.ndarray:
+        """
+        :param batch: fingerprints of the same format as the database.
+        :return: the index of the shard every fingerprint of the batch belongs to, as shard_index gives.
+        """
+        keys = batch.keys
+        if self.fingerprint_format == FINGERPRINT_FORMAT_SHA1:
+            # the first 4 bytes of the key are the first 8 hexadecimal digits of the hash.
+            raw = np.ascontiguousarray(keys).view(np.uint8).reshape(len(keys), keys.dtype.itemsize)
+            return np.ascontiguousarray(raw[:, :4]).view(">u4").ravel() % len(self.shards)
+        # unsigned integer products wrap around, as the mask does.
+        spread = keys.astype(np.uint64) * np.uint64(PACKED_SHARD_MULTIPLIER)
+        return (spread >> np.uint64(32)) % np.uint64(len(self.shards))
+
+    def _scatter(self, function: Callable, hashes: List[Tuple[Union[str, int], int]]) -> List:
+        """
+        Calls the function, in parallel, with every shard and the hashes it owns, shards owning none
+        of them are skipped.
+
+        :param function: called as function(shard, shard_hashes).
+        :param hashes: A sequence of tuples in the format (hash, offset).
+        :return: the results of each shard called.
+        """
+        if isinstance(hashes, FingerprintBatch):
+            indexes = self.shard_indexes(hashes)
+            split = [hashes[indexes == index] for index in range(len(self.shards))]
+        else:
+            split = [[] for _ in self.shards]
+            for hsh, offset in hashes:
+                split[self.shard_index(hsh)].append((hsh, offset))
+
+        scattered = [(shard, shard_hashes) for shard, shard_hashes in zip(self.shards, split) if shard_hashes]
+        return self._map(function, *zip(*scattered)) if scattered else []
+
+    def before_fork(self) -> None:
+        """
+        Called before the database instance is given to the new process
+        """
+        for shard in self.shards:
+            shard.before_fork()
+
+    def after_fork(self) -> None:
+        """
+        Called after the database instance has been given to the new process
+
+        This will be called in the new process.
+        """
+        # threads don't survive a fork.
+        self._executor = None
+        for shard in self.shards:
+            shard.after_fork()
+
+    def setup(self) -> None:
+        """
+        Called on creation or shortly afterwards.
+        """
+        self._all("setup")
+
+    def set_fingerprint_format(self, fingerprint_format: str) -> None:
+        """
+        Sets the format of the fingerprints stored and queried by this instance.
+
+        :param fingerprint_format: either "sha1" or "packed".
+        """
+        super().set_fingerprint_format(fingerprint_format)
+        for shard in self.shards:
+            shard.set_fingerprint_format(fingerprint_format)
+
+    def set_catalog_setting(self, setting: str, value: any) -> None:
+        """
+        Sets a setting the catalog is expected to have been generated with, on this instance and on
+        every database it wraps.
+
+        :param setting: name of the setting, one of the CATALOG_* settings.
+        :param value: value of the setting.
+        """
+        super().set_catalog_setting(setting, value)
+        for db in self.shards:
+            db.set_catalog_setting(setting, value)
+
+    def check_catalog(self, record_missing: bool = True) -> None:
+        """
+        Validates the settings recorded in the catalog of every shard against the ones of this instance
+        and the position of the shard, settings not recorded yet are stored.
+
+        It raises CatalogMismatchError if any of the recorded settings differs.
+
+        :param record_missing: whether the settings not recorded yet are stored, otherwise the catalogs are
+         only read and they are left unchecked.
+        """
+        self._all("check_catalog", record_missing)
+
+    def validate_catalog(self) -> None:
+        """
+        Validates the settings recorded in the catalog of every shard without writing to them, once per shard.
+        """
+        if not all(shard._catalog_checked or shard._catalog_validated for shard in self.shards):
+            self._all("validate_catalog")
+
+    def begin_initial_build(self) -> None:
+        """
+        Starts an initial build on every shard.
+
+        It raises InitialBuildError if any shard has fingerprints.
+        """
+        self._all("begin_initial_build")
+
+    def finish_initial_build(self, *args) -> None:
+        """
+        Ends the initial build of every shard, their indexes are built in parallel.
+        """
+        self._all("finish_initial_build", *args)
+
+    def empty(self) -> None:
+        """
+        Called when the database should be cleared of all data.
+        """
+        self._all("empty")
+
+    def delete_unfingerprinted_songs(self) -> None:
+        """
+        Called to remove any song entries that do not have any fingerprints
+        associated with them.
+        """
+        self._all("delete_unfingerprinted_songs")
+
+    def get_num_songs(self) -> int:
+        """
+        Returns the song's count stored.
+
+        :return: the amount of songs in the database.
+        """
+        return self.owner.get_num_songs()
+
+    def get_num_fingerprints(self) -> int:
+        """
+        Returns the fingerprints' count stored.
+
+        :return: the number of fingerprints in the database.
+        """
+        return sum(self._all("get_num_fingerprints"))
+
+    def set_song_fingerprinted(self, song_id: int):
+        """
+        Sets a specific song as having all fingerprints in the database.
+
+        :param song_id: song identifier.
+        """
+        self._all("set_song_fingerprinted", song_id)
+
+    def get_songs(self) -> List[Dict[str, str]]:
+        """
+        Returns all fully fingerprinted songs in the database
+
+        :return: a dictionary with the songs info.
+        """
+        return self.owner.get_songs()
+
+    def get_song_by_id(self, song_id: int) -> Dict[str, str]:
+        """
+        Brings the song info from the database.
+
+        :param song_id: song identifier.
+        :return: a song by its identifier. Result must be a Dictionary.
+        """
+        return self.owner.get_song_by_id(song_id)
+
+    def get_songs_by_ids(self, song_ids: List[int]) -> List[Dict[str, str]]:
+        """
+        Brings the song info from the database.
+
+        :param song_ids: song identifiers.
+        :return: songs by their identifiers. Result must be a List of Dictionaries.
+        """
+        return self.owner.get_songs_by_ids(song_ids)
+
+    def insert(self, fingerprint: str, song_id: int, offset: int):
+        """
+        Inserts a single fingerprint into the database.
+
+        :param fingerprint: Part of a sha1 hash, in hexadecimal format, or a packed hash
+        :param song_id: Song identifier this fingerprint is off
+        :param offset: The offset this fingerprint is from.
+        """
+        self.shards[self.shard_index(fingerprint)].insert(fingerprint, song_id, offset)
+
+    def insert_song(self, song_name: str, file_hash: str, total_hashes: int, song_publisher: str = '',
+                    song_length: float = 0, song_singer: str = '', song_album: str = '', song_public: str = '') -> int:
+        """
+        Inserts a song name into the owner shard, which assigns its identifier, and replicates it to
+        the other shards.
+
+        :param song_name: The name of the song.
+        :param file_hash: Hash from the fingerprinted file.
+        :param total_hashes: amount of hashes to be inserted on fingerprint table.
+        :param song_publisher: The publisher of the song.
+        :param song_length: The length of the song.
+        :param song_singer: The singer of the song.
+        :param song_album: The album of the song.
+        :param song_public: The public time of the song.
+        :return: the inserted id.
+        """
+        song_id = self.owner.insert_song(song_name, file_hash, total_hashes, song_publisher, song_length,
+                                         song_singer, song_album, song_public)
+        # the song is only fingerprinted once set_song_fingerprinted is called.
+        song = {FIELD_SONG_ID: song_id, FIELD_SONGNAME: song_name, FIELD_FINGERPRINTED: 0, FIELD_FILE_SHA1: file_hash,
+                FIELD_TOTAL_HASHES: total_hashes, FIELD_PUBLISHER: song_publisher, FIELD_SONG_LENGTH: song_length,
+                FIELD_SINGER: song_singer, FIELD_ALBUM: song_album, FIELD_PUBLICTIME: song_public}
+        self._map(lambda shard: shard.import_songs([song]), self.shards[1:])
+        return song_id
+
+    def import_songs(self, songs: List[Dict[str, any]]) -> None:
+        """
+        Inserts songs read from another database (as get_songs returns them) keeping their identifiers,
+        songs already stored are left untouched.
+
+        :param songs: the songs info, considered fingerprinted unless they have a "fingerprinted" key.
+        """
+        self._all("import_songs", songs)
+
+    def query(self, fingerprint: str = None) -> List[Tuple]:
+        """
+        Returns all matching fingerprint entries associated with
+        the given hash as parameter, if None is passed it returns all entries.
+
+        :param fingerprint: part of a sha1 hash, in hexadecimal format, or a packed hash
+        :return: a list of fingerprint records stored in the db.
+        """
+        if fingerprint:
+            return self.shards[self.shard_index(fingerprint)].query(fingerprint)
+        return [row for rows in self._all("query", None) for row in rows]
+
+    def get_iterable_kv_pairs(self) -> List[Tuple]:
+        """
+        Returns all fingerprints in the database.
+
+        :return: a list containing all fingerprints stored in the db.
+        """
+        return self.query(None)
+
+    def iterate_fingerprints(self, batch_size: int = 10000) -> Iterator[List[Tuple[Union[str, int], int, int]]]:
+        """
+        Streams all fingerprints in the database, sorted by hash, merging the streams of the shards.
+
+        :param batch_size: number of fingerprints fetched at a time from each shard.
+        :return: an iterator over lists of up to batch_size (hash, song id, offset) tuples.
+        """
+        streams = [(row for rows in shard.iterate_fingerprints(batch_size) for row in rows) for shard in self.shards]
+        merged = heapq.merge(*streams, key=itemgetter(0))
+        batch = list(islice(merged, batch_size))
+        while batch:
+            yield batch
+            batch = list(islice(merged, batch_size))
+
+    def get_frequent_hashes(self, threshold: int) -> Dict[Union[str, int], int]:
+        """
+        Counts the fingerprints of every hash in each shard and keeps the frequent ones, a hash
+        only living in one shard.
+
+        :param threshold: hashes having more fingerprints than this one are returned.
+        :return: a dictionary with the amount of fingerprints of each frequent hash.
+        """
+        return {hsh: count for frequent in self._all("get_frequent_hashes", threshold)
+                for hsh, count in frequent.items()}
+
+    def insert_hashes(self, song_id: int, hashes: List[Tuple[str, int]], batch_size: int = 10000) -> None:
+        """
+        Insert a multitude of fingerprints, each shard gets the ones it owns, in parallel.
+
+        :param song_id: Song identifier the fingerprints belong to
+        :param hashes: A sequence of tuples in the format (hash, offset)
+            - hash: Part of a sha1 hash, in hexadecimal format, or a packed hash
+            - offset: Offset this hash was created from/at.
+        :param batch_size: insert batches.
+        """
+        self._scatter(lambda shard, shard_hashes: shard.insert_hashes(song_id, shard_hashes, batch_size), hashes)
+
+    @DejavuTimer(name=__name__ + ".return_matches()\t\t\t")
+    def return_matches(self, hashes: List[Tuple[str, int]], batch_size: int = 1000, as_arrays: bool = False) \
+            -> Tuple[Union[List[Tuple[int, int]], Tuple[np.ndarray, np.ndarray]], Dict[int, int]]:
+        """
+        Searches the database for pairs of (hash, offset) values, each shard being queried in parallel
+        with the hashes it owns.
+
+        :param hashes: A sequence of tuples in the format (hash, offset)
+            - hash: Part of a sha1 hash, in hexadecimal format, or a packed hash
+            - offset: Offset this hash was created from/at.
+        :param batch_size: number of query's batches.
+        :param as_arrays: return the matches as two parallel arrays (song ids, offset differences)
+         instead of a list of tuples.
+        :return: a list of (sid, offset_difference) tuples and a
+        dictionary with the amount of hashes matched (not considering
+        duplicated hashes) in each song.
+            - song id: Song identifier
+            - offset_difference: (database_offset - sampled_offset)
+        """
+        results = self._scatter(
+            lambda shard, shard_hashes: shard.return_matches(shard_hashes, batch_size, as_arrays=True), hashes)
+
+        song_ids = np.concatenate([np.asarray(sids, dtype=np.int64) for (sids, _), _ in results] or
+                                  [np.empty(0, dtype=np.int64)])
+        offset_differences = np.concatenate([np.asarray(diffs, dtype=np.int64) for (_, diffs), _ in results] or
+                                            [np.empty(0, dtype=np.int64)])
+
+        # a hash only lives in one shard, so the hashes matched in a song add up.
+        dedup_hashes = {}
+        for _, shard_dedup_hashes in results:
+            for sid, count in shard_dedup_hashes.items():
+                dedup_hashes[sid] = dedup_hashes.get(sid, 0) + count
+
+        if as_arrays:
+            return (song_ids, offset_differences), dedup_hashes
+        return list(zip(song_ids.tolist(), offset_differences.tolist())), dedup_hashes
+
+    @DejavuTimer(name=__name__ + ".return_aligned_matches()\t\t")
+    def return_aligned_matches(self, hashes: List[Tuple[str, int]],
+                               topn: int) -> Tuple[List[Tuple[int, int, int]], Dict[int, int]]:
+        """
+        Searches the database for pairs of (hash, offset) values, aligning the matches gathered from the
+        shards: the best offsets of each shard can't be merged, a song's matches being spread over all of them.
+
+        :param hashes: A sequence of tuples in the format (hash, offset)
+            - hash: Part of a sha1 hash, in hexadecimal format, or a packed hash
+            - offset: Offset this hash was created from/at.
+        :param topn: number of songs returned.
+        :return: a list of (sid, offset_difference, count) tuples, with the offset difference
+        matched the most times in each of the topn songs matched the most, and a dictionary with
+        the amount of hashes matched (not considering duplicated hashes) in each of those songs.
+        """
+        (song_ids, offset_differences), dedup_hashes = self.return_matches(hashes, as_arrays=True)
+        songs_matches = best_offsets(song_ids, offset_differences, topn)
+        return songs_matches, {sid: dedup_hashes[sid] for sid, _, _ in songs_matches}
+
+    def delete_songs_by_id(self, song_ids: List[int], batch_size: int = 1000) -> None:
+        """
+        Given a list of song ids it deletes all songs specified and their corresponding fingerprints.
+
+        :param song_ids: song ids to be deleted from the database.
+        :param batch_size: number of query's batches.
+        """
+        self._all("delete_songs_by_id", song_ids, batch_size)
+
+
+@DejavuTimer(name=__name__ + ".reshard()\t\t\t\t\t")
+def reshard(source: BaseDatabase, target: BaseDatabase, batch_size: int = RESHARD_BATCH_SIZE) -> int:
+    """
+    Copies the fingerprinted songs and their fingerprints from a database to another one, e.g. between
+    two sharded databases with a different amount of shards, or from a single database to a sharded one.
+    Fingerprints are streamed sorted by hash, so they are never loaded all at once, and they are
+    distributed by the target as they are inserted. Fingerprints already in the target are ignored, so
+    an interrupted copy can be run again.
+
+    :param source: database read, it's left untouched.
+    :param target: database written, set up and using the same fingerprint format as the source.
+    :param batch_size: number of fingerprints read at a time.
+    :return: the number of fingerprints copied.
+    """
+    source.validate_catalog()
+    if target.fingerprint_format != source.fingerprint_format:
+        raise TypeError("Unsupported target fingerprint format supplied.")
+    target.check_catalog()
+
+    songs = source.get_songs()
+    target.import_songs(songs)
+    song_ids = {song[FIELD_SONG_ID] for song in songs}
+
+    copied = 0
+    for rows in source.iterate_fingerprints(batch_size):
+        by_song = {}
+        for hsh, sid, offset in rows:
+            # fingerprints of songs still being fingerprinted are left behind, as their song is.
+            if sid in song_ids:
+                by_song.setdefault(sid, []).append((hsh, offset))
+
+        for sid, hashes in by_song.items():
+            target.insert_hashes(sid, hashes, batch_size)
+            copied += len(hashes)
+
+    return copied
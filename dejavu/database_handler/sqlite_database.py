@@ -0,0 +1,681 @@
+import sqlite3
+from datetime import datetime
+from functools import partial
+from typing import Iterable, List, Tuple
+
+from dejavu.base_classes.common_database import CommonDatabase
+from dejavu.database_handler.connection_pool import ConnectionPool
+from dejavu.config.settings import (CATALOG_TABLENAME, DATABASE_POOL_MAX_IDLE,
+                                    DATABASE_POOL_SIZE, FIELD_FILE_SHA1,
+                                    FIELD_FINGERPRINTED, FIELD_HASH,
+                                    FIELD_OFFSET, FIELD_SETTING, FIELD_SONG_ID,
+                                    FIELD_SONGNAME, FIELD_TOTAL_HASHES, FIELD_PUBLISHER, FIELD_SONG_LENGTH,
+                                    FIELD_SINGER, FIELD_ALBUM, FIELD_PUBLICTIME, FIELD_VALUE,
+                                    FINGERPRINTS_QUERY_TABLENAME,
+                                    FINGERPRINTS_REBUILD_TABLENAME,
+                                    FINGERPRINTS_STAGING_TABLENAME,
+                                    FINGERPRINTS_TABLENAME, SONGS_TABLENAME,
+                                    SQLITE_BUSY_TIMEOUT, SQLITE_CACHE_SIZE,
+                                    SQLITE_MMAP_SIZE, SQLITE_PAGE_SIZE)
+
+from dejavu.third_party.dejavu_timer import DejavuTimer
+
+# columns tagged with this type come back as datetime objects, as they do from the other databases.
+sqlite3.register_converter("dejavu_timestamp", lambda value: datetime.fromisoformat(value.decode()))
+
+
+class SQLiteDatabase(CommonDatabase):
+    """
+    Embedded database stored in a single file, for single node catalogs, tests and benchmarks.
+
+    Fingerprints are kept in a WITHOUT ROWID table clustered on the hash, so matching a hash is a single
+    range scan. The file is opened in WAL mode: any number of processes can read it while another one writes.
+    """
+    type = "sqlite"
+
+    CONNECTION_ERRORS = (sqlite3.OperationalError, sqlite3.InterfaceError)
+
+    # CREATES
+    CREATE_SONGS_TABLE = f"""
+        CREATE TABLE IF NOT EXISTS "{SONGS_TABLENAME}" (
+            "{FIELD_SONG_ID}" INTEGER PRIMARY KEY AUTOINCREMENT
+        ,   "{FIELD_SONGNAME}" TEXT NOT NULL
+        ,   "{FIELD_FINGERPRINTED}" INTEGER DEFAULT 0
+        ,   "{FIELD_FILE_SHA1}" BLOB
+        ,   "{FIELD_TOTAL_HASHES}" INTEGER NOT NULL DEFAULT 0
+        ,   "{FIELD_PUBLISHER}" TEXT DEFAULT 'Unknown'
+        ,   "{FIELD_SONG_LENGTH}" REAL DEFAULT 0
+        ,   "{FIELD_SINGER}" TEXT DEFAULT 'Unknown'
+        ,   "{FIELD_ALBUM}" TEXT DEFAULT 'Unknown'
+        ,   "{FIELD_PUBLICTIME}" TEXT DEFAULT 'Unknown'
+        ,   "date_created" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ,   "date_modified" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+    """
+
+    # the primary key is the table itself, the dates kept by the other databases are left out to keep rows small.
+    CREATE_FINGERPRINTS_TABLE = f"""
+        CREATE TABLE IF NOT EXISTS "{FINGERPRINTS_TABLENAME}" (
+            "{FIELD_HASH}" BLOB NOT NULL
+        ,   "{FIELD_SONG_ID}" INTEGER NOT NULL
+        ,   "{FIELD_OFFSET}" INTEGER NOT NULL
+        ,   CONSTRAINT "pk_{FINGERPRINTS_TABLENAME}" PRIMARY KEY ("{FIELD_HASH}", "{FIELD_SONG_ID}", "{FIELD_OFFSET}")
+        ,   CONSTRAINT "fk_{FINGERPRINTS_TABLENAME}_{FIELD_SONG_ID}" FOREIGN KEY ("{FIELD_SONG_ID}")
+                REFERENCES "{SONGS_TABLENAME}"("{FIELD_SONG_ID}") ON DELETE CASCADE
+        ) WITHOUT ROWID;
+
+        CREATE INDEX IF NOT EXISTS "ix_{FINGERPRINTS_TABLENAME}_{FIELD_SONG_ID}"
+        ON "{FINGERPRINTS_TABLENAME}" ("{FIELD_SONG_ID}");
+    """
+
+    # Plain table without key, foreign key nor index, used during an initial build.
+    CREATE_FINGERPRINTS_TABLE_UNINDEXED = f"""
+        CREATE TABLE IF NOT EXISTS "{FINGERPRINTS_TABLENAME}" (
+            "{FIELD_HASH}" BLOB NOT NULL
+        ,   "{FIELD_SONG_ID}" INTEGER NOT NULL
+        ,   "{FIELD_OFFSET}" INTEGER NOT NULL
+        );
+    """
+
+    CREATE_CATALOG_TABLE = f"""
+        CREATE TABLE IF NOT EXISTS "{CATALOG_TABLENAME}" (
+            "{FIELD_SETTING}" TEXT NOT NULL
+        ,   "{FIELD_VALUE}" TEXT NOT NULL
+        ,   CONSTRAINT "pk_{CATALOG_TABLENAME}_{FIELD_SETTING}" PRIMARY KEY ("{FIELD_SETTING}")
+        );
+    """
+
+    CREATE_FINGERPRINTS_STAGING = f"""
+        CREATE TEMPORARY TABLE "{FINGERPRINTS_STAGING_TABLENAME}" (
+            "{FIELD_HASH}" BLOB NOT NULL
+        ,   "{FIELD_SONG_ID}" INTEGER NOT NULL
+        ,   "{FIELD_OFFSET}" INTEGER NOT NULL
+        );
+    """
+
+    CREATE_FINGERPRINTS_QUERY = f"""
+        CREATE TEMPORARY TABLE "{FINGERPRINTS_QUERY_TABLENAME}" (
+            "{FIELD_HASH}" BLOB NOT NULL PRIMARY KEY
+        ) WITHOUT ROWID;
+    """
+
+    CREATE_FINGERPRINTS_QUERY_OFFSETS = f"""
+        CREATE TEMPORARY TABLE "{FINGERPRINTS_QUERY_TABLENAME}" (
+            "{FIELD_HASH}" BLOB NOT NULL
+        ,   "{FIELD_OFFSET}" INTEGER NOT NULL
+        );
+    """
+
+    # INSERTS (IGNORES DUPLICATES)
+    INSERT_FINGERPRINT = f"""
+        INSERT OR IGNORE INTO "{FINGERPRINTS_TABLENAME}" (
+                "{FIELD_SONG_ID}"
+            ,   "{FIELD_HASH}"
+            ,   "{FIELD_OFFSET}")
+        VALUES (%s, unhex(%s), %s);
+    """
+
+    INSERT_SONG = f"""
+        INSERT INTO "{SONGS_TABLENAME}" ("{FIELD_SONGNAME}", "{FIELD_FILE_SHA1}", "{FIELD_TOTAL_HASHES}",
+            "{FIELD_PUBLISHER}", "{FIELD_SONG_LENGTH}", "{FIELD_SINGER}", "{FIELD_ALBUM}", "{FIELD_PUBLICTIME}")
+        VALUES (%s, unhex(%s), %s, %s, %s, %s, %s, %s);
+    """
+
+    IMPORT_SONG = f"""
+        INSERT OR IGNORE INTO "{SONGS_TABLENAME}" ("{FIELD_SONG_ID}", "{FIELD_SONGNAME}", "{FIELD_FINGERPRINTED}",
+            "{FIELD_FILE_SHA1}", "{FIELD_TOTAL_HASHES}", "{FIELD_PUBLISHER}", "{FIELD_SONG_LENGTH}", "{FIELD_SINGER}",
+            "{FIELD_ALBUM}", "{FIELD_PUBLICTIME}")
+        VALUES (%s, %s, %s, unhex(%s), %s, %s, %s, %s, %s, %s);
+    """
+
+    INSERT_CATALOG_SETTING = f"""
+        INSERT OR IGNORE INTO "{CATALOG_TABLENAME}" ("{FIELD_SETTING}", "{FIELD_VALUE}") VALUES (%s, %s);
+    """
+
+    INSERT_FINGERPRINTS_STAGING = f"""
+        INSERT INTO "{FINGERPRINTS_STAGING_TABLENAME}" ("{FIELD_SONG_ID}", "{FIELD_HASH}", "{FIELD_OFFSET}")
+        VALUES (%s, unhex(%s), %s);
+    """
+
+    # sorted by hash, the rows are appended to the clustered key instead of being inserted all over it.
+    MERGE_FINGERPRINTS_STAGING = f"""
+        INSERT OR IGNORE INTO "{FINGERPRINTS_TABLENAME}" ("{FIELD_SONG_ID}", "{FIELD_HASH}", "{FIELD_OFFSET}")
+        SELECT "{FIELD_SONG_ID}", "{FIELD_HASH}", "{FIELD_OFFSET}"
+        FROM "{FINGERPRINTS_STAGING_TABLENAME}"
+        ORDER BY "{FIELD_HASH}", "{FIELD_SONG_ID}", "{FIELD_OFFSET}";
+    """
+
+    INSERT_FINGERPRINTS_QUERY = f"""
+        INSERT OR IGNORE INTO "{FINGERPRINTS_QUERY_TABLENAME}" ("{FIELD_HASH}") VALUES (unhex(%s));
+    """
+
+    INSERT_FINGERPRINTS_QUERY_OFFSET = f"""
+        INSERT INTO "{FINGERPRINTS_QUERY_TABLENAME}" ("{FIELD_HASH}", "{FIELD_OFFSET}") VALUES (unhex(%s), %s);
+    """
+
+    # SELECTS
+    SELECT = f"""
+        SELECT "{FIELD_SONG_ID}", "{FIELD_OFFSET}"
+        FROM "{FINGERPRINTS_TABLENAME}"
+        WHERE "{FIELD_HASH}" = unhex(%s);
+    """
+
+    SELECT_MULTIPLE = f"""
+        SELECT hex("{FIELD_HASH}"), "{FIELD_SONG_ID}", "{FIELD_OFFSET}"
+        FROM "{FINGERPRINTS_TABLENAME}"
+        WHERE "{FIELD_HASH}" IN (%s);
+    """
+
+    # CROSS JOIN makes SQLite loop over the query hashes, looking each one up in the fingerprints key.
+    SELECT_MATCHES = f"""
+        SELECT hex(f."{FIELD_HASH}"), f."{FIELD_SONG_ID}", f."{FIELD_OFFSET}"
+        FROM "{FINGERPRINTS_QUERY_TABLENAME}" AS q
+        CROSS JOIN "{FINGERPRINTS_TABLENAME}" AS f ON f."{FIELD_HASH}" = q."{FIELD_HASH}";
+    """
+
+    # the offsets are aligned in the database (window functions need SQLite 3.25).
+    SELECT_ALIGNED_MATCHES = f"""
+        WITH matched AS (
+            SELECT
+                f."{FIELD_SONG_ID}"
+            ,   f."{FIELD_HASH}"
+            ,   f."{FIELD_OFFSET}"
+            ,   f."{FIELD_OFFSET}" - q."{FIELD_OFFSET}" AS "offset_difference"
+            FROM "{FINGERPRINTS_QUERY_TABLENAME}" AS q
+            CROSS JOIN "{FINGERPRINTS_TABLENAME}" AS f ON f."{FIELD_HASH}" = q."{FIELD_HASH}"
+        )
+    ,   candidates AS (
+            SELECT
+                "{FIELD_SONG_ID}"
+            ,   "offset_difference"
+            ,   COUNT(*) AS "count"
+            ,   row_number() OVER (
+                    PARTITION BY "{FIELD_SONG_ID}" ORDER BY COUNT(*) DESC, "offset_difference"
+                ) AS "candidate"
+            FROM matched
+            GROUP BY "{FIELD_SONG_ID}", "offset_difference"
+        )
+    ,   hashes_matched AS (
+            SELECT "{FIELD_SONG_ID}", COUNT(*) AS "count"
+            FROM (SELECT DISTINCT "{FIELD_SONG_ID}", "{FIELD_HASH}", "{FIELD_OFFSET}" FROM matched)
+            GROUP BY "{FIELD_SONG_ID}"
+        )
+        SELECT c."{FIELD_SONG_ID}", c."offset_difference", c."count", h."count"
+        FROM candidates AS c
+        INNER JOIN hashes_matched AS h ON h."{FIELD_SONG_ID}" = c."{FIELD_SONG_ID}"
+        WHERE c."candidate" = 1
+        ORDER BY c."count" DESC, c."{FIELD_SONG_ID}"
+        LIMIT %s;
+    """
+
+    SELECT_ALL = f'SELECT "{FIELD_SONG_ID}", "{FIELD_OFFSET}" FROM "{FINGERPRINTS_TABLENAME}";'
+
+    SELECT_ALL_ORDERED = f"""
+        SELECT hex("{FIELD_HASH}"), "{FIELD_SONG_ID}", "{FIELD_OFFSET}"
+        FROM "{FINGERPRINTS_TABLENAME}"
+        ORDER BY "{FIELD_HASH}", "{FIELD_SONG_ID}", "{FIELD_OFFSET}";
+    """
+
+    # hashes having more fingerprints than the threshold given, with their amount of fingerprints.
+    SELECT_FREQUENT_HASHES = f"""
+        SELECT hex("{FIELD_HASH}"), COUNT(*)
+        FROM "{FINGERPRINTS_TABLENAME}"
+        GROUP BY "{FIELD_HASH}"
+        HAVING COUNT(*) > %s;
+    """
+
+    SELECT_ANY_FINGERPRINT = f'SELECT 1 FROM "{FINGERPRINTS_TABLENAME}" LIMIT 1;'
+
+    SELECT_CATALOG = f'SELECT "{FIELD_SETTING}", "{FIELD_VALUE}" FROM "{CATALOG_TABLENAME}";'
+
+    SELECT_SONG = f"""
+        SELECT
+            "{FIELD_SONGNAME}", "{FIELD_PUBLISHER}", "{FIELD_SONG_LENGTH}", "{FIELD_SINGER}", "{FIELD_ALBUM}"
+        ,   "{FIELD_PUBLICTIME}", hex("{FIELD_FILE_SHA1}") AS "{FIELD_FILE_SHA1}", "{FIELD_TOTAL_HASHES}"
+        FROM "{SONGS_TABLENAME}"
+        WHERE "{FIELD_SONG_ID}" = %s;
+    """
+
+    SELECT_SONGS_BY_IDS = f"""
+        SELECT
+            "{FIELD_SONG_ID}", "{FIELD_SONGNAME}", "{FIELD_PUBLISHER}", "{FIELD_SONG_LENGTH}", "{FIELD_SINGER}"
+        ,   "{FIELD_ALBUM}", "{FIELD_PUBLICTIME}", hex("{FIELD_FILE_SHA1}") AS "{FIELD_FILE_SHA1}"
+        ,   "{FIELD_TOTAL_HASHES}"
+        FROM "{SONGS_TABLENAME}"
+        WHERE "{FIELD_SONG_ID}" IN (%s);
+    """
+
+    SELECT_NUM_FINGERPRINTS = f'SELECT COUNT(*) AS n FROM "{FINGERPRINTS_TABLENAME}";'
+
+    SELECT_UNIQUE_SONG_IDS = f"""
+        SELECT COUNT("{FIELD_SONG_ID}") AS n
+        FROM "{SONGS_TABLENAME}"
+        WHERE "{FIELD_FINGERPRINTED}" = 1;
+    """
+
+    SELECT_SONGS = f"""
+        SELECT
+            "{FIELD_SONG_ID}"
+        ,   "{FIELD_SONGNAME}"
+        ,   "{FIELD_PUBLISHER}"
+        ,   "{FIELD_SONG_LENGTH}"
+        ,   "{FIELD_SINGER}"
+        ,   "{FIELD_ALBUM}"
+        ,   "{FIELD_PUBLICTIME}"
+        ,   hex("{FIELD_FILE_SHA1}") AS "{FIELD_FILE_SHA1}"
+        ,   "{FIELD_TOTAL_HASHES}"
+        ,   "date_created" AS "date_created [dejavu_timestamp]"
+        FROM "{SONGS_TABLENAME}"
+        WHERE "{FIELD_FINGERPRINTED}" = 1;
+    """
+
+    # DROPS
+    DROP_FINGERPRINTS = f'DROP TABLE IF EXISTS "{FINGERPRINTS_TABLENAME}";'
+    DROP_SONGS = f'DROP TABLE IF EXISTS "{SONGS_TABLENAME}";'
+    DROP_CATALOG = f'DROP TABLE IF EXISTS "{CATALOG_TABLENAME}";'
+    DROP_FINGERPRINTS_STAGING = f'DROP TABLE IF EXISTS temp."{FINGERPRINTS_STAGING_TABLENAME}";'
+    DROP_FINGERPRINTS_QUERY = f'DROP TABLE IF EXISTS temp."{FINGERPRINTS_QUERY_TABLENAME}";'
+
+    # UPDATE
+    UPDATE_SONG_FINGERPRINTED = f"""
+        UPDATE "{SONGS_TABLENAME}" SET
+            "{FIELD_FINGERPRINTED}" = 1
+        ,   "date_modified" = CURRENT_TIMESTAMP
+        WHERE "{FIELD_SONG_ID}" = %s;
+    """
+
+    # DELETES
+    DELETE_UNFINGERPRINTED = f"""
+        DELETE FROM "{SONGS_TABLENAME}" WHERE "{FIELD_FINGERPRINTED}" = 0;
+    """
+
+    DELETE_SONGS = f"""
+        DELETE FROM "{SONGS_TABLENAME}" WHERE "{FIELD_SONG_ID}" IN (%s);
+    """
+
+    # INITIAL BUILD
+    # auxiliary threads SQLite may use to sort while building the key and index.
+    SET_PARALLEL_MAINTENANCE = "PRAGMA threads = %d;"
+
+    # Run in order by finish_initial_build, the key, foreign key and index get the same names setup() gives them.
+    FINISH_INITIAL_BUILD = [
+        # duplicates and fingerprints whose song was deleted (no foreign key cascades during the build) are
+        # left out while copying the rows, sorted, into the clustered table.
+        f'DROP TABLE IF EXISTS "{FINGERPRINTS_REBUILD_TABLENAME}";',
+        f"""
+            CREATE TABLE "{FINGERPRINTS_REBUILD_TABLENAME}" (
+                "{FIELD_HASH}" BLOB NOT NULL
+            ,   "{FIELD_SONG_ID}" INTEGER NOT NULL
+            ,   "{FIELD_OFFSET}" INTEGER NOT NULL
+            ,   CONSTRAINT "pk_{FINGERPRINTS_TABLENAME}"
+                    PRIMARY KEY ("{FIELD_HASH}", "{FIELD_SONG_ID}", "{FIELD_OFFSET}")
+            ,   CONSTRAINT "fk_{FINGERPRINTS_TABLENAME}_{FIELD_SONG_ID}" FOREIGN KEY ("{FIELD_SONG_ID}")
+                    REFERENCES "{SONGS_TABLENAME}"("{FIELD_SONG_ID}") ON DELETE CASCADE
+            ) WITHOUT ROWID;
+        """,
+        f"""
+            INSERT OR IGNORE INTO "{FINGERPRINTS_REBUILD_TABLENAME}" (
+                    "{FIELD_HASH}"
+                ,   "{FIELD_SONG_ID}"
+                ,   "{FIELD_OFFSET}")
+            SELECT f."{FIELD_HASH}", f."{FIELD_SONG_ID}", f."{FIELD_OFFSET}"
+            FROM "{FINGERPRINTS_TABLENAME}" AS f
+            WHERE EXISTS (
+                SELECT 1 FROM "{SONGS_TABLENAME}" AS s WHERE s."{FIELD_SONG_ID}" = f."{FIELD_SONG_ID}"
+            )
+            ORDER BY f."{FIELD_HASH}", f."{FIELD_SONG_ID}", f."{FIELD_OFFSET}";
+        """,
+        f'DROP TABLE "{FINGERPRINTS_TABLENAME}";',
+        f'ALTER TABLE "{FINGERPRINTS_REBUILD_TABLENAME}" RENAME TO "{FINGERPRINTS_TABLENAME}";',
+        f"""
+            CREATE INDEX "ix_{FINGERPRINTS_TABLENAME}_{FIELD_SONG_ID}"
+            ON "{FINGERPRINTS_TABLENAME}" ("{FIELD_SONG_ID}");
+        """,
+        f'ANALYZE "{FINGERPRINTS_TABLENAME}";'
+    ]
+
+    # IN
+    IN_MATCH = "unhex(%s)"
+
+    # PACKED FINGERPRINT FORMAT (hashes are stored as plain integers)
+    PACKED_STATEMENTS = {
+        "CREATE_FINGERPRINTS_TABLE": f"""
+            CREATE TABLE IF NOT EXISTS "{FINGERPRINTS_TABLENAME}" (
+                "{FIELD_HASH}" INTEGER NOT NULL
+            ,   "{FIELD_SONG_ID}" INTEGER NOT NULL
+            ,   "{FIELD_OFFSET}" INTEGER NOT NULL
+            ,   CONSTRAINT "pk_{FINGERPRINTS_TABLENAME}"
+                    PRIMARY KEY ("{FIELD_HASH}", "{FIELD_SONG_ID}", "{FIELD_OFFSET}")
+            ,   CONSTRAINT "fk_{FINGERPRINTS_TABLENAME}_{FIELD_SONG_ID}" FOREIGN KEY ("{FIELD_SONG_ID}")
+                    REFERENCES "{SONGS_TABLENAME}"("{FIELD_SONG_ID}") ON DELETE CASCADE
+            ) WITHOUT ROWID;
+
+            CREATE INDEX IF NOT EXISTS "ix_{FINGERPRINTS_TABLENAME}_{FIELD_SONG_ID}"
+            ON "{FINGERPRINTS_TABLENAME}" ("{FIELD_SONG_ID}");
+        """,
+        "CREATE_FINGERPRINTS_TABLE_UNINDEXED": f"""
+            CREATE TABLE IF NOT EXISTS "{FINGERPRINTS_TABLENAME}" (
+                "{FIELD_HASH}" INTEGER NOT NULL
+            ,   "{FIELD_SONG_ID}" INTEGER NOT NULL
+            ,   "{FIELD_OFFSET}" INTEGER NOT NULL
+            );
+        """,
+        "CREATE_FINGERPRINTS_STAGING": f"""
+            CREATE TEMPORARY TABLE "{FINGERPRINTS_STAGING_TABLENAME}" (
+                "{FIELD_HASH}" INTEGER NOT NULL
+            ,   "{FIELD_SONG_ID}" INTEGER NOT NULL
+            ,   "{FIELD_OFFSET}" INTEGER NOT NULL
+            );
+        """,
+        "CREATE_FINGERPRINTS_QUERY": f"""
+            CREATE TEMPORARY TABLE "{FINGERPRINTS_QUERY_TABLENAME}" (
+                "{FIELD_HASH}" INTEGER NOT NULL PRIMARY KEY
+            ) WITHOUT ROWID;
+        """,
+        "CREATE_FINGERPRINTS_QUERY_OFFSETS": f"""
+            CREATE TEMPORARY TABLE "{FINGERPRINTS_QUERY_TABLENAME}" (
+                "{FIELD_HASH}" INTEGER NOT NULL
+            ,   "{FIELD_OFFSET}" INTEGER NOT NULL
+            );
+        """,
+        "INSERT_FINGERPRINT": f"""
+            INSERT OR IGNORE INTO "{FINGERPRINTS_TABLENAME}" (
+                    "{FIELD_SONG_ID}"
+                ,   "{FIELD_HASH}"
+                ,   "{FIELD_OFFSET}")
+            VALUES (%s, %s, %s);
+        """,
+        "INSERT_FINGERPRINTS_STAGING": f"""
+            INSERT INTO "{FINGERPRINTS_STAGING_TABLENAME}" ("{FIELD_SONG_ID}", "{FIELD_HASH}", "{FIELD_OFFSET}")
+            VALUES (%s, %s, %s);
+        """,
+        "INSERT_FINGERPRINTS_QUERY": f"""
+            INSERT OR IGNORE INTO "{FINGERPRINTS_QUERY_TABLENAME}" ("{FIELD_HASH}") VALUES (%s);
+        """,
+        "INSERT_FINGERPRINTS_QUERY_OFFSET": f"""
+            INSERT INTO "{FINGERPRINTS_QUERY_TABLENAME}" ("{FIELD_HASH}", "{FIELD_OFFSET}") VALUES (%s, %s);
+        """,
+        "SELECT": f"""
+            SELECT "{FIELD_SONG_ID}", "{FIELD_OFFSET}"
+            FROM "{FINGERPRINTS_TABLENAME}"
+            WHERE "{FIELD_HASH}" = %s;
+        """,
+        "SELECT_MULTIPLE": f"""
+            SELECT "{FIELD_HASH}", "{FIELD_SONG_ID}", "{FIELD_OFFSET}"
+            FROM "{FINGERPRINTS_TABLENAME}"
+            WHERE "{FIELD_HASH}" IN (%s);
+        """,
+        "SELECT_MATCHES": f"""
+            SELECT f."{FIELD_HASH}", f."{FIELD_SONG_ID}", f."{FIELD_OFFSET}"
+            FROM "{FINGERPRINTS_QUERY_TABLENAME}" AS q
+            CROSS JOIN "{FINGERPRINTS_TABLENAME}" AS f ON f."{FIELD_HASH}" = q."{FIELD_HASH}";
+        """,
+        "SELECT_FREQUENT_HASHES": f"""
+            SELECT "{FIELD_HASH}", COUNT(*)
+            FROM "{FINGERPRINTS_TABLENAME}"
+            GROUP BY "{FIELD_HASH}"
+            HAVING COUNT(*) > %s;
+        """,
+        "SELECT_ALL_ORDERED": f"""
+            SELECT "{FIELD_HASH}", "{FIELD_SONG_ID}", "{FIELD_OFFSET}"
+            FROM "{FINGERPRINTS_TABLENAME}"
+            ORDER BY "{FIELD_HASH}", "{FIELD_SONG_ID}", "{FIELD_OFFSET}";
+        """,
+        "FINISH_INITIAL_BUILD": [
+            f'DROP TABLE IF EXISTS "{FINGERPRINTS_REBUILD_TABLENAME}";',
+            f"""
+                CREATE TABLE "{FINGERPRINTS_REBUILD_TABLENAME}" (
+                    "{FIELD_HASH}" INTEGER NOT NULL
+                ,   "{FIELD_SONG_ID}" INTEGER NOT NULL
+                ,   "{FIELD_OFFSET}" INTEGER NOT NULL
+                ,   CONSTRAINT "pk_{FINGERPRINTS_TABLENAME}"
+                        PRIMARY KEY ("{FIELD_HASH}", "{FIELD_SONG_ID}", "{FIELD_OFFSET}")
+                ,   CONSTRAINT "fk_{FINGERPRINTS_TABLENAME}_{FIELD_SONG_ID}" FOREIGN KEY ("{FIELD_SONG_ID}")
+                        REFERENCES "{SONGS_TABLENAME}"("{FIELD_SONG_ID}") ON DELETE CASCADE
+                ) WITHOUT ROWID;
+            """,
+            *FINISH_INITIAL_BUILD[2:]
+        ],
+        "IN_MATCH": "%s"
+    }
+
+    def __init__(self, **options):
+        super().__init__()
+        self._set_options(options)
+
+    def _set_options(self, options) -> None:
+        self._options = options
+        connection_options = dict(options)
+        # "bulk_load" switches insert_hashes to a staging table merged in a single statement.
+        self.bulk_load = connection_options.pop("bulk_load", False)
+        # connections are pooled per instance, shared by its copies and threads.
+        pool_size = connection_options.pop("pool_size", DATABASE_POOL_SIZE)
+        pool_max_idle = connection_options.pop("pool_max_idle", DATABASE_POOL_MAX_IDLE)
+        self.pool = ConnectionPool(partial(connect, **connection_options), is_alive, size=pool_size,
+                                   max_idle=pool_max_idle)
+        self.cursor = cursor_factory(self.pool)
+
+    def set_parallel_maintenance(self, cur, workers: int) -> None:
+        # pragmas don't take bound parameters.
+        cur.execute(self.SET_PARALLEL_MAINTENANCE % int(workers))
+
+    def after_fork(self) -> None:
+        # Forget the pooled connections, SQLite connections can't be used across a fork.
+        self.pool.reset()
+
+    def insert_song(self, song_name: str, file_hash: str, total_hashes: int, song_publisher: str = '',
+                    song_length: float = 0, song_singer: str = '', song_album: str = '', song_public: str = '') -> int:
+        """
+        Inserts a song name into the database, returns the new
+        identifier of the song.
+
+        :param song_name: The name of the song.
+        :param file_hash: Hash from the fingerprinted file.
+        :param total_hashes: amount of hashes to be inserted on fingerprint table.
+        :param song_publisher: The publisher of the song.
+        :param song_length: The length of the song.
+        :param song_singer: The singer of the song.
+        :param song_album: The album of the song.
+        :param song_public: The public time of the song.
+        :return: the inserted id.
+        """
+        with self.cursor() as cur:
+            cur.execute(self.INSERT_SONG, (song_name, file_hash, total_hashes, song_publisher, song_length, song_singer,
+                                           song_album, song_public))
+            return cur.lastrowid
+
+    def load_staging(self, cur, rows: Iterable[Tuple[int, str, int]]) -> None:
+        """
+        Bulk loads fingerprints into the staging table, all of them within the current transaction.
+
+        :param cur: an open cursor, the staging table exists and is empty.
+        :param rows: A sequence of tuples in the format (song_id, hash, offset)
+        """
+        cur.executemany(self.INSERT_FINGERPRINTS_STAGING, rows)
+
+    def select_matches(self, cur, hashes: List[str], batch_size: int = 1000) -> Iterable[Tuple[str, int, int]]:
+        """
+        Selects the fingerprints having any of the given hashes by inserting them into a temporary table
+        joined with the fingerprints table, which takes the same few statements whatever the amount of hashes.
+
+        :param cur: an open cursor.
+        :param hashes: the distinct hashes searched.
+        :param batch_size: unused, all the hashes are inserted into the temporary table at once.
+        :return: the (hash, song id, offset) of every fingerprint matched.
+        """
+        # a connection reused from the pool may still hold the table of a failed query.
+        cur.execute(self.DROP_FINGERPRINTS_QUERY)
+        cur.execute(self.CREATE_FINGERPRINTS_QUERY)
+        cur.executemany(self.INSERT_FINGERPRINTS_QUERY, [(hsh,) for hsh in hashes])
+        cur.execute(self.SELECT_MATCHES)
+        rows = cur.fetchall()
+        cur.execute(self.DROP_FINGERPRINTS_QUERY)
+        return rows
+
+    def select_aligned_matches(self, cur, hashes: List[Tuple[str, int]],
+                               topn: int) -> Iterable[Tuple[int, int, int, int]]:
+        """
+        Aligns the fingerprints matching the given (hash, offset) pairs by inserting them into a temporary
+        table joined with the fingerprints table.
+
+        :param cur: an open cursor.
+        :param hashes: the distinct (hash, offset) pairs of the query.
+        :param topn: number of songs returned.
+        :return: the (song id, offset difference, count, hashes matched) of the best candidate of each
+         of the topn songs.
+        """
+        # a connection reused from the pool may still hold the table of a failed query.
+        cur.execute(self.DROP_FINGERPRINTS_QUERY)
+        cur.execute(self.CREATE_FINGERPRINTS_QUERY_OFFSETS)
+        cur.executemany(self.INSERT_FINGERPRINTS_QUERY_OFFSET, hashes)
+        cur.execute(self.SELECT_ALIGNED_MATCHES, (topn,))
+        rows = cur.fetchall()
+        cur.execute(self.DROP_FINGERPRINTS_QUERY)
+        return rows
+
+    def __copy__(self):
+        # copies (e.g. the ingestion writers' ones) check connections out of the same pool.
+        clone = self.__class__.__new__(self.__class__)
+        clone.__dict__.update(self.__dict__)
+        clone.catalog_settings = dict(self.catalog_settings)
+        return clone
+
+    def __getstate__(self):
+        return self._options, self.fingerprint_format, self.catalog_settings
+
+    def __setstate__(self, state):
+        options, fingerprint_format, self.catalog_settings = state
+        self._set_options(options)
+        self.set_fingerprint_format(fingerprint_format)
+
+
+def _has_unhex() -> bool:
+    conn = sqlite3.connect(":memory:")
+    try:
+        conn.execute("SELECT unhex('00');")
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+
+
+# unhex() is built in since SQLite 3.41, older versions get a Python implementation.
+HAS_UNHEX = _has_unhex()
+
+
+def connect(database: str, page_size: int = SQLITE_PAGE_SIZE, mmap_size: int = SQLITE_MMAP_SIZE,
+            cache_size: int = SQLITE_CACHE_SIZE, busy_timeout: float = SQLITE_BUSY_TIMEOUT) -> sqlite3.Connection:
+    """
+    Opens a connection to the database file, tuned for a fingerprints catalog.
+
+    :param database: path of the database file.
+    :param page_size: bytes per page, only applies when the file is created.
+    :param mmap_size: bytes of the file read through memory mapping instead of read calls.
+    :param cache_size: kibibytes of page cache of the connection.
+    :param busy_timeout: seconds a statement waits for the lock held by another writer.
+    :return: an open connection.
+    """
+    conn = sqlite3.connect(database, timeout=busy_timeout, detect_types=sqlite3.PARSE_COLNAMES,
+                           check_same_thread=False)
+    if not HAS_UNHEX:
+        conn.create_function("unhex", 1, bytes.fromhex, deterministic=True)
+
+    conn.execute(f"PRAGMA page_size = {int(page_size)};")
+    # readers don't block the writer (nor the other way around), from any process.
+    conn.execute("PRAGMA journal_mode = WAL;")
+    # in WAL mode, transactions stay durable on application crashes, only fsyncing at checkpoints.
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    conn.execute(f"PRAGMA mmap_size = {int(mmap_size)};")
+    conn.execute(f"PRAGMA cache_size = -{int(cache_size)};")
+    conn.execute("PRAGMA temp_store = MEMORY;")
+    conn.execute("PRAGMA foreign_keys = ON;")
+    return conn
+
+
+def cursor_factory(pool: ConnectionPool):
+    def cursor(**options):
+        return Cursor(pool, **options)
+    return cursor
+
+
+def is_alive(conn) -> bool:
+    try:
+        conn.execute("SELECT 1;")
+        return True
+    except sqlite3.Error:
+        return False
+
+
+def dict_factory(cursor, row) -> dict:
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+class Cursor(object):
+    """
+    Checks a connection out of the pool and returns an open cursor, taking the "%s" placeholders the
+    statements of the other databases use. The transaction is committed on exit and the connection
+    given back to the pool, unless an exception was raised: the transaction is then rolled back and
+    the connection discarded.
+    # Use as context manager
+    with Cursor(pool) as cur:
+        cur.execute(query)
+        ...
+    """
+    def __init__(self, pool: ConnectionPool, dictionary=False, buffered=False, server_side=False):
+        super().__init__()
+        # SQLite cursors step through the result as it's fetched, "buffered" and "server_side" are there
+        # for compatibility with the other databases.
+        self.pool = pool
+        self.conn = pool.acquire()
+        self.dictionary = dictionary
+
+    def __enter__(self):
+        self.cursor = self.conn.cursor()
+        if self.dictionary:
+            self.cursor.row_factory = dict_factory
+        return self
+
+    @DejavuTimer(name=__name__ + ".Cursor.execute()\t\t\t[agg]")
+    def execute(self, operation, params=()):
+        if not params and operation.count(";") > 1:
+            # several statements (e.g. a table and its index), run as a script.
+            return self.cursor.executescript(operation)
+        return self.cursor.execute(operation.replace("%s", "?"), params)
+
+    def executemany(self, operation, seq_params):
+        return self.cursor.executemany(operation.replace("%s", "?"), seq_params)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def fetchmany(self, size=1):
+        return self.cursor.fetchmany(size)
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    def __iter__(self):
+        return self.cursor.__iter__()
+
+    def __next__(self):
+        return self.cursor.__next__()
+
+    def __exit__(self, extype, exvalue, traceback):
+        if extype is not None:
+            # closing the connection rolls the transaction back.
+            self.pool.release(self.conn, discard=True)
+            return
+
+        try:
+            self.cursor.close()
+            self.conn.commit()
+        except sqlite3.Error:
+            self.pool.release(self.conn, discard=True)
+            raise
+
+        self.pool.release(self.conn)
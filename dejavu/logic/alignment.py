@@ -0,0 +1,93 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from dejavu.third_party.dejavu_timer import DejavuTimer
+
+
+def expand_matches(hash_indexes: np.ndarray, song_ids: np.ndarray, offsets: np.ndarray,
+                   sampled_offsets: List[List[int]]) -> Tuple[Tuple[np.ndarray, np.ndarray], Dict[int, int]]:
+    """
+    Turns the fingerprints matched by a query into (song id, offset difference) matches, every
+    fingerprint giving one match per offset its hash was sampled at in the query.
+
+    :param hash_indexes: index, within sampled_offsets, of the hash of every fingerprint matched.
+    :param song_ids: song id of every fingerprint matched.
+    :param offsets: offset of every fingerprint matched.
+    :param sampled_offsets: the offsets every distinct hash of the query was sampled at.
+    :return: two parallel arrays, song ids and offset differences, and a dictionary with the amount of
+     fingerprints matched in each song.
+    """
+    if len(song_ids) == 0:
+        return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)), {}
+
+    # sampled offsets of every hash laid out one after another, hash i owning
+    # flat_offsets[starts[i]: starts[i] + counts[i]].
+    counts = np.fromiter((len(hash_offsets) for hash_offsets in sampled_offsets), dtype=np.int64,
+                         count=len(sampled_offsets))
+    starts = np.cumsum(counts) - counts
+    flat_offsets = np.fromiter((offset for hash_offsets in sampled_offsets for offset in hash_offsets),
+                               dtype=np.int64, count=int(counts.sum()))
+
+    song_ids = np.asarray(song_ids, dtype=np.int64)
+    matched_sids, matched_counts = np.unique(song_ids, return_counts=True)
+    dedup_hashes = dict(zip(matched_sids.tolist(), matched_counts.tolist()))
+
+    # every fingerprint is repeated once per sampled offset of its hash.
+    repeats = counts[hash_indexes]
+    positions = np.arange(int(repeats.sum())) - np.repeat(np.cumsum(repeats) - repeats - starts[hash_indexes], repeats)
+
+    return (np.repeat(song_ids, repeats),
+            np.repeat(np.asarray(offsets, dtype=np.int64), repeats) - flat_offsets[positions]), dedup_hashes
+
+
+@DejavuTimer(name=__name__ + ".best_offsets()\t\t\t\t")
+def best_offsets(song_ids: np.ndarray, offset_differences: np.ndarray,
+                 topn: Optional[int] = None) -> List[Tuple[int, int, int]]:
+    """
+    Counts how many times each (song, offset difference) pair was matched and keeps, for every song,
+    the offset difference matched the most (the lowest one on ties). Songs are ranked by that count,
+    the lowest song id first on ties.
+
+    The (song, offset difference) pairs are packed into single integers and counted with np.unique,
+    and only the topn songs are fully sorted.
+
+    :param song_ids: song id of every match.
+    :param offset_differences: offset difference (database offset - sampled offset) of every match.
+    :param topn: number of songs returned, all of them if None.
+    :return: a list of (song id, offset difference, count) tuples, the best songs first.
+    """
+    song_ids = np.asarray(song_ids, dtype=np.int64)
+    offset_differences = np.asarray(offset_differences, dtype=np.int64)
+    if len(song_ids) == 0:
+        return []
+
+    min_sid, min_diff = song_ids.min(), offset_differences.min()
+    sids_range = int(song_ids.max() - min_sid) + 1
+    diffs_range = int(offset_differences.max() - min_diff) + 1
+
+    if sids_range * diffs_range < 2 ** 62:
+        keys, counts = np.unique((song_ids - min_sid) * diffs_range + (offset_differences - min_diff),
+                                 return_counts=True)
+        sids, diffs = keys // diffs_range + min_sid, keys % diffs_range + min_diff
+    else:
+        # the pairs can't be packed in 64 bits, they are sorted and run length counted instead.
+        order = np.lexsort((offset_differences, song_ids))
+        sids, diffs = song_ids[order], offset_differences[order]
+        starts = np.flatnonzero(np.r_[True, (sids[1:] != sids[:-1]) | (diffs[1:] != diffs[:-1])])
+        counts = np.diff(np.r_[starts, len(sids)])
+        sids, diffs = sids[starts], diffs[starts]
+
+    # pairs are in (song, offset difference) order, put the best count of each song first.
+    order = np.lexsort((diffs, -counts, sids))
+    sids, diffs, counts = sids[order], diffs[order], counts[order]
+    firsts = np.flatnonzero(np.r_[True, sids[1:] != sids[:-1]])
+    sids, diffs, counts = sids[firsts], diffs[firsts], counts[firsts]
+
+    # rank songs by count, then by song id, only the topn ones get sorted.
+    if topn is not None and topn < len(sids) and int(counts.max()) * sids_range < 2 ** 62:
+        top = np.argpartition(-counts * sids_range + (sids - min_sid), topn - 1)[:topn]
+        sids, diffs, counts = sids[top], diffs[top], counts[top]
+    ranking = np.lexsort((sids, -counts))[:topn]
+
+    return list(zip(sids[ranking].tolist(), diffs[ranking].tolist(), counts[ranking].tolist()))
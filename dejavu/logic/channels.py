@@ -0,0 +1,52 @@
+from typing import List
+
+import numpy as np
+
+from dejavu.config.settings import (CHANNEL_STRATEGY, CHANNEL_STRATEGY_ALL,
+                                    CHANNEL_STRATEGY_LOUDEST,
+                                    CHANNEL_STRATEGY_MID)
+
+CHANNEL_STRATEGIES = (CHANNEL_STRATEGY_ALL, CHANNEL_STRATEGY_MID, CHANNEL_STRATEGY_LOUDEST)
+
+
+def downmix(channels: List[np.ndarray]) -> np.ndarray:
+    """
+    :param channels: samples of every channel, all of them of the same length.
+    :return: the mid downmix, the average of all the channels, as int16 samples.
+    """
+    if len(channels) == 1:
+        return np.asarray(channels[0])
+
+    # accumulated in 32 bits so the sum of the 16 bits samples can't overflow.
+    total = np.asarray(channels[0], dtype=np.int32).copy()
+    for channel in channels[1:]:
+        total += np.asarray(channel, dtype=np.int32)
+    return (total // len(channels)).astype(np.int16)
+
+
+def channel_energy(samples: np.ndarray) -> float:
+    """
+    :param samples: samples of a channel.
+    :return: the sum of the squared samples.
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    return float(np.dot(samples, samples))
+
+
+def select_channels(channels: List[np.ndarray], strategy: str = CHANNEL_STRATEGY) -> List[np.ndarray]:
+    """
+    Picks the channels of an audio that get fingerprinted.
+
+    :param channels: samples of every channel.
+    :param strategy: channel strategy, either "all", "mid" or "loudest".
+    :return: the channels to fingerprint, a single one unless the strategy is "all".
+    """
+    if strategy not in CHANNEL_STRATEGIES:
+        raise TypeError("Unsupported channel strategy supplied.")
+
+    if strategy == CHANNEL_STRATEGY_ALL or len(channels) <= 1:
+        return list(channels)
+    if strategy == CHANNEL_STRATEGY_MID:
+        return [downmix(channels)]
+    # the first channel wins on ties.
+    return [channels[int(np.argmax([channel_energy(channel) for channel in channels]))]]
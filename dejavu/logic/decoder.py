@@ -1,12 +1,23 @@
 import fnmatch
+import io
+import json
 import os
+import subprocess
+import tempfile
+import threading
 from hashlib import sha1
-from typing import List, Tuple
+from math import gcd
+from typing import Iterator, List, Tuple
 
 import numpy as np
 from pydub import AudioSegment
-from pydub.utils import audioop
+from pydub.exceptions import CouldntDecodeError
+from pydub.utils import get_prober_name
+from scipy.signal import resample_poly
 
+from dejavu.config.settings import (DECODER_BACKEND, DECODER_BACKEND_FFMPEG,
+                                    DECODER_BACKEND_PYDUB,
+                                    DECODER_BLOCK_FRAMES)
 from dejavu.third_party import wavio
 from dejavu.third_party.dejavu_timer import DejavuTimer
 
@@ -22,14 +33,47 @@ def unique_hash(file_path: str, block_size: int = 2**20) -> str:
     :param block_size: read block size.
     :return: a hash in an hexagesimal string form.
     """
-    s = sha1()
-    with open(file_path, "rb") as f:
-        while True:
-            buf = f.read(block_size)
-            if not buf:
-                break
-            s.update(buf)
-    return s.hexdigest().upper()
+    with HashingReader(file_path, block_size=block_size) as reader:
+        return reader.hexdigest()
+
+
+class HashingReader(object):
+    """
+    Reads a file while computing the SHA1 of its contents, so the bytes handed to a decoder are
+    hashed in the same pass instead of reading the file again afterwards.
+
+    hexdigest() reads whatever the consumer left unread (e.g. when decoding stopped at a limit)
+    before returning the hash of the whole file.
+
+    # Use as context manager
+    with HashingReader(file_path) as reader:
+        data = reader.read()
+        file_hash = reader.hexdigest()
+    """
+    def __init__(self, file_path: str, block_size: int = 2**20):
+        super().__init__()
+        self.block_size = block_size
+        self._file = open(file_path, "rb")
+        self._sha1 = sha1()
+
+    def read(self, size: int = -1) -> bytes:
+        buf = self._file.read(size)
+        self._sha1.update(buf)
+        return buf
+
+    def hexdigest(self) -> str:
+        while self.read(self.block_size):
+            pass
+        return self._sha1.hexdigest().upper()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, extype, exvalue, traceback):
+        self.close()
 
 
 def find_files(path: str, extensions: List[str]) -> List[Tuple[str, str]]:
@@ -53,11 +97,12 @@ def find_files(path: str, extensions: List[str]) -> List[Tuple[str, str]]:
 
 
 @DejavuTimer(name=__name__ + ".read()\t\t\t\t\t\t")
-def read(file_name: str, limit: int = None) -> Tuple[List[List[int]], int, str]:
+def read(file_name: str, limit: int = None, backend: str = DECODER_BACKEND,
+         frame_rate: int = None) -> Tuple[List[List[int]], int, str]:
     """
     Reads any file supported by pydub (ffmpeg) and returns the data contained
-    within. If file reading fails due to input being a 24-bit wav file,
-    wavio is used as a backup.
+    within. PCM wav files (including 24-bit ones, which pydub does not support)
+    are memory mapped with wavio instead, whatever the backend.
 
     Can be optionally limited to a certain amount of seconds from the start
     of the file by specifying the `limit` parameter. This is the amount of
@@ -65,33 +110,361 @@ def read(file_name: str, limit: int = None) -> Tuple[List[List[int]], int, str]:
 
     :param file_name: file to be read.
     :param limit: number of seconds to limit.
+    :param backend: decoder backend, either "pydub" or "ffmpeg".
+    :param frame_rate: sampling rate the audio is resampled to, None keeps the one of the file. ffmpeg
+     resamples while decoding, wav files and files decoded by pydub are resampled once decoded.
+    :return: tuple list of (channels, sample_rate, content_file_hash).
+    """
+    if backend not in (DECODER_BACKEND_PYDUB, DECODER_BACKEND_FFMPEG):
+        raise TypeError("Unsupported decoder backend supplied.")
+
+    if _is_wav(file_name):
+        try:
+            channels, rate, file_hash = read_wav(file_name, limit)
+            return resample_channels(channels, rate, frame_rate), frame_rate or rate, file_hash
+        except wavio.WavFormatError:
+            # not a wav file wavio can map (e.g. floating point samples), it is decoded as any other file.
+            pass
+
+    if backend == DECODER_BACKEND_FFMPEG:
+        with PCMStream(file_name, limit=limit, frame_rate=frame_rate, hash_file=True) as stream:
+            # blocks are read into a reused buffer, so each one is copied per channel.
+            blocks = [block.T.copy() for block in stream]
+            frame_rate, n_channels = stream.frame_rate, stream.channels
+
+        data = np.concatenate(blocks, axis=1) if blocks else np.empty((n_channels, 0), dtype=np.int16)
+        return list(data), frame_rate, stream.file_hash
+
+    # the file is read once, hashed, and handed to pydub from memory.
+    with HashingReader(file_name) as reader:
+        content = reader.read()
+        file_hash = reader.hexdigest()
+
+    audiofile = _load_segment(file_name, content)
+
+    if limit:
+        audiofile = audiofile[:limit * 1000]
+
+    data = np.fromstring(audiofile.raw_data, np.int16)
+
+    channels = []
+    for chn in range(audiofile.channels):
+        channels.append(data[chn::audiofile.channels])
+
+    return resample_channels(channels, audiofile.frame_rate, frame_rate), frame_rate or audiofile.frame_rate, \
+        file_hash
+
+
+def resample(samples: np.ndarray, rate: int, frame_rate: int) -> np.ndarray:
+    """
+    Resamples a channel through a polyphase filter, which low pass filters it below the new Nyquist
+    frequency when downsampling.
+
+    :param samples: 16 bits samples of the channel.
+    :param rate: sampling rate of the samples.
+    :param frame_rate: sampling rate the samples are resampled to.
+    :return: the resampled 16 bits samples.
+    """
+    if rate == frame_rate:
+        return np.asarray(samples)
+
+    divisor = gcd(rate, frame_rate)
+    resampled = resample_poly(np.asarray(samples, dtype=np.float32), frame_rate // divisor, rate // divisor)
+    return np.clip(np.rint(resampled), -32768, 32767).astype(np.int16)
+
+
+def resample_channels(channels: List[np.ndarray], rate: int, frame_rate: int = None) -> List[np.ndarray]:
+    """
+    :param channels: 16 bits samples of every channel.
+    :param rate: sampling rate of the channels.
+    :param frame_rate: sampling rate the channels are resampled to, None keeps them as they are.
+    :return: the channels at the requested sampling rate.
+    """
+    if frame_rate is None or frame_rate == rate:
+        return channels
+    return [resample(channel, rate, frame_rate) for channel in channels]
+
+
+def read_wav(file_name: str, limit: int = None) -> Tuple[List[np.ndarray], int, str]:
+    """
+    Reads a PCM wav file through a memory map. For 16 and 24-bit files the channels returned are views
+    over the mapped file, so the samples are only paged in as they get fingerprinted and never copied.
+
+    :param file_name: wav file to be read.
+    :param limit: number of seconds to limit.
     :return: tuple list of (channels, sample_rate, content_file_hash).
     """
-    # pydub does not support 24-bit wav files, use wavio when this occurs
+    wav = wavio.WavMap(file_name)
+    nframes = min(wav.nframes, int(limit * wav.rate)) if limit else wav.nframes
+    data = _wav_samples_as_int16(wav.data[:nframes], wav.sampwidth)
+
+    # hashing through the map pages the file in, the samples are then read from the page cache.
+    file_hash = sha1(wav.file_bytes).hexdigest().upper()
+
+    return [data[:, chn] for chn in range(wav.nchannels)], wav.rate, file_hash
+
+
+def open_stream(file_name: str, limit: int = None, hash_file: bool = False, frame_rate: int = None):
+    """
+    Opens a stream of 16-bit PCM blocks over a file: a WavStream for PCM wav files, a PCMStream (ffmpeg)
+    for anything else, or for wav files needing to be resampled.
+
+    :param file_name: file to be read.
+    :param limit: number of seconds to limit.
+    :param hash_file: whether to compute the hash of the file contents while reading it.
+    :param frame_rate: sampling rate the audio is resampled to, None keeps the one of the file.
+    :return: the stream, to be used as a context manager.
+    """
+    if _is_wav(file_name):
+        try:
+            # the rate is read from the header first, so files to be resampled are never mapped.
+            if frame_rate is None or wavio.read_rate(file_name) == frame_rate:
+                return WavStream(file_name, limit=limit, hash_file=hash_file)
+        except wavio.WavFormatError:
+            pass
+    return PCMStream(file_name, limit=limit, frame_rate=frame_rate, hash_file=hash_file)
+
+
+def _is_wav(file_name: str) -> bool:
+    return os.path.splitext(file_name)[1].lower() == ".wav"
+
+
+def _wav_samples_as_int16(samples: np.ndarray, sampwidth: int) -> np.ndarray:
+    """
+    Converts samples given by wavio.WavMap to 16 bits as ffmpeg does. 16-bit samples, and 24-bit ones
+    (already viewed through their 16 most significant bits), are returned as they are, without a copy.
+    """
+    if sampwidth == 1:
+        return (samples.astype(np.int16) - 128) << 8
+    elif sampwidth == 4:
+        return (samples >> 16).astype(np.int16)
+    return samples
+
+
+def _load_segment(file_name: str, content: bytes) -> AudioSegment:
+    """
+    Loads a file already read in memory with pydub.
+
+    :param file_name: the file name, used to identify wav files and as a fallback.
+    :param content: the file contents.
+    :return: the decoded audio segment.
+    """
+    # without a file name pydub can only tell wav files apart if told so, ffmpeg detects the rest.
+    try:
+        return AudioSegment.from_file(io.BytesIO(content), format="wav" if _is_wav(file_name) else None)
+    except CouldntDecodeError:
+        # containers with their index at the end (e.g. mp4 without faststart) can't be decoded from
+        # memory, as ffmpeg reads it through a pipe.
+        return AudioSegment.from_file(file_name)
+
+
+def probe(file_name: str) -> Tuple[int, int]:
+    """
+    Gets the sampling rate and number of channels of the first audio stream of a file through ffprobe.
+
+    :param file_name: file to be probed.
+    :return: tuple of (sample_rate, channels).
+    """
+    command = [get_prober_name(), "-v", "error", "-select_streams", "a:0",
+               "-show_entries", "stream=sample_rate,channels", "-of", "json", file_name]
     try:
-        audiofile = AudioSegment.from_file(file_name)
+        output = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True).stdout
+        stream = json.loads(output)["streams"][0]
+    except (subprocess.CalledProcessError, KeyError, IndexError, ValueError) as err:
+        raise DecodeError(f"Couldn't probe the audio stream of {file_name}: {err}")
+
+    return int(stream["sample_rate"]), int(stream["channels"])
 
-        if limit:
-            audiofile = audiofile[:limit * 1000]
 
-        data = np.fromstring(audiofile.raw_data, np.int16)
+class PCMStream(object):
+    """
+    Decodes an audio file with an ffmpeg subprocess writing raw signed 16 bits little endian PCM to a pipe,
+    which is read in blocks of a fixed number of frames. Blocks are numpy arrays of shape (frames, channels)
+    read with readinto into the same reused buffer, so a block is only valid until the next one is read
+    (copy it to keep it).
+
+    ffmpeg resamples and remixes to the requested sampling rate and number of channels (by default the ones
+    of the file), and stops decoding after `limit` seconds.
+
+    With `hash_file`, the file is fed to ffmpeg through its stdin by a HashingReader, and `file_hash` holds
+    the SHA1 of the file contents once every block has been read.
+
+    # Use as context manager
+    with PCMStream(file_name, limit=10) as stream:
+        for block in stream:
+            ...
+    """
+    def __init__(self, file_name: str, limit: int = None, frame_rate: int = None, channels: int = None,
+                 block_frames: int = DECODER_BLOCK_FRAMES, hash_file: bool = False):
+        super().__init__()
+        self.file_name = file_name
+        self.limit = limit
+        self.hash_file = hash_file
+        self.file_hash = None
+
+        if frame_rate is None or channels is None:
+            native_frame_rate, native_channels = probe(file_name)
+            frame_rate = frame_rate or native_frame_rate
+            channels = channels or native_channels
+
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.block_frames = block_frames
+
+        self._buffer = np.empty((block_frames, channels), dtype=np.int16)
+        self._view = memoryview(self._buffer).cast("B")
+        self._process = None
+        self._stderr = None
+        self._reader = None
+        self._feeder = None
+        self._closing = threading.Event()
+
+    def command(self, from_pipe: bool = False) -> List[str]:
+        command = [AudioSegment.converter, "-v", "error"]
+        if self.limit:
+            # as an input option, ffmpeg stops reading the file once the limit is reached.
+            command += ["-t", str(self.limit)]
+        if from_pipe:
+            # the cache protocol keeps the input seekable backwards, some containers need it.
+            command += ["-i", "cache:pipe:0"]
+        else:
+            command += ["-nostdin", "-i", self.file_name]
+        command += ["-vn", "-f", "s16le", "-acodec", "pcm_s16le",
+                    "-ar", str(self.frame_rate), "-ac", str(self.channels), "pipe:1"]
+        return command
+
+    def __enter__(self):
+        self._start(from_pipe=self.hash_file)
+        return self
+
+    def _start(self, from_pipe: bool) -> None:
+        # stderr goes to a file, a pipe nobody reads could fill up and block ffmpeg.
+        self._stderr = tempfile.TemporaryFile()
+        if from_pipe:
+            self._reader = HashingReader(self.file_name)
+            self._process = subprocess.Popen(self.command(from_pipe=True), stdin=subprocess.PIPE,
+                                             stdout=subprocess.PIPE, stderr=self._stderr)
+            self._feeder = threading.Thread(target=self._feed, daemon=True)
+            self._feeder.start()
+        else:
+            self._process = subprocess.Popen(self.command(), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                             stderr=self._stderr)
+
+    def _feed(self) -> None:
+        try:
+            while not self._closing.is_set():
+                buf = self._reader.read(self._reader.block_size)
+                if not buf:
+                    break
+                self._process.stdin.write(buf)
+        except (BrokenPipeError, ValueError):
+            # ffmpeg stopped reading (limit reached or failure), the rest of the file is still hashed.
+            pass
+        finally:
+            try:
+                self._process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+        if not self._closing.is_set():
+            self.file_hash = self._reader.hexdigest()
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        frame_size = 2 * self.channels
+        decoded = False
+        while True:
+            filled = 0
+            while filled < len(self._view):
+                n = self._process.stdout.readinto(self._view[filled:])
+                if not n:
+                    break
+                filled += n
+
+            frames = filled // frame_size
+            if frames:
+                decoded = True
+                yield self._buffer[:frames]
+
+            if filled < len(self._view):
+                break
+
+        if self._process.wait() != 0:
+            if self._feeder is not None and not decoded:
+                # containers with their index at the end (e.g. mp4 without faststart) can't be decoded from
+                # a pipe, so the file is decoded again from its path. Its hash comes from the bytes already fed.
+                self._close()
+                self._start(from_pipe=False)
+                yield from self
+                return
+
+            self._stderr.seek(0)
+            raise DecodeError(f"ffmpeg couldn't decode {self.file_name}: "
+                              f"{self._stderr.read().decode('utf-8', 'replace').strip()}")
+
+        if self._feeder is not None:
+            self._feeder.join()
+
+    def __exit__(self, extype, exvalue, traceback):
+        self._closing.set()
+        self._close()
+
+    def _close(self) -> None:
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.stdout.close()
+        self._process.wait()
+        if self._feeder is not None:
+            self._feeder.join()
+            self._reader.close()
+            self._feeder = None
+        self._stderr.close()
+
+
+class WavStream(object):
+    """
+    Reads a PCM wav file through a wavio.WavMap, giving the same blocks PCMStream does without running ffmpeg.
+    Blocks of 16 and 24-bit files are views over the mapped file (24-bit samples through their 16 most
+    significant bits), other sample widths are converted one block at a time.
+
+    With `hash_file`, the file is hashed from the map along the blocks, and `file_hash` holds the SHA1 of the
+    file contents once every block has been read.
+    """
+    def __init__(self, file_name: str, limit: int = None, block_frames: int = DECODER_BLOCK_FRAMES,
+                 hash_file: bool = False):
+        super().__init__()
+        self.file_name = file_name
+        self.wav = wavio.WavMap(file_name)
+        self.frame_rate = self.wav.rate
+        self.channels = self.wav.nchannels
+        self.nframes = min(self.wav.nframes, int(limit * self.frame_rate)) if limit else self.wav.nframes
+        self.block_frames = block_frames
+        self.hash_file = hash_file
+        self.file_hash = None
+
+    def __enter__(self):
+        return self
 
-        channels = []
-        for chn in range(audiofile.channels):
-            channels.append(data[chn::audiofile.channels])
+    def __iter__(self) -> Iterator[np.ndarray]:
+        wav = self.wav
+        hasher = sha1() if self.hash_file else None
+        hashed = 0
+        for start in range(0, self.nframes, self.block_frames):
+            end = min(start + self.block_frames, self.nframes)
+            if hasher is not None:
+                # hashed before being used, so the pages are already in memory when fingerprinting them.
+                block_end = wav.data_offset + end * wav.block_align
+                hasher.update(wav.file_bytes[hashed:block_end])
+                hashed = block_end
 
-        audiofile.frame_rate
-    except audioop.error:
-        _, _, audiofile = wavio.readwav(file_name)
+            yield _wav_samples_as_int16(wav.data[start:end], wav.sampwidth)
 
-        if limit:
-            audiofile = audiofile[:limit * 1000]
+        if hasher is not None:
+            hasher.update(wav.file_bytes[hashed:])
+            self.file_hash = hasher.hexdigest().upper()
 
-        audiofile = audiofile.T
-        audiofile = audiofile.astype(np.int16)
+    def __exit__(self, extype, exvalue, traceback):
+        pass
 
-        channels = []
-        for chn in audiofile:
-            channels.append(chn)
 
-    return channels, audiofile.frame_rate, unique_hash(file_name)
+class DecodeError(Exception):
+    pass
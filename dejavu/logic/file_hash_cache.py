@@ -0,0 +1,92 @@
+import os
+import sqlite3
+import threading
+from typing import Optional, Tuple
+
+from dejavu.config.settings import (FIELD_FILE_SHA1, FIELD_INODE, FIELD_MTIME,
+                                    FIELD_PATH, FIELD_SIZE,
+                                    FILE_HASHES_TABLENAME)
+
+
+class FileHashCache(object):
+    """
+    Persistent cache of file content hashes, kept in a SQLite file. Entries are keyed by the file path
+    and only used while the size, modification time and inode of the file are the ones it had when
+    hashed, so a library rescan only reads the files that are new or changed.
+
+    It is meant to be used from a single process (the one deciding which files get fingerprinted),
+    from any of its threads.
+
+    # Use as:
+    cache = FileHashCache("hashes.sqlite")
+    key = cache.file_key(file_path)
+    file_hash = cache.get(key)
+    if file_hash is None:
+        file_hash = unique_hash(file_path)
+        cache.set(key, file_hash)
+    """
+    CREATE_FILE_HASHES_TABLE = f"""
+        CREATE TABLE IF NOT EXISTS "{FILE_HASHES_TABLENAME}" (
+            "{FIELD_PATH}" TEXT NOT NULL PRIMARY KEY
+        ,   "{FIELD_SIZE}" INTEGER NOT NULL
+        ,   "{FIELD_MTIME}" INTEGER NOT NULL
+        ,   "{FIELD_INODE}" INTEGER NOT NULL
+        ,   "{FIELD_FILE_SHA1}" TEXT NOT NULL
+        );
+    """
+
+    SELECT_FILE_HASH = f"""
+        SELECT "{FIELD_FILE_SHA1}"
+        FROM "{FILE_HASHES_TABLENAME}"
+        WHERE "{FIELD_PATH}" = ? AND "{FIELD_SIZE}" = ? AND "{FIELD_MTIME}" = ? AND "{FIELD_INODE}" = ?;
+    """
+
+    INSERT_FILE_HASH = f"""
+        INSERT OR REPLACE INTO "{FILE_HASHES_TABLENAME}" (
+            "{FIELD_PATH}", "{FIELD_SIZE}", "{FIELD_MTIME}", "{FIELD_INODE}", "{FIELD_FILE_SHA1}"
+        ) VALUES (?, ?, ?, ?, ?);
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self.connection:
+            self.connection.execute(self.CREATE_FILE_HASHES_TABLE)
+
+    @staticmethod
+    def file_key(file_path: str) -> Tuple[str, int, int, int]:
+        """
+        Identifies the current version of a file. It has to be taken before the file gets read, so a change
+        made while hashing it leaves a stale key behind instead of a wrong hash.
+
+        :param file_path: path to the file.
+        :return: a tuple of (absolute path, size, modification time in nanoseconds, inode).
+        """
+        stat = os.stat(file_path)
+        return os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+    def get(self, key: Tuple[str, int, int, int]) -> Optional[str]:
+        """
+        Gets the hash of a file if it didn't change since it was cached.
+
+        :param key: the file key, as given by file_key.
+        :return: the hash of the file contents, or None if unknown.
+        """
+        with self._lock:
+            row = self.connection.execute(self.SELECT_FILE_HASH, key).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: Tuple[str, int, int, int], file_hash: str) -> None:
+        """
+        Caches the hash of a file, replacing any previous one for the same path.
+
+        :param key: the file key, as given by file_key before reading the file.
+        :param file_hash: the hash of the file contents.
+        """
+        with self._lock, self.connection:
+            self.connection.execute(self.INSERT_FILE_HASH, (*key, file_hash))
+
+    def close(self) -> None:
+        self.connection.close()
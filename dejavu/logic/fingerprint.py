@@ -1,9 +1,7 @@
 import hashlib
-from operator import itemgetter
-from typing import List, Tuple
+from functools import lru_cache
+from typing import List, Tuple, Union
 
-import matplotlib.mlab as mlab
-import matplotlib.pyplot as plt
 import numpy as np
 from scipy.ndimage.filters import maximum_filter
 from scipy.ndimage.morphology import (binary_erosion,
@@ -13,9 +11,17 @@ from scipy.ndimage.morphology import (binary_erosion,
 from dejavu.config.settings import (CONNECTIVITY_MASK, DEFAULT_AMP_MIN,
                                     DEFAULT_FAN_VALUE, DEFAULT_FS,
                                     DEFAULT_OVERLAP_RATIO, DEFAULT_WINDOW_SIZE,
+                                    FINGERPRINT_FORMAT,
+                                    FINGERPRINT_FORMAT_PACKED,
+                                    FINGERPRINT_FORMAT_SHA1,
                                     FINGERPRINT_REDUCTION, MAX_HASH_TIME_DELTA,
-                                    MIN_HASH_TIME_DELTA,
-                                    PEAK_NEIGHBORHOOD_SIZE, PEAK_SORT)
+                                    MIN_HASH_TIME_DELTA, PACKED_FIELD_BITS,
+                                    PEAK_NEIGHBORHOOD_SIZE, PEAK_SORT,
+                                    SPECTROGRAM_DTYPE)
+from dejavu.logic.fingerprint_batch import (PACKED_KEY_DTYPE,
+                                            SHA1_KEY_DTYPE, FingerprintBatch)
+from dejavu.logic.fingerprint_profile import FingerprintProfile
+from dejavu.logic.stft import spectrogram
 
 from dejavu.third_party.dejavu_timer import DejavuTimer
 
@@ -26,7 +32,10 @@ def fingerprint(channel_samples: List[int],
                 wsize: int = DEFAULT_WINDOW_SIZE,
                 wratio: float = DEFAULT_OVERLAP_RATIO,
                 fan_value: int = DEFAULT_FAN_VALUE,
-                amp_min: int = DEFAULT_AMP_MIN) -> List[Tuple[str, int]]:
+                amp_min: int = DEFAULT_AMP_MIN,
+                fingerprint_format: str = FINGERPRINT_FORMAT,
+                as_batch: bool = False,
+                profile: FingerprintProfile = None) -> Union[List[Tuple[Union[str, int], int]], FingerprintBatch]:
     """
     FFT the channel, log transform output, find local maxima, then return locally sensitive hashes.
 
@@ -36,38 +45,73 @@ def fingerprint(channel_samples: List[int],
     :param wratio: ratio by which each sequential window overlaps the last and the next window.
     :param fan_value: degree to which a fingerprint can be paired with its neighbors.
     :param amp_min: minimum amplitude in spectrogram in order to be considered a peak.
+    :param fingerprint_format: format of the generated hashes, either "sha1" or "packed".
+    :param as_batch: return the hashes as a FingerprintBatch instead of a list of tuples.
+    :param profile: fingerprint profile, if given its parameters are used instead of wsize, wratio, fan_value,
+     amp_min and the peak finding and hashing settings.
     :return: a list of hashes with their corresponding offsets.
     """
-    # FFT the signal and extract frequency components
-    with (DejavuTimer(name=__name__ + ".fingerprint() - mlab.specgram(...\t\t")):
-        arr2D = mlab.specgram(
-            channel_samples,
-            NFFT=wsize,
-            Fs=Fs,
-            window=mlab.window_hanning,
-            noverlap=int(wsize * wratio))[0]
+    if profile is not None:
+        wsize, wratio = profile.window_size, profile.overlap_ratio
 
-    # Apply log transform since specgram function returns linear array. 0s are excluded to avoid np warning.
-    with (DejavuTimer(name=__name__ + ".fingerprint() - np.log10(arr2D...\t\t")):
-        arr2D = 10 * np.log10(arr2D, out=np.zeros_like(arr2D), where=(arr2D != 0))
+    # FFT the signal and extract frequency components, already log transformed.
+    with (DejavuTimer(name=__name__ + ".fingerprint() - spectrogram(...\t\t")):
+        arr2D = spectrogram(channel_samples, Fs=Fs, wsize=wsize, wratio=wratio, dtype=SPECTROGRAM_DTYPE)
 
-    local_maxima = get_2D_peaks(arr2D, plot=False, amp_min=amp_min)
+    local_maxima = get_2D_peaks(arr2D, plot=False, amp_min=amp_min, profile=profile)
 
     # return hashes
-    return generate_hashes(local_maxima, fan_value=fan_value)
+    return generate_hashes(local_maxima, fan_value=fan_value, fingerprint_format=fingerprint_format,
+                           as_batch=as_batch, profile=profile)
 
 
 @DejavuTimer(name=__name__ + ".get_2D_peaks()\t\t\t\t\t")
-def get_2D_peaks(arr2D: np.array, plot: bool = False, amp_min: int = DEFAULT_AMP_MIN)\
-        -> List[Tuple[List[int], List[int]]]:
+def get_2D_peaks(arr2D: np.array, plot: bool = False, amp_min: int = DEFAULT_AMP_MIN,
+                 profile: FingerprintProfile = None) -> List[Tuple[List[int], List[int]]]:
     """
     Extract maximum peaks from the spectogram matrix (arr2D).
 
     :param arr2D: matrix representing the spectogram.
     :param plot: for plotting the results.
     :param amp_min: minimum amplitude in spectrogram in order to be considered a peak.
+    :param profile: fingerprint profile, if given its parameters are used instead of amp_min and the peak
+     finding settings.
     :return: a list composed by a list of frequencies and times.
     """
+    if profile is None:
+        freqs_filter, times_filter = detect_peaks(arr2D, amp_min=amp_min)
+    else:
+        freqs_filter, times_filter = detect_peaks(arr2D, amp_min=profile.amp_min,
+                                                  neighborhood_size=profile.peak_neighborhood_size,
+                                                  connectivity_mask=profile.connectivity_mask)
+
+    if plot:
+        import matplotlib.pyplot as plt
+
+        # scatter of the peaks
+        fig, ax = plt.subplots()
+        ax.imshow(arr2D)
+        ax.scatter(times_filter, freqs_filter)
+        ax.set_xlabel('Time')
+        ax.set_ylabel('Frequency')
+        ax.set_title("Spectrogram")
+        plt.gca().invert_yaxis()
+        plt.show()
+
+    return list(zip(freqs_filter, times_filter))
+
+
+@lru_cache(maxsize=None)
+def peak_neighborhood(neighborhood_size: int = PEAK_NEIGHBORHOOD_SIZE,
+                      connectivity_mask: int = CONNECTIVITY_MASK) -> np.ndarray:
+    """
+    Returns the neighborhood a cell of the spectrogram has to be the maximum of to be a peak. It is built once
+    per (size, connectivity) and cached, the array is shared so it is read only.
+
+    :param neighborhood_size: number of cells around a peak it has to be the maximum of.
+    :param connectivity_mask: 1 for a diamond peak neighborhood, 2 for a square one.
+    :return: the boolean footprint of the neighborhood.
+    """
     # Original code from the repo is using a morphology mask that does not consider diagonal elements
     # as neighbors (basically a diamond figure) and then applies a dilation over it, so what I'm proposing
     # is to change from the current diamond figure to a just a normal square one:
@@ -79,15 +123,93 @@ def get_2D_peaks(arr2D: np.array, plot: bool = False, amp_min: int = DEFAULT_AMP
     # I've made now the mask shape configurable in order to allow both ways of find maximum peaks.
     # That being said, we generate the mask by using the following function
     # https://docs.scipy.org/doc/scipy/reference/generated/scipy.ndimage.generate_binary_structure.html
-    struct = generate_binary_structure(2, CONNECTIVITY_MASK)
+    struct = generate_binary_structure(2, connectivity_mask)
 
     #  And then we apply dilation using the following function
     #  http://docs.scipy.org/doc/scipy/reference/generated/scipy.ndimage.iterate_structure.html
-    #  Take into account that if PEAK_NEIGHBORHOOD_SIZE is 2 you can avoid the use of the scipy functions and just
+    #  Take into account that if neighborhood_size is 2 you can avoid the use of the scipy functions and just
     #  change it by the following code:
-    #  neighborhood = np.ones((PEAK_NEIGHBORHOOD_SIZE * 2 + 1, PEAK_NEIGHBORHOOD_SIZE * 2 + 1), dtype=bool)
-    neighborhood = iterate_structure(struct, PEAK_NEIGHBORHOOD_SIZE)
+    #  neighborhood = np.ones((neighborhood_size * 2 + 1, neighborhood_size * 2 + 1), dtype=bool)
+    neighborhood = iterate_structure(struct, neighborhood_size)
+    neighborhood.flags.writeable = False
+    return neighborhood
+
+
+def detect_peaks(arr2D: np.array, amp_min: int = DEFAULT_AMP_MIN, neighborhood_size: int = PEAK_NEIGHBORHOOD_SIZE,
+                 connectivity_mask: int = CONNECTIVITY_MASK) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the local maxima of the spectogram matrix (arr2D) above amp_min. Whether a cell is a peak only depends
+    on the cells within neighborhood_size of it in each direction.
+
+    Square neighborhoods are searched with two 1D maximum filters, diamond ones with the 2D footprint and the
+    erosion of the zero background. Both find the peaks the 2D footprint search finds.
+
+    :param arr2D: matrix representing the spectogram.
+    :param amp_min: minimum amplitude in spectrogram in order to be considered a peak.
+    :param neighborhood_size: number of cells around a peak it has to be the maximum of.
+    :param connectivity_mask: 1 for a diamond peak neighborhood, 2 for a square one.
+    :return: a tuple with the arrays of frequencies and times of the peaks, in row major (frequency) order.
+    """
+    neighborhood = peak_neighborhood(neighborhood_size, connectivity_mask)
+
+    if connectivity_mask == 2:
+        detected_peaks = _square_peaks_mask(arr2D, amp_min, neighborhood.shape)
+    else:
+        detected_peaks = _footprint_peaks_mask(arr2D, amp_min, neighborhood)
+
+    # only the peaks above amp_min are left in the mask, so only they get extracted. Their flat indexes are
+    # found in a single pass, much faster than np.nonzero walking both dimensions.
+    return np.divmod(np.flatnonzero(detected_peaks), detected_peaks.shape[1])
+
+
+def _running_max(arr: np.ndarray, size: int, axis: int, pad_mode: str = "symmetric") -> np.ndarray:
+    """
+    Maximum over a centered window of odd size along one axis, as scipy.ndimage.maximum_filter1d, but built from
+    log2(size) np.maximum calls over shifted slices of the whole matrix (windows of 2, 4, 8... cells), which
+    are much faster than filtering line by line.
+
+    :param arr: matrix filtered.
+    :param size: window size, odd.
+    :param axis: axis filtered.
+    :param pad_mode: np.pad mode of the borders, "symmetric" is the "reflect" mode of maximum_filter1d and
+     "constant" pads with zeros.
+    :return: the filtered matrix.
+    """
+    def window(start, length):
+        return tuple(slice(start, start + length) if dim == axis else slice(None) for dim in range(arr.ndim))
+
+    pad = [(0, 0)] * arr.ndim
+    pad[axis] = (size // 2, size // 2)
+    running_max, width = np.pad(arr, pad, mode=pad_mode), 1
+    while 2 * width <= size:
+        length = running_max.shape[axis] - width
+        running_max = np.maximum(running_max[window(0, length)], running_max[window(width, length)])
+        width *= 2
+
+    # the remaining cells are covered by two overlapping windows.
+    length = arr.shape[axis]
+    return np.maximum(running_max[window(0, length)], running_max[window(size - width, length)])
+
+
+def _square_peaks_mask(arr2D: np.array, amp_min: int, size: Tuple[int, int]) -> np.ndarray:
+    # a square neighborhood is a window along the frequencies times a window along the times, so its maximum
+    # is the maximum along one axis followed by the maximum along the other (same "reflect" borders), which
+    # takes 2 * log2(size) comparisons per cell instead of size ** 2.
+    local_max = _running_max(_running_max(arr2D, size[0], axis=0), size[1], axis=1)
+
+    detected_peaks = arr2D > amp_min
+    detected_peaks &= local_max == arr2D
 
+    if amp_min < 0:
+        # cells of a zero background (no other value in their neighborhood) are their own maximum, the
+        # erosion drops them. They only survive the threshold when it is negative.
+        near_nonzero = _running_max(arr2D != 0, size[0], axis=0, pad_mode="constant")
+        detected_peaks &= _running_max(near_nonzero, size[1], axis=1, pad_mode="constant")
+
+    return detected_peaks
+
+
+def _footprint_peaks_mask(arr2D: np.array, amp_min: int, neighborhood: np.ndarray) -> np.ndarray:
     # find local maxima using our filter mask
     local_max = maximum_filter(arr2D, footprint=neighborhood) == arr2D
 
@@ -95,69 +217,211 @@ def get_2D_peaks(arr2D: np.array, plot: bool = False, amp_min: int = DEFAULT_AMP
     background = (arr2D == 0)
     eroded_background = binary_erosion(background, structure=neighborhood, border_value=1)
 
-    # Boolean mask of arr2D with True at peaks (applying XOR on both matrices).
+    # Boolean mask of arr2D with True at peaks (applying XOR on both matrices), above amp_min.
     detected_peaks = local_max != eroded_background
+    detected_peaks &= arr2D > amp_min
 
-    # extract peaks
-    amps = arr2D[detected_peaks]
-    freqs, times = np.where(detected_peaks)
-
-    # filter peaks
-    amps = amps.flatten()
-
-    # get indices for frequency and time
-    filter_idxs = np.where(amps > amp_min)
-
-    freqs_filter = freqs[filter_idxs]
-    times_filter = times[filter_idxs]
-
-    if plot:
-        # scatter of the peaks
-        fig, ax = plt.subplots()
-        ax.imshow(arr2D)
-        ax.scatter(times_filter, freqs_filter)
-        ax.set_xlabel('Time')
-        ax.set_ylabel('Frequency')
-        ax.set_title("Spectrogram")
-        plt.gca().invert_yaxis()
-        plt.show()
-
-    return list(zip(freqs_filter, times_filter))
+    return detected_peaks
 
 
 @DejavuTimer(name=__name__ + ".generate_hashes()\t\t\t\t")
-def generate_hashes(peaks: List[Tuple[int, int]], fan_value: int = DEFAULT_FAN_VALUE) -> List[Tuple[str, int]]:
+def generate_hashes(peaks: List[Tuple[int, int]], fan_value: int = DEFAULT_FAN_VALUE,
+                    fingerprint_format: str = FINGERPRINT_FORMAT,
+                    as_batch: bool = False,
+                    profile: FingerprintProfile = None) -> Union[List[Tuple[Union[str, int], int]], FingerprintBatch]:
     """
     Hash list structure:
        sha1_hash[0:FINGERPRINT_REDUCTION]    time_offset
         [(e05b341a9b77a51fd26, 32), ... ]
+    or, for the packed format:
+       freq1 << 42 | freq2 << 21 | t_delta   time_offset
+        [(4398050806071298, 32), ... ]
 
     :param peaks: list of peak frequencies and times.
     :param fan_value: degree to which a fingerprint can be paired with its neighbors.
+    :param fingerprint_format: format of the generated hashes, either "sha1" or "packed".
+    :param as_batch: return the hashes as a FingerprintBatch, their keys computed straight into an array,
+     instead of a list of tuples.
+    :param profile: fingerprint profile, if given its parameters are used instead of fan_value and the hashing
+     settings.
     :return: a list of hashes with their corresponding offsets.
     """
-    # frequencies are in the first position of the tuples
-    idx_freq = 0
-    # times are in the second position of the tuples
-    idx_time = 1
+    try:
+        hash_function = (HASH_KEY_FUNCTIONS if as_batch else HASH_FUNCTIONS)[fingerprint_format]
+    except KeyError:
+        raise TypeError("Unsupported fingerprint format supplied.")
+
+    peaks = np.asarray(peaks, dtype=np.int64).reshape(-1, 2)
+
+    # frequencies are in the first column, times in the second one.
+    if profile is None:
+        freq1, freq2, t_delta, t1 = get_hash_pairs(peaks[:, 0], peaks[:, 1], fan_value=fan_value)
+        reduction = FINGERPRINT_REDUCTION
+    else:
+        freq1, freq2, t_delta, t1 = get_hash_pairs(peaks[:, 0], peaks[:, 1], fan_value=profile.fan_value,
+                                                   peak_sort=profile.peak_sort,
+                                                   min_time_delta=profile.min_hash_time_delta,
+                                                   max_time_delta=profile.max_hash_time_delta)
+        reduction = profile.fingerprint_reduction
+
+    if as_batch:
+        return FingerprintBatch.from_arrays(hash_function(freq1, freq2, t_delta, reduction=reduction), t1,
+                                            fingerprint_format)
+    return list(zip(hash_function(freq1, freq2, t_delta, reduction=reduction), t1.tolist()))
+
+
+def get_hash_pairs(freqs: np.ndarray, times: np.ndarray, fan_value: int = DEFAULT_FAN_VALUE,
+                   anchors: int = None, peak_sort: bool = PEAK_SORT, min_time_delta: int = MIN_HASH_TIME_DELTA,
+                   max_time_delta: int = MAX_HASH_TIME_DELTA) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Builds every (peak, partner) pair at once. Each peak is paired with the next fan_value - 1 peaks and the
+    pairs are kept in the same order the original nested loop produced them (peak major, partner minor).
+
+    :param freqs: peak frequencies.
+    :param times: peak times.
+    :param fan_value: degree to which a fingerprint can be paired with its neighbors.
+    :param anchors: if given, only the first `anchors` peaks (once sorted) are paired with their partners.
+    :param peak_sort: whether peaks are paired in time order.
+    :param min_time_delta: minimum time between two peaks paired.
+    :param max_time_delta: maximum time between two peaks paired.
+    :return: a tuple of arrays (freq1, freq2, t_delta, t1), one entry per pair.
+    """
+    freqs = np.asarray(freqs, dtype=np.int64)
+    times = np.asarray(times, dtype=np.int64)
+
+    if peak_sort:
+        # a stable sort keeps peaks sharing the same time ordered by frequency, as list.sort did.
+        order = np.argsort(times, kind="stable")
+        freqs = freqs[order]
+        times = times[order]
+
+    n_peaks = len(times)
+    n_anchors = n_peaks if anchors is None else min(anchors, n_peaks)
+    partners = np.arange(n_anchors)[:, np.newaxis] + np.arange(1, max(fan_value, 1))[np.newaxis, :]
+    in_range = partners < n_peaks
+    partners[~in_range] = 0
+
+    t_delta = times[partners] - times[:n_anchors, np.newaxis]
+    mask = in_range & (min_time_delta <= t_delta) & (t_delta <= max_time_delta)
+
+    # np.nonzero walks the mask in row major order, i.e. peak by peak.
+    rows, cols = np.nonzero(mask)
+
+    return freqs[rows], freqs[partners[rows, cols]], t_delta[rows, cols], times[rows]
+
+
+def sha1_hashes(freq1: np.ndarray, freq2: np.ndarray, t_delta: np.ndarray,
+                reduction: int = FINGERPRINT_REDUCTION) -> List[str]:
+    """
+    Compatibility hashing, byte-identical to the "freq1|freq2|t_delta" SHA1 prefix used by existing catalogs.
+    SHA1 itself can't be vectorized so it is only computed once per distinct triple and then broadcast back.
+
+    :param freq1: anchor peak frequencies.
+    :param freq2: partner peak frequencies.
+    :param t_delta: time deltas between anchor and partner.
+    :param reduction: hexadecimal characters of the SHA1 kept, the hashes are zero padded to
+     FINGERPRINT_REDUCTION characters.
+    :return: a list with the hexadecimal hash of each triple.
+    """
+    if len(freq1) == 0:
+        return []
+
+    triples, inverse = np.unique(np.stack([freq1, freq2, t_delta], axis=1), axis=0, return_inverse=True)
 
-    if PEAK_SORT:
-        peaks.sort(key=itemgetter(1))
+    digests = [
+        hashlib.sha1(f"{f1}|{f2}|{dt}".encode('utf-8')).hexdigest()[0:reduction].ljust(FINGERPRINT_REDUCTION, "0")
+        for f1, f2, dt in triples.tolist()
+    ]
 
-    hashes = []
-    for i in range(len(peaks)):
-        for j in range(1, fan_value):
-            if (i + j) < len(peaks):
+    return [digests[idx] for idx in inverse.reshape(-1).tolist()]
 
-                freq1 = peaks[i][idx_freq]
-                freq2 = peaks[i + j][idx_freq]
-                t1 = peaks[i][idx_time]
-                t2 = peaks[i + j][idx_time]
-                t_delta = t2 - t1
 
-                if MIN_HASH_TIME_DELTA <= t_delta <= MAX_HASH_TIME_DELTA:
-                    h = hashlib.sha1(f"{str(freq1)}|{str(freq2)}|{str(t_delta)}".encode('utf-8'))
+def sha1_keys(freq1: np.ndarray, freq2: np.ndarray, t_delta: np.ndarray,
+              reduction: int = FINGERPRINT_REDUCTION) -> np.ndarray:
+    """
+    Same hashes as sha1_hashes, as the raw bytes of the digest prefix instead of hexadecimal strings.
+
+    :param freq1: anchor peak frequencies.
+    :param freq2: partner peak frequencies.
+    :param t_delta: time deltas between anchor and partner.
+    :param reduction: hexadecimal characters of the SHA1 kept, the keys are zero padded to
+     FINGERPRINT_REDUCTION // 2 bytes.
+    :return: an array with the key of each triple.
+    """
+    if len(freq1) == 0:
+        return np.empty(0, dtype=SHA1_KEY_DTYPE)
+
+    triples, inverse = np.unique(np.stack([freq1, freq2, t_delta], axis=1), axis=0, return_inverse=True)
+
+    # an odd amount of characters keeps the high nibble of the last byte.
+    last_byte_mask = 0xF0 if reduction % 2 else 0xFF
+    digests = np.array([
+        _reduce_digest(hashlib.sha1(f"{f1}|{f2}|{dt}".encode('utf-8')).digest(), reduction, last_byte_mask)
+        for f1, f2, dt in triples.tolist()
+    ], dtype=SHA1_KEY_DTYPE)
+
+    return digests[inverse.reshape(-1)]
+
+
+def _reduce_digest(digest: bytes, reduction: int, last_byte_mask: int) -> bytes:
+    # the first `reduction` hexadecimal characters of the digest, as bytes.
+    reduced = digest[0:(reduction + 1) // 2]
+    if last_byte_mask == 0xFF:
+        return reduced
+    return reduced[:-1] + bytes([reduced[-1] & last_byte_mask])
+
+
+def packed_hashes(freq1: np.ndarray, freq2: np.ndarray, t_delta: np.ndarray,
+                  reduction: int = FINGERPRINT_REDUCTION) -> List[int]:
+    """
+    Packs each (freq1, freq2, t_delta) triple into a single 63 bits integer, PACKED_FIELD_BITS bits per member.
+
+    :param freq1: anchor peak frequencies.
+    :param freq2: partner peak frequencies.
+    :param t_delta: time deltas between anchor and partner.
+    :param reduction: unused, packed hashes keep the whole triple.
+    :return: a list with the packed hash of each triple.
+    """
+    return packed_keys(freq1, freq2, t_delta).tolist()
+
+
+def packed_keys(freq1: np.ndarray, freq2: np.ndarray, t_delta: np.ndarray,
+                reduction: int = FINGERPRINT_REDUCTION) -> np.ndarray:
+    """
+    Same hashes as packed_hashes, as an array.
+
+    :param freq1: anchor peak frequencies.
+    :param freq2: partner peak frequencies.
+    :param t_delta: time deltas between anchor and partner.
+    :param reduction: unused, packed hashes keep the whole triple.
+    :return: an array with the packed hash of each triple.
+    """
+    mask = (1 << PACKED_FIELD_BITS) - 1
+    packed = ((np.asarray(freq1, dtype=np.int64) & mask) << (2 * PACKED_FIELD_BITS)) \
+        | ((np.asarray(freq2, dtype=np.int64) & mask) << PACKED_FIELD_BITS) \
+        | (np.asarray(t_delta, dtype=np.int64) & mask)
+
+    return packed.astype(PACKED_KEY_DTYPE)
+
+
+def unpack_hash(packed_hash: int) -> Tuple[int, int, int]:
+    """
+    Inverse of packed_hashes for a single hash.
+
+    :param packed_hash: a hash in the packed format.
+    :return: the (freq1, freq2, t_delta) triple.
+    """
+    mask = (1 << PACKED_FIELD_BITS) - 1
+    return (packed_hash >> (2 * PACKED_FIELD_BITS)) & mask, (packed_hash >> PACKED_FIELD_BITS) & mask, \
+        packed_hash & mask
+
 
-                    hashes.append((h.hexdigest()[0:FINGERPRINT_REDUCTION], t1))
+HASH_FUNCTIONS = {
+    FINGERPRINT_FORMAT_SHA1: sha1_hashes,
+    FINGERPRINT_FORMAT_PACKED: packed_hashes
+}
 
-    return hashes
+HASH_KEY_FUNCTIONS = {
+    FINGERPRINT_FORMAT_SHA1: sha1_keys,
+    FINGERPRINT_FORMAT_PACKED: packed_keys
+}
@@ -0,0 +1,136 @@
+from typing import Dict, Optional, Union
+
+from dejavu.config.settings import (CATALOG_AMP_MIN, CATALOG_CONNECTIVITY_MASK,
+                                    CATALOG_FAN_VALUE,
+                                    CATALOG_FINGERPRINT_REDUCTION,
+                                    CATALOG_HASH_TIME_DELTA,
+                                    CATALOG_OVERLAP_RATIO,
+                                    CATALOG_PEAK_NEIGHBORHOOD_SIZE,
+                                    CATALOG_PEAK_SORT, CATALOG_SAMPLE_RATE,
+                                    CATALOG_WINDOW_SIZE, CONNECTIVITY_MASK,
+                                    DEFAULT_AMP_MIN, DEFAULT_FAN_VALUE,
+                                    DEFAULT_FS, DEFAULT_OVERLAP_RATIO,
+                                    DEFAULT_WINDOW_SIZE, FINGERPRINT_PROFILE,
+                                    FINGERPRINT_PROFILES,
+                                    FINGERPRINT_REDUCTION,
+                                    MAX_HASH_TIME_DELTA, MIN_HASH_TIME_DELTA,
+                                    PEAK_NEIGHBORHOOD_SIZE, PEAK_SORT)
+
+
+class FingerprintProfile(object):
+    """
+    Parameters audio is fingerprinted with: the sampling rate, the FFT window size and overlap ratio used
+    at that rate, and the peak finding and hashing parameters. Every parameter defaults to the one of the
+    settings, so several catalogs tuned differently can be served from the same process, each Dejavu
+    instance fingerprinting with the profile recorded in the catalog of its database.
+
+    Files are resampled to the rate of the profile when decoded, and recordings before being fingerprinted,
+    so every offset stands for the same amount of time whatever the rate of the audio it comes from.
+
+    # Use as:
+    profile = FingerprintProfile.from_config({"fs": 11025, "window_size": 1024, "fan_value": 10})
+    channels, fs, file_hash = decoder.read(file_name, frame_rate=profile.fs)
+    hashes = fingerprint(channels[0], Fs=fs, profile=profile)
+    """
+    def __init__(self, fs: Optional[int] = None, window_size: int = DEFAULT_WINDOW_SIZE,
+                 overlap_ratio: float = DEFAULT_OVERLAP_RATIO, fan_value: int = DEFAULT_FAN_VALUE,
+                 amp_min: float = DEFAULT_AMP_MIN, peak_neighborhood_size: int = PEAK_NEIGHBORHOOD_SIZE,
+                 connectivity_mask: int = CONNECTIVITY_MASK, fingerprint_reduction: int = FINGERPRINT_REDUCTION,
+                 peak_sort: bool = PEAK_SORT, min_hash_time_delta: int = MIN_HASH_TIME_DELTA,
+                 max_hash_time_delta: int = MAX_HASH_TIME_DELTA):
+        """
+        :param fs: sampling rate audio is resampled to, None keeps the rate of every file.
+        :param window_size: FFT windows size.
+        :param overlap_ratio: ratio by which each sequential window overlaps the last and the next window.
+        :param fan_value: degree to which a fingerprint can be paired with its neighbors.
+        :param amp_min: minimum amplitude in spectrogram in order to be considered a peak.
+        :param peak_neighborhood_size: number of cells around a peak in the spectrogram it has to be the
+         maximum of.
+        :param connectivity_mask: 1 for a diamond peak neighborhood, 2 for a square one.
+        :param fingerprint_reduction: hexadecimal characters of the SHA1 kept, up to FINGERPRINT_REDUCTION
+         (the width the hashes are stored with), the rest of them are zeroed.
+        :param peak_sort: whether peaks are paired in time order.
+        :param min_hash_time_delta: minimum time between two peaks paired.
+        :param max_hash_time_delta: maximum time between two peaks paired.
+        """
+        super().__init__()
+        if (fs is not None and fs <= 0) or window_size <= 0 or not 0 <= overlap_ratio < 1 or fan_value < 1 \
+                or peak_neighborhood_size < 0 or connectivity_mask not in (1, 2) \
+                or not 0 < fingerprint_reduction <= FINGERPRINT_REDUCTION \
+                or min_hash_time_delta > max_hash_time_delta:
+            raise TypeError("Unsupported fingerprint profile supplied.")
+
+        self.fs = fs
+        self.window_size = window_size
+        self.overlap_ratio = overlap_ratio
+        self.fan_value = fan_value
+        self.amp_min = amp_min
+        self.peak_neighborhood_size = peak_neighborhood_size
+        self.connectivity_mask = connectivity_mask
+        self.fingerprint_reduction = fingerprint_reduction
+        self.peak_sort = bool(peak_sort)
+        self.min_hash_time_delta = min_hash_time_delta
+        self.max_hash_time_delta = max_hash_time_delta
+
+    @classmethod
+    def from_config(cls, config: Union[str, Dict[str, any], None] = None) -> 'FingerprintProfile':
+        """
+        :param config: name of one of the FINGERPRINT_PROFILES, or a dictionary with parameters of the profile
+         (those missing are taken from the settings) and optionally the "profile" they start from,
+         FINGERPRINT_PROFILE if None.
+        :return: the profile.
+        """
+        if config is None:
+            config = FINGERPRINT_PROFILE
+        if isinstance(config, str):
+            config = {"profile": config}
+
+        config = dict(config)
+        base = config.pop("profile", None)
+        if base is not None:
+            if base not in FINGERPRINT_PROFILES:
+                raise TypeError("Unsupported fingerprint profile supplied.")
+            config = {**FINGERPRINT_PROFILES[base], **config}
+
+        try:
+            return cls(**config)
+        except TypeError:
+            raise TypeError("Unsupported fingerprint profile supplied.")
+
+    @property
+    def hop(self) -> int:
+        # samples between the start of two consecutive windows, an offset is a number of hops.
+        return self.window_size - int(self.window_size * self.overlap_ratio)
+
+    def offset_seconds(self, offset: int) -> float:
+        """
+        :param offset: offset of a fingerprint, or an offset difference.
+        :return: the offset in seconds, assuming DEFAULT_FS if the profile keeps the rate of every file.
+        """
+        return round(float(offset) * self.hop / (self.fs or DEFAULT_FS), 5)
+
+    def catalog_settings(self) -> Dict[str, str]:
+        """
+        :return: the catalog settings the fingerprints of this profile are recorded with.
+        """
+        return {
+            CATALOG_SAMPLE_RATE: str(self.fs or "native"),
+            CATALOG_WINDOW_SIZE: str(self.window_size),
+            CATALOG_OVERLAP_RATIO: str(self.overlap_ratio),
+            CATALOG_FAN_VALUE: str(self.fan_value),
+            CATALOG_AMP_MIN: str(self.amp_min),
+            CATALOG_PEAK_NEIGHBORHOOD_SIZE: str(self.peak_neighborhood_size),
+            CATALOG_CONNECTIVITY_MASK: str(self.connectivity_mask),
+            CATALOG_FINGERPRINT_REDUCTION: str(self.fingerprint_reduction),
+            CATALOG_PEAK_SORT: str(int(self.peak_sort)),
+            CATALOG_HASH_TIME_DELTA: f"{self.min_hash_time_delta}-{self.max_hash_time_delta}"
+        }
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, FingerprintProfile) and self.catalog_settings() == other.catalog_settings()
+
+    def __hash__(self) -> int:
+        return hash(tuple(sorted(self.catalog_settings().items())))
+
+    def __repr__(self) -> str:
+        return f"FingerprintProfile({', '.join(f'{key}={value!r}' for key, value in vars(self).items())})"
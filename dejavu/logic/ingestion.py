@@ -0,0 +1,179 @@
+import copy
+import multiprocessing
+import queue
+import sys
+import threading
+import traceback
+from functools import partial
+from time import time
+from typing import Any, Callable, Iterable, Set, Tuple
+
+from dejavu.base_classes.base_database import BaseDatabase
+from dejavu.config.settings import (INGESTION_QUEUE_SIZE,
+                                    INGESTION_REPORT_INTERVAL,
+                                    INGESTION_WRITERS)
+from dejavu.logic.file_hash_cache import FileHashCache
+from dejavu.logic.stop_hashes import StopHashes
+
+
+class IngestionPipeline(object):
+    """
+    Fingerprints files in a process pool while writer threads store the results, so the database
+    writes of a song overlap with the fingerprinting of the next ones.
+
+    - files are submitted one by one to the pool, holding one of a fixed number of slots which is only
+    released once the file is stored (or failed). When all slots are taken, submission waits, so finished
+    results never pile up in memory faster than they can be written.
+    - finished results go through a bounded queue to the writer threads, each one storing them with its
+    own copy of the database (all of them checking connections out of the same pool).
+    - the set of known file hashes is loaded once and updated as songs get stored, so files found to be
+    duplicates only after decoding them are not stored twice.
+    - throughput (files/s and hashes/s) is printed every `report_interval` seconds and at the end.
+
+    # Use as:
+    pipeline = IngestionPipeline(db, worker, known_hashes, nprocesses=4)
+    pipeline.run((file_name, worker_arguments, hash_cache_key) for file_name in files)
+    """
+    def __init__(self, db: BaseDatabase, worker: Callable, known_hashes: Set[str], nprocesses: int = None,
+                 nwriters: int = INGESTION_WRITERS, queue_size: int = INGESTION_QUEUE_SIZE,
+                 hash_cache: FileHashCache = None, report_interval: float = INGESTION_REPORT_INTERVAL,
+                 stop_hashes: StopHashes = None):
+        """
+        :param db: database the songs are stored in, each writer thread works on a copy of it.
+        :param worker: function run in the pool for each file, returning the same tuple as
+         Dejavu._fingerprint_worker does.
+        :param known_hashes: hashes of the files already fingerprinted, it gets updated as files are stored.
+        :param nprocesses: amount of processes fingerprinting files, all cpus if None.
+        :param nwriters: amount of threads writing to the database.
+        :param queue_size: amount of fingerprinted files that can wait for a writer.
+        :param hash_cache: cache updated with the hash of every file fingerprinted, if given.
+        :param report_interval: seconds between throughput reports.
+        :param stop_hashes: stop hashes dropped from the songs stored, if they are pruned at ingest time.
+        """
+        super().__init__()
+        self.db = db
+        self.worker = worker
+        self.known_hashes = known_hashes
+        self.nprocesses = nprocesses
+        self.nwriters = max(nwriters, 1)
+        self.hash_cache = hash_cache
+        self.report_interval = report_interval
+        self.stop_hashes = stop_hashes
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        # files in flight: being fingerprinted, waiting in the queue or being written.
+        self._slots = threading.BoundedSemaphore(queue_size + (nprocesses or multiprocessing.cpu_count()))
+        self._lock = threading.Lock()
+
+        self.files = 0
+        self.hashes = 0
+        self.failures = 0
+        self._start = None
+        self._last_report = None
+
+    def is_known(self, file_hash: str) -> bool:
+        with self._lock:
+            return file_hash in self.known_hashes
+
+    def run(self, jobs: Iterable[Tuple[str, Any, Any]]) -> None:
+        """
+        Fingerprints and stores the given files, returning once all of them are done. Jobs are consumed
+        lazily, so whatever produces them (e.g. walking a directory) overlaps with the work.
+
+        :param jobs: iterable of (file name, worker arguments, hash cache key) tuples.
+        """
+        # the pool is forked before any writer thread is started.
+        pool = multiprocessing.Pool(self.nprocesses)
+        writers = [threading.Thread(target=self._write, args=(copy.copy(self.db),), daemon=True)
+                   for _ in range(self.nwriters)]
+        for writer in writers:
+            writer.start()
+
+        self._start = self._last_report = time()
+        try:
+            for file_name, arguments, key in jobs:
+                self._slots.acquire()
+                pool.apply_async(self.worker, (arguments,), callback=partial(self._finished, file_name, key),
+                                 error_callback=partial(self._failed, file_name))
+        finally:
+            pool.close()
+            pool.join()
+            for _ in writers:
+                self._queue.put(None)
+            for writer in writers:
+                writer.join()
+
+        self._report(final=True)
+
+    def _finished(self, file_name: str, key: Any, result: Tuple) -> None:
+        # runs in the pool result handler thread, blocking it here holds the next results back in the workers.
+        self._queue.put((file_name, key, result))
+
+    def _write(self, db: BaseDatabase) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            file_name, key, result = item
+            try:
+                self._store(db, file_name, key, result)
+            except Exception as err:
+                self._failed(file_name, err, release=False)
+            finally:
+                self._slots.release()
+
+    def _store(self, db: BaseDatabase, file_name: str, key: Any, result: Tuple) -> None:
+        song_name, hashes, file_hash, song_publisher, song_length, song_singer, song_album, song_public = result
+
+        if self.hash_cache is not None:
+            self.hash_cache.set(key, file_hash)
+
+        # the hash is claimed before writing, so a duplicate handled by another writer is skipped.
+        with self._lock:
+            duplicate = file_hash in self.known_hashes
+            self.known_hashes.add(file_hash)
+
+        if duplicate:
+            print(f"{file_name} already fingerprinted, continuing...")
+            return
+
+        if self.stop_hashes is not None:
+            hashes = self.stop_hashes.prune_stored(hashes)
+
+        try:
+            sid = db.insert_song(song_name, file_hash, len(hashes), song_publisher, song_length, song_singer,
+                                 song_album, song_public)
+            db.insert_hashes(sid, hashes)
+            db.set_song_fingerprinted(sid)
+        except Exception:
+            with self._lock:
+                self.known_hashes.discard(file_hash)
+            raise
+
+        with self._lock:
+            self.files += 1
+            self.hashes += len(hashes)
+        self._report()
+
+    def _failed(self, file_name: str, err: BaseException, release: bool = True) -> None:
+        with self._lock:
+            self.failures += 1
+            print(f"Failed fingerprinting {file_name}")
+            # Print traceback because we can't reraise it here
+            traceback.print_exception(type(err), err, err.__traceback__, file=sys.stdout)
+
+        if release:
+            self._slots.release()
+
+    def _report(self, final: bool = False) -> None:
+        with self._lock:
+            now = time()
+            if not final and now - self._last_report < self.report_interval:
+                return
+            self._last_report = now
+
+            elapsed = max(now - self._start, 1e-9)
+            print(f"{'Ingested' if final else 'Ingesting'}: {self.files} files in {elapsed:.1f} s "
+                  f"({self.files / elapsed:.2f} files/s, {self.hashes / elapsed:.0f} hashes/s), "
+                  f"{self.failures} failed")
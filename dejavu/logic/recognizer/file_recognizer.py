@@ -15,7 +15,8 @@ class FileRecognizer(BaseRecognizer):
 
     @DejavuTimer(name=__name__ + ".recognize_file()\t\t")
     def recognize_file(self, filename: str) -> Dict[str, any]:
-        channels, self.Fs, _ = decoder.read(filename, self.dejavu.limit)
+        channels, self.Fs, _ = decoder.read(filename, self.dejavu.limit, backend=self.dejavu.decoder_backend,
+                                            frame_rate=self.dejavu.profile.fs)
 
         t = time()
         matches, fingerprint_time, query_time, align_time = self._recognize(*channels)
@@ -26,7 +27,8 @@ class FileRecognizer(BaseRecognizer):
             FINGERPRINT_TIME: fingerprint_time,
             QUERY_TIME: query_time,
             ALIGN_TIME: align_time,
-            RESULTS: matches
+            RESULTS: matches,
+            **self.pruning
         }
 
         return results
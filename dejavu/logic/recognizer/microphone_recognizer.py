@@ -1,7 +1,12 @@
+from time import time
+from typing import Dict
+
 import numpy as np
 import pyaudio
 
 from dejavu.base_classes.base_recognizer import BaseRecognizer
+from dejavu.config.settings import (ALIGN_TIME, FINGERPRINT_TIME, QUERY_TIME,
+                                    RESULTS, TOTAL_TIME)
 
 
 class MicrophoneRecognizer(BaseRecognizer):
@@ -28,6 +33,8 @@ class MicrophoneRecognizer(BaseRecognizer):
         self.channels = channels
         self.recorded = False
         self.samplerate = samplerate
+        # recordings are resampled to the rate of the fingerprint profile from this one.
+        self.Fs = samplerate
 
         if self.stream:
             self.stream.stop_stream()
@@ -58,10 +65,24 @@ class MicrophoneRecognizer(BaseRecognizer):
         self.stream = None
         self.recorded = True
 
-    def recognize_recording(self):
+    def recognize_recording(self) -> Dict[str, any]:
         if not self.recorded:
             raise NoRecordingError("Recording was not complete/begun")
-        return self._recognize(*self.data)
+
+        t = time()
+        matches, fingerprint_time, query_time, align_time = self._recognize(*self.data)
+        t = time() - t
+
+        results = {
+            TOTAL_TIME: t,
+            FINGERPRINT_TIME: fingerprint_time,
+            QUERY_TIME: query_time,
+            ALIGN_TIME: align_time,
+            RESULTS: matches,
+            **self.pruning
+        }
+
+        return results
 
     def get_recorded_time(self):
         return len(self.data[0]) / self.rate
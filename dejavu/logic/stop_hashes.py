@@ -0,0 +1,195 @@
+import json
+import os
+import tempfile
+import threading
+from typing import Dict, Iterable, List, Tuple, Union
+
+import numpy as np
+
+from dejavu.base_classes.base_database import BaseDatabase
+from dejavu.config.settings import (FINGERPRINT_FORMAT_SHA1,
+                                    STOP_FINGERPRINTS_SKIPPED,
+                                    STOP_HASHES_PRUNED)
+from dejavu.logic.fingerprint_batch import FingerprintBatch, hashes_to_keys
+
+
+class StopHashes(object):
+    """
+    Hashes having more fingerprints than a threshold in the database (silence, tones, common drum
+    patterns...). Each one brings back as many matches as it has fingerprints while barely telling the
+    songs apart, so they are skipped when querying and, optionally, not stored when fingerprinting.
+
+    The counts are a snapshot of the database, kept in a JSON sidecar file next to it and refreshed with
+    from_database (e.g. `python dejavu.py --stop-hashes`) as the catalog grows. Running totals of the
+    work saved are kept, report() sums them up together with the index space the stop hashes take.
+
+    # Use as:
+    stop_hashes = StopHashes.from_database(db, threshold=1000)
+    stop_hashes.save("stop_hashes.json")
+    hashes, pruning = stop_hashes.prune(hashes)
+    """
+    def __init__(self, counts: Dict[Union[str, int], int], threshold: int, fingerprint_format: str,
+                 total_fingerprints: int, prune_ingest: bool = False):
+        """
+        :param counts: amount of fingerprints of every stop hash.
+        :param threshold: hashes having more fingerprints than this one are stop hashes.
+        :param fingerprint_format: format of the hashes, either "sha1" or "packed".
+        :param total_fingerprints: fingerprints in the database when the hashes were counted.
+        :param prune_ingest: whether prune_stored drops the stop hashes of the songs fingerprinted.
+        """
+        super().__init__()
+        self.threshold = threshold
+        self.fingerprint_format = fingerprint_format
+        self.total_fingerprints = total_fingerprints
+        self.prune_ingest = prune_ingest
+        self.counts = {self._normalize(hsh): count for hsh, count in counts.items()}
+
+        # sorted keys of the stop hashes, with their counts, to prune fingerprint batches at once.
+        keys = hashes_to_keys(self.counts, fingerprint_format)
+        order = np.argsort(keys)
+        self._keys = keys[order]
+        self._key_counts = np.fromiter(self.counts.values(), dtype=np.int64, count=len(self.counts))[order]
+
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.hashes_queried = 0
+        self.hashes_pruned = 0
+        self.fingerprints_skipped = 0
+        self.fingerprints_not_stored = 0
+
+    @classmethod
+    def from_database(cls, db: BaseDatabase, threshold: int, prune_ingest: bool = False) -> 'StopHashes':
+        """
+        Counts the fingerprints of every hash of the database.
+
+        :param db: database counted.
+        :param threshold: hashes having more fingerprints than this one are stop hashes.
+        :param prune_ingest: whether prune_stored drops the stop hashes of the songs fingerprinted.
+        :return: the stop hashes of the database.
+        """
+        return cls(db.get_frequent_hashes(threshold), threshold, db.fingerprint_format, db.get_num_fingerprints(),
+                   prune_ingest)
+
+    @classmethod
+    def load(cls, path: str, prune_ingest: bool = False) -> 'StopHashes':
+        """
+        :param path: sidecar file written by save.
+        :param prune_ingest: whether prune_stored drops the stop hashes of the songs fingerprinted.
+        :return: the stop hashes saved.
+        """
+        with open(path) as f:
+            data = json.load(f)
+        return cls(dict(data["hashes"]), data["threshold"], data["fingerprint_format"], data["total_fingerprints"],
+                   prune_ingest)
+
+    def save(self, path: str) -> None:
+        """
+        Writes the stop hashes to a sidecar file, replacing it at once.
+
+        :param path: sidecar file written.
+        """
+        data = {
+            "threshold": self.threshold,
+            "fingerprint_format": self.fingerprint_format,
+            "total_fingerprints": self.total_fingerprints,
+            # as pairs, JSON keys being strings only.
+            "hashes": sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        }
+        directory, name = os.path.split(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _normalize(self, hsh: Union[str, int]) -> Union[str, int]:
+        # sha1 hashes are compared in upper case, packed ones as plain integers.
+        return hsh.upper() if self.fingerprint_format == FINGERPRINT_FORMAT_SHA1 else int(hsh)
+
+    def _stop_mask(self, batch: FingerprintBatch) -> np.ndarray:
+        if batch.fingerprint_format != self.fingerprint_format:
+            raise TypeError("Unsupported fingerprint format supplied.")
+        return np.isin(batch.keys, self._keys)
+
+    def __contains__(self, hsh: Union[str, int]) -> bool:
+        return self._normalize(hsh) in self.counts
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def prune(self, hashes: Iterable[Tuple[Union[str, int], int]]) \
+            -> Tuple[List[Tuple[Union[str, int], int]], Dict[str, int]]:
+        """
+        Drops the stop hashes of a query.
+
+        :param hashes: A sequence of tuples in the format (hash, offset), or a FingerprintBatch.
+        :return: the (hash, offset) tuples (or the batch) kept, and a dictionary with the amount of distinct hashes
+         pruned and of fingerprints the database didn't have to return because of them.
+        """
+        if isinstance(hashes, FingerprintBatch):
+            stop = self._stop_mask(hashes)
+            # counts of the distinct stop hashes of the query.
+            pruned = self._key_counts[np.searchsorted(self._keys, np.unique(hashes.keys[stop]))].tolist()
+            kept = hashes[~stop]
+        else:
+            kept, pruned_counts = [], {}
+            for hsh, offset in hashes:
+                count = self.counts.get(self._normalize(hsh))
+                if count is None:
+                    kept.append((hsh, offset))
+                else:
+                    pruned_counts[self._normalize(hsh)] = count
+            pruned = list(pruned_counts.values())
+
+        pruning = {STOP_HASHES_PRUNED: len(pruned), STOP_FINGERPRINTS_SKIPPED: sum(pruned)}
+        with self._lock:
+            self.queries += 1
+            self.hashes_queried += len(kept) + len(pruned)
+            self.hashes_pruned += pruning[STOP_HASHES_PRUNED]
+            self.fingerprints_skipped += pruning[STOP_FINGERPRINTS_SKIPPED]
+        return kept, pruning
+
+    def prune_stored(self, hashes: List[Tuple[Union[str, int], int]]) -> List[Tuple[Union[str, int], int]]:
+        """
+        Drops the stop hashes of a song being fingerprinted, when pruning at ingest time is enabled.
+
+        :param hashes: A sequence of tuples in the format (hash, offset), or a FingerprintBatch.
+        :return: the (hash, offset) tuples (or the batch) to store.
+        """
+        if not self.prune_ingest:
+            return hashes
+
+        if isinstance(hashes, FingerprintBatch):
+            kept = hashes[~self._stop_mask(hashes)]
+        else:
+            kept = [(hsh, offset) for hsh, offset in hashes if self._normalize(hsh) not in self.counts]
+        with self._lock:
+            self.fingerprints_not_stored += len(hashes) - len(kept)
+        return kept
+
+    def report(self) -> Dict[str, any]:
+        """
+        :return: a dictionary with the threshold, the amount of stop hashes, the fingerprints they take
+         in the index (and their share of all of them), and the work saved since the stop hashes were
+         loaded: queries pruned, hashes queried and pruned, fingerprints the database didn't return (in
+         total and per query) and fingerprints not stored.
+        """
+        stop_fingerprints = sum(self.counts.values())
+        index_share = stop_fingerprints / self.total_fingerprints if self.total_fingerprints else 0.0
+        with self._lock:
+            return {
+                "threshold": self.threshold,
+                "stop_hashes": len(self.counts),
+                "stop_fingerprints": stop_fingerprints,
+                "total_fingerprints": self.total_fingerprints,
+                "index_share": round(index_share, 4),
+                "queries": self.queries,
+                "hashes_queried": self.hashes_queried,
+                "hashes_pruned": self.hashes_pruned,
+                "fingerprints_skipped": self.fingerprints_skipped,
+                "fingerprints_skipped_per_query": round(self.fingerprints_skipped / max(self.queries, 1), 1),
+                "fingerprints_not_stored": self.fingerprints_not_stored
+            }
@@ -0,0 +1,202 @@
+from typing import Iterable, Iterator, List, Tuple, Union
+
+import numpy as np
+
+from dejavu.config.settings import (DEFAULT_AMP_MIN, DEFAULT_FAN_VALUE,
+                                    DEFAULT_FS, DEFAULT_OVERLAP_RATIO,
+                                    DEFAULT_WINDOW_SIZE, FINGERPRINT_FORMAT,
+                                    SPECTROGRAM_DTYPE)
+from dejavu.logic.fingerprint import (HASH_FUNCTIONS, HASH_KEY_FUNCTIONS,
+                                      detect_peaks, get_hash_pairs)
+from dejavu.logic.fingerprint_batch import FingerprintBatch
+from dejavu.logic.fingerprint_profile import FingerprintProfile
+from dejavu.logic.stft import spectrogram
+
+from dejavu.third_party.dejavu_timer import DejavuTimer
+
+# Minimum number of new spectrogram frames gathered before looking for peaks on them.
+# The peak search is repeated over 2 * peak_neighborhood_size frames of overlap per chunk.
+FRAMES_PER_CHUNK = 512
+
+
+class StreamingFingerprinter(object):
+    """
+    Fingerprints a single channel from consecutive blocks of samples, keeping only a bounded
+    amount of samples, spectrogram frames and peaks in memory regardless of the audio length.
+
+    Spectrogram frames are computed as soon as enough samples are available. Whether a frame holds
+    a peak only depends on the peak_neighborhood_size frames around it, so peaks are only settled for
+    frames having that many frames on each side (or being at the very start or end of the audio).
+    Hashes pair each peak with the next fan_value - 1 ones, so the last fan_value - 1 peaks are carried
+    until their partners are known.
+
+    The hashes produced, with their absolute offsets, are the same fingerprint() returns for the whole
+    audio with the same profile (peaks are paired in time order, as fingerprint() does with peak_sort enabled).
+
+    # Use as:
+    fingerprinter = StreamingFingerprinter(Fs=fs)
+    for block in blocks:
+        hashes = fingerprinter.feed(block)
+        ...
+    hashes = fingerprinter.flush()
+    """
+    def __init__(self,
+                 Fs: int = DEFAULT_FS,
+                 wsize: int = DEFAULT_WINDOW_SIZE,
+                 wratio: float = DEFAULT_OVERLAP_RATIO,
+                 fan_value: int = DEFAULT_FAN_VALUE,
+                 amp_min: int = DEFAULT_AMP_MIN,
+                 fingerprint_format: str = FINGERPRINT_FORMAT,
+                 frames_per_chunk: int = FRAMES_PER_CHUNK,
+                 as_batch: bool = False,
+                 profile: FingerprintProfile = None):
+        super().__init__()
+        if profile is None:
+            # the peak finding and hashing parameters not given are the ones of the settings.
+            profile = FingerprintProfile(window_size=wsize, overlap_ratio=wratio, fan_value=fan_value,
+                                         amp_min=amp_min)
+
+        try:
+            self.hash_function = (HASH_KEY_FUNCTIONS if as_batch else HASH_FUNCTIONS)[fingerprint_format]
+        except KeyError:
+            raise TypeError("Unsupported fingerprint format supplied.")
+
+        self.fingerprint_format = fingerprint_format
+        # hashes are returned as FingerprintBatch instead of lists of tuples.
+        self.as_batch = as_batch
+
+        self.Fs = Fs
+        self.profile = profile
+        self.wsize = profile.window_size
+        self.wratio = profile.overlap_ratio
+        self.step = profile.hop
+        self.fan_value = profile.fan_value
+        self.amp_min = profile.amp_min
+        self.neighborhood_size = profile.peak_neighborhood_size
+        self.frames_per_chunk = frames_per_chunk
+
+        # samples not yet consumed by a spectrogram frame.
+        self._samples = np.empty(0, dtype=np.int16)
+        # spectrogram frames kept in memory, and the absolute index of the first one.
+        self._frames = np.empty((self.wsize // 2 + 1, 0), dtype=SPECTROGRAM_DTYPE)
+        self._frames_start = 0
+        # absolute index of the first frame whose peaks are not settled yet.
+        self._settled = 0
+        # settled peaks that are still waiting for their partners.
+        self._peak_freqs = np.empty(0, dtype=np.int64)
+        self._peak_times = np.empty(0, dtype=np.int64)
+
+    def feed(self, samples: np.ndarray) -> Union[List[Tuple[Union[str, int], int]], FingerprintBatch]:
+        """
+        Adds a new block of samples to the stream.
+
+        :param samples: next samples of the channel.
+        :return: the hashes (with their absolute offsets) that can already be settled.
+        """
+        self._samples = np.concatenate([self._samples, np.asarray(samples)])
+
+        n_frames = (len(self._samples) - self.wsize) // self.step + 1 if len(self._samples) >= self.wsize else 0
+        if n_frames > 0:
+            self._append_frames(self._samples[:(n_frames - 1) * self.step + self.wsize])
+            self._samples = self._samples[n_frames * self.step:]
+
+        unsettled = self._frames.shape[1] - (self._settled - self._frames_start)
+        if unsettled < self.frames_per_chunk + self.neighborhood_size:
+            return FingerprintBatch.concatenate([], self.fingerprint_format) if self.as_batch else []
+
+        return self._settle(last=False)
+
+    def flush(self) -> Union[List[Tuple[Union[str, int], int]], FingerprintBatch]:
+        """
+        Ends the stream. Trailing samples not filling a whole window are discarded, as fingerprint() does.
+
+        :return: the remaining hashes.
+        """
+        if self._frames_start == 0 and self._frames.shape[1] == 0:
+            # audios shorter than a window get zero padded into a single frame.
+            self._append_frames(self._samples)
+        self._samples = self._samples[:0]
+
+        return self._settle(last=True)
+
+    def _append_frames(self, samples: np.ndarray) -> None:
+        arr2D = spectrogram(samples, Fs=self.Fs, wsize=self.wsize, wratio=self.wratio, dtype=SPECTROGRAM_DTYPE)
+        self._frames = np.concatenate([self._frames, arr2D], axis=1)
+
+    @DejavuTimer(name=__name__ + ".StreamingFingerprinter._settle()\t[agg]")
+    def _settle(self, last: bool) -> Union[List[Tuple[Union[str, int], int]], FingerprintBatch]:
+        frames_end = self._frames_start + self._frames.shape[1]
+        settle_end = frames_end if last else frames_end - self.neighborhood_size
+
+        # the frames kept before self._settled provide the left context of the peak search.
+        freqs, times = detect_peaks(self._frames, amp_min=self.amp_min, neighborhood_size=self.neighborhood_size,
+                                    connectivity_mask=self.profile.connectivity_mask)
+        times = times + self._frames_start
+        keep = (times >= self._settled) & (times < settle_end)
+        freqs, times = freqs[keep], times[keep]
+
+        # time order, frequency order on ties.
+        order = np.argsort(times, kind="stable")
+        self._peak_freqs = np.concatenate([self._peak_freqs, freqs[order]])
+        self._peak_times = np.concatenate([self._peak_times, times[order]])
+
+        # only the peaks that already have all their partners are paired, unless this is the end.
+        pending = 0 if last else min(max(self.fan_value - 1, 0), len(self._peak_times))
+        anchors = len(self._peak_times) - pending
+        # the peaks are already in time order.
+        freq1, freq2, t_delta, t1 = get_hash_pairs(self._peak_freqs, self._peak_times, fan_value=self.fan_value,
+                                                   anchors=anchors, peak_sort=False,
+                                                   min_time_delta=self.profile.min_hash_time_delta,
+                                                   max_time_delta=self.profile.max_hash_time_delta)
+        keys = self.hash_function(freq1, freq2, t_delta, reduction=self.profile.fingerprint_reduction)
+        if self.as_batch:
+            hashes = FingerprintBatch.from_arrays(keys, t1, self.fingerprint_format)
+        else:
+            hashes = list(zip(keys, t1.tolist()))
+
+        self._peak_freqs = self._peak_freqs[anchors:]
+        self._peak_times = self._peak_times[anchors:]
+
+        # drop the frames no longer needed as context.
+        self._settled = settle_end
+        new_start = max(self._frames_start, settle_end - self.neighborhood_size)
+        self._frames = self._frames[:, new_start - self._frames_start:]
+        self._frames_start = new_start
+
+        return hashes
+
+
+def fingerprint_stream(blocks: Iterable[np.ndarray],
+                       Fs: int = DEFAULT_FS,
+                       wsize: int = DEFAULT_WINDOW_SIZE,
+                       wratio: float = DEFAULT_OVERLAP_RATIO,
+                       fan_value: int = DEFAULT_FAN_VALUE,
+                       amp_min: int = DEFAULT_AMP_MIN,
+                       fingerprint_format: str = FINGERPRINT_FORMAT,
+                       profile: FingerprintProfile = None) \
+        -> Iterator[List[Tuple[Union[str, int], int]]]:
+    """
+    Fingerprints a channel given as a sequence of sample blocks, yielding the hashes as they get settled.
+    Concatenating everything yielded gives the same list fingerprint() returns for the whole channel.
+
+    :param blocks: iterable of consecutive channel sample blocks.
+    :param Fs: audio sampling rate.
+    :param wsize: FFT windows size.
+    :param wratio: ratio by which each sequential window overlaps the last and the next window.
+    :param fan_value: degree to which a fingerprint can be paired with its neighbors.
+    :param amp_min: minimum amplitude in spectrogram in order to be considered a peak.
+    :param fingerprint_format: format of the generated hashes, either "sha1" or "packed".
+    :param profile: fingerprint profile, if given its parameters are used instead of wsize, wratio, fan_value,
+     amp_min and the peak finding and hashing settings.
+    :return: an iterator over lists of hashes with their corresponding absolute offsets.
+    """
+    fingerprinter = StreamingFingerprinter(Fs=Fs, wsize=wsize, wratio=wratio, fan_value=fan_value,
+                                           amp_min=amp_min, fingerprint_format=fingerprint_format, profile=profile)
+    for block in blocks:
+        hashes = fingerprinter.feed(block)
+        if hashes:
+            yield hashes
+
+    hashes = fingerprinter.flush()
+    if hashes:
+        yield hashes
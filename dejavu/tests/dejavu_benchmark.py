@@ -0,0 +1,285 @@
+import os
+from itertools import groupby
+from time import perf_counter, process_time
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+from scipy.ndimage import (binary_erosion, generate_binary_structure,
+                           iterate_structure, maximum_filter)
+
+import dejavu.logic.decoder as decoder
+from dejavu import Dejavu
+from dejavu.base_classes.base_recognizer import BaseRecognizer
+from dejavu.base_classes.common_database import CommonDatabase
+from dejavu.config.settings import (FINGERPRINT_FORMAT, INPUT_HASHES, RESULTS,
+                                    SONG_NAME, SPECTROGRAM_DTYPE)
+from dejavu.logic.alignment import best_offsets
+from dejavu.logic.channels import CHANNEL_STRATEGIES
+from dejavu.logic.fingerprint import detect_peaks
+from dejavu.logic.fingerprint_profile import FingerprintProfile
+from dejavu.logic.stft import spectrogram
+
+
+def align_matches_reference(matches: List[Tuple[int, int]]) -> List[Tuple[int, int, int]]:
+    """
+    Alignment as Dejavu.align_matches used to do it, over a list of (song id, offset difference) tuples.
+
+    :param matches: list of (song id, offset difference) tuples.
+    :return: a list of (song id, offset difference, count) tuples, the best songs first.
+    """
+    sorted_matches = sorted(matches, key=lambda m: (m[0], m[1]))
+    counts = [(*key, len(list(group))) for key, group in groupby(sorted_matches, key=lambda m: (m[0], m[1]))]
+    return sorted(
+        [max(list(group), key=lambda g: g[2]) for key, group in groupby(counts, key=lambda count: count[0])],
+        key=lambda count: count[2], reverse=True
+    )
+
+
+def detect_peaks_reference(arr2D: np.ndarray, amp_min: int, neighborhood_size: int,
+                           connectivity_mask: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Peak detection as detect_peaks used to do it: the neighborhood built on every call, a 2D maximum filter
+    over its footprint, the erosion of the zero background and the amp_min threshold applied to every
+    candidate.
+
+    :param arr2D: matrix representing the spectogram.
+    :param amp_min: minimum amplitude in spectrogram in order to be considered a peak.
+    :param neighborhood_size: number of cells around a peak it has to be the maximum of.
+    :param connectivity_mask: 1 for a diamond peak neighborhood, 2 for a square one.
+    :return: a tuple with the arrays of frequencies and times of the peaks.
+    """
+    neighborhood = iterate_structure(generate_binary_structure(2, connectivity_mask), neighborhood_size)
+    local_max = maximum_filter(arr2D, footprint=neighborhood) == arr2D
+    eroded_background = binary_erosion(arr2D == 0, structure=neighborhood, border_value=1)
+    detected_peaks = local_max != eroded_background
+
+    amps = arr2D[detected_peaks].flatten()
+    freqs, times = np.where(detected_peaks)
+    filter_idxs = np.where(amps > amp_min)
+    return freqs[filter_idxs], times[filter_idxs]
+
+
+def generate_matches(n_matches: int, n_songs: int = 10000, max_offset: int = 20000, aligned: float = 0.05,
+                     seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Generates random matches, as a query against a large catalog returns them: mostly noise spread
+    over many songs, with a fraction of them aligned on a single offset difference of a few songs.
+
+    :param n_matches: amount of matches.
+    :param n_songs: amount of songs in the catalog.
+    :param max_offset: maximum offset difference.
+    :param aligned: fraction of the matches aligned.
+    :param seed: random seed.
+    :return: two parallel arrays, song ids and offset differences.
+    """
+    rng = np.random.default_rng(seed)
+    song_ids = rng.integers(1, n_songs + 1, n_matches)
+    offset_differences = rng.integers(-max_offset, max_offset, n_matches)
+
+    n_aligned = int(n_matches * aligned)
+    song_ids[:n_aligned] = rng.integers(1, 6, n_aligned)
+    offset_differences[:n_aligned] = song_ids[:n_aligned] * 100
+
+    return song_ids, offset_differences
+
+
+def time_call(function: Callable, *args, repeat: int = 3) -> float:
+    """
+    :return: the best time, in seconds, out of `repeat` calls of the function.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = perf_counter()
+        function(*args)
+        best = min(best, perf_counter() - start)
+    return best
+
+
+def benchmark_alignment(match_counts: List[int], topn: int = 2, repeat: int = 3) -> List[Dict[str, float]]:
+    """
+    Times the list based alignment against the vectorized one, checking both of them give the same results.
+
+    :param match_counts: amounts of matches to benchmark.
+    :param topn: number of songs kept.
+    :param repeat: calls timed per implementation, the best one is kept.
+    :return: a list of dictionaries with the matches, the seconds each implementation took and the speedup.
+    """
+    results = []
+    for n_matches in match_counts:
+        song_ids, offset_differences = generate_matches(n_matches)
+        matches = list(zip(song_ids.tolist(), offset_differences.tolist()))
+
+        expected = align_matches_reference(matches)[:topn]
+        obtained = best_offsets(song_ids, offset_differences, topn)
+        if obtained != expected:
+            raise AssertionError(f"Alignment mismatch for {n_matches} matches: {obtained} != {expected}")
+
+        reference_time = time_call(align_matches_reference, matches, repeat=repeat)
+        vectorized_time = time_call(best_offsets, song_ids, offset_differences, topn, repeat=repeat)
+        results.append({
+            "matches": n_matches,
+            "reference": reference_time,
+            "vectorized": vectorized_time,
+            "speedup": reference_time / vectorized_time
+        })
+
+    return results
+
+
+def benchmark_expansion(match_counts: List[int], repeat: int = 3) -> List[Dict[str, float]]:
+    """
+    Times the expansion of the rows fetched by return_matches into (song id, offset difference) tuples
+    against their expansion into arrays.
+
+    :param match_counts: amounts of rows to benchmark.
+    :param repeat: calls timed per implementation, the best one is kept.
+    :return: a list of dictionaries with the rows, the seconds each implementation took and the speedup.
+    """
+    def expand_reference(mapper, rows):
+        results = []
+        for hsh, sid, offset in rows:
+            for song_sampled_offset in mapper[hsh]:
+                results.append((sid, offset - song_sampled_offset))
+        return results
+
+    results = []
+    rng = np.random.default_rng(0)
+    for n_rows in match_counts:
+        n_hashes = max(n_rows // 50, 1)
+        mapper = {hsh: rng.integers(0, 2000, rng.integers(1, 4)).tolist() for hsh in range(n_hashes)}
+        rows = list(zip(rng.integers(0, n_hashes, n_rows).tolist(), rng.integers(1, 10000, n_rows).tolist(),
+                        rng.integers(0, 20000, n_rows).tolist()))
+
+        (sids, diffs), _ = CommonDatabase._matches_as_arrays(mapper, rows)
+        if sorted(zip(sids.tolist(), diffs.tolist())) != sorted(expand_reference(mapper, rows)):
+            raise AssertionError(f"Expansion mismatch for {n_rows} rows")
+
+        reference_time = time_call(expand_reference, mapper, rows, repeat=repeat)
+        vectorized_time = time_call(CommonDatabase._matches_as_arrays, mapper, rows, repeat=repeat)
+        results.append({
+            "matches": n_rows,
+            "reference": reference_time,
+            "vectorized": vectorized_time,
+            "speedup": reference_time / vectorized_time
+        })
+
+    return results
+
+
+class SamplesRecognizer(BaseRecognizer):
+    """
+    Recognizes audio already decoded, given as its channels and sampling rate.
+    """
+    def recognize(self, channels: List[np.ndarray], fs: int) -> Dict[str, any]:
+        self.Fs = fs
+        matches, fingerprint_time, query_time, align_time = self._recognize(*channels)
+        return {RESULTS: matches}
+
+
+def benchmark_channel_strategies(paths: List[str], extensions: List[str] = ["mp3", "wav"], seconds: int = 5,
+                                 clips: int = 10, seed: int = 0,
+                                 fingerprint_format: str = FINGERPRINT_FORMAT) -> List[Dict[str, float]]:
+    """
+    Fingerprints the audio files found into an in-memory database with every channel strategy, and then
+    recognizes the same random clips of them.
+
+    :param paths: directories with the audio files.
+    :param extensions: file extensions to look for.
+    :param seconds: length of the clips recognized.
+    :param clips: clips recognized per file.
+    :param seed: random seed.
+    :param fingerprint_format: format of the hashes, either "sha1" or "packed".
+    :return: a list of dictionaries with the strategy, the CPU seconds taken fingerprinting the files
+     (decoding included) and recognizing the clips, the hashes stored per second of audio, the hashes
+     queried per clip and the fraction of clips whose best match is the file they come from.
+    """
+    files = sorted(file_name for path in paths for file_name, _ in decoder.find_files(path, extensions))
+    rng = np.random.default_rng(seed)
+
+    # the same clips are recognized with every strategy.
+    queries, audio_seconds = [], 0.0
+    for file_name in files:
+        channels, fs, _ = decoder.read(file_name)
+        length = len(channels[0])
+        audio_seconds += length / fs
+        for start in rng.integers(0, max(length - seconds * fs, 1), clips).tolist():
+            queries.append((os.path.splitext(os.path.basename(file_name))[0],
+                            [np.asarray(channel[start: start + seconds * fs]) for channel in channels], fs))
+
+    results = []
+    for strategy in CHANNEL_STRATEGIES:
+        djv = Dejavu({"database_type": "memory", "fingerprint_format": fingerprint_format,
+                      "channel_strategy": strategy})
+
+        start, hashes = process_time(), 0
+        for file_name in files:
+            batch, file_hash = Dejavu.get_file_fingerprints(file_name, None, fingerprint_format=fingerprint_format,
+                                                            channel_strategy=strategy)
+            song_id = djv.db.insert_song(os.path.splitext(os.path.basename(file_name))[0], file_hash, len(batch))
+            djv.db.insert_hashes(song_id, batch)
+            djv.db.set_song_fingerprinted(song_id)
+            hashes += len(batch)
+        fingerprint_cpu = process_time() - start
+
+        start, correct, queried = process_time(), 0, 0
+        for song_name, channels, fs in queries:
+            matches = djv.recognize(SamplesRecognizer, channels, fs)[RESULTS]
+            correct += bool(matches) and matches[0][SONG_NAME] == song_name
+            queried += matches[0][INPUT_HASHES] if matches else 0
+        recognize_cpu = process_time() - start
+
+        results.append({
+            "strategy": strategy,
+            "fingerprint_cpu": fingerprint_cpu,
+            "hashes_per_second": hashes / audio_seconds if audio_seconds else 0.0,
+            "recognize_cpu": recognize_cpu,
+            "hashes_per_query": queried / len(queries) if queries else 0.0,
+            "accuracy": correct / len(queries) if queries else 0.0
+        })
+
+    return results
+
+
+def benchmark_peak_detection(paths: List[str], extensions: List[str] = ["mp3", "wav"], repeat: int = 3,
+                             profile: FingerprintProfile = None) -> List[Dict[str, float]]:
+    """
+    Times the previous peak detection against detect_peaks over the spectrogram of every channel of the audio
+    files found, checking both of them find the same peaks.
+
+    :param paths: directories with the audio files.
+    :param extensions: file extensions to look for.
+    :param repeat: calls timed per implementation, the best one is kept.
+    :param profile: fingerprint profile the spectrograms are computed and the peaks searched with, the one of
+     the settings if None.
+    :return: a list of dictionaries with the file, the minutes of audio of its channels, the seconds each
+     implementation took per minute of audio and the speedup.
+    """
+    profile = profile or FingerprintProfile.from_config()
+    parameters = (profile.amp_min, profile.peak_neighborhood_size, profile.connectivity_mask)
+
+    results = []
+    for file_name in sorted(file_name for path in paths for file_name, _ in decoder.find_files(path, extensions)):
+        channels, fs, _ = decoder.read(file_name, frame_rate=profile.fs)
+        reference_time = detection_time = minutes = 0.0
+        for channel in channels:
+            arr2D = spectrogram(channel, Fs=fs, wsize=profile.window_size, wratio=profile.overlap_ratio,
+                                dtype=SPECTROGRAM_DTYPE)
+
+            expected = detect_peaks_reference(arr2D, *parameters)
+            obtained = detect_peaks(arr2D, *parameters)
+            if not all(np.array_equal(o, e) for o, e in zip(obtained, expected)):
+                raise AssertionError(f"Peaks mismatch for {file_name}")
+
+            reference_time += time_call(detect_peaks_reference, arr2D, *parameters, repeat=repeat)
+            detection_time += time_call(detect_peaks, arr2D, *parameters, repeat=repeat)
+            minutes += len(channel) / fs / 60
+
+        results.append({
+            "file": os.path.basename(file_name),
+            "minutes": minutes,
+            "reference": reference_time / minutes,
+            "detection": detection_time / minutes,
+            "speedup": reference_time / detection_time
+        })
+
+    return results
@@ -9,6 +9,9 @@ The wavio module defines the functions:
 read(file)
     Read a WAV file and return a `wavio.Wav` object, with attributes
     `data`, `rate` and `sampwidth`.
+WavMap(file)
+    Memory map a PCM WAV file, giving access to its samples without
+    reading the file or copying the data.
 write(filename, data, rate, scale=None, sampwidth=None)
     Write a numpy array to a WAV file.
 -----
@@ -37,6 +40,8 @@ POSSIBILITY OF SUCH DAMAGE.
 """
 
 
+import os as _os
+import struct as _struct
 import wave as _wave
 
 import numpy as _np
@@ -165,6 +170,144 @@ def read(file):
     return w
 
 
+class WavFormatError(ValueError):
+    """Raised by `WavMap` for files it can't map (not RIFF/WAVE, not PCM, malformed)."""
+    pass
+
+
+_WAVE_FORMAT_PCM = 0x0001
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# dtype and byte offset within each sample of the views given by `WavMap`.
+# 24 bit samples are viewed through their two most significant bytes.
+_mmap_dtypes = {1: ('u1', 0),
+                2: ('<i2', 0),
+                3: ('<i2', 1),
+                4: ('<i4', 0)}
+
+
+def _parse_riff(f, file_size):
+    """
+    Parse the chunks of a RIFF/WAVE file up to the data chunk.
+    Returns (nchannels, rate, sampwidth, block_align, data_offset, data_size).
+    """
+    riff = f.read(12)
+    if len(riff) < 12 or riff[:4] != b'RIFF' or riff[8:12] != b'WAVE':
+        raise WavFormatError('not a RIFF/WAVE file.')
+
+    fmt = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            raise WavFormatError('no data chunk found.')
+        chunk_id, chunk_size = _struct.unpack('<4sI', header)
+        if chunk_id == b'fmt ':
+            body = f.read(chunk_size)
+            if len(body) < 16:
+                raise WavFormatError('fmt chunk too short.')
+            fmt = _struct.unpack('<HHIIHH', body[:16])
+            if fmt[0] == _WAVE_FORMAT_EXTENSIBLE:
+                if len(body) < 26:
+                    raise WavFormatError('extensible fmt chunk too short.')
+                # the format code is held by the first two bytes of the sub format GUID.
+                fmt = (_struct.unpack('<H', body[24:26])[0],) + fmt[1:]
+            if chunk_size % 2:
+                f.seek(1, _os.SEEK_CUR)
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise WavFormatError('data chunk found before the fmt chunk.')
+            data_offset = f.tell()
+            # streamed files may not have their data size filled in, the rest of the file is taken then.
+            data_size = min(chunk_size, file_size - data_offset)
+            break
+        else:
+            f.seek(chunk_size + chunk_size % 2, _os.SEEK_CUR)
+
+    audio_format, nchannels, rate, _, block_align, bits = fmt
+    sampwidth = (bits + 7) // 8
+    if audio_format != _WAVE_FORMAT_PCM:
+        raise WavFormatError(f'unsupported audio format {audio_format:#06x}, only PCM is supported.')
+    if sampwidth not in _mmap_dtypes or nchannels < 1 or block_align < nchannels * sampwidth:
+        raise WavFormatError(f'unsupported layout: {nchannels} channels of {bits} bits '
+                             f'in blocks of {block_align} bytes.')
+    return nchannels, rate, sampwidth, block_align, data_offset, data_size
+
+
+def read_rate(file):
+    """
+    Read the sample rate from the header of a PCM WAV file, without
+    mapping it. Raises WavFormatError as WavMap does.
+    """
+    with open(file, 'rb') as f:
+        return _parse_riff(f, _os.path.getsize(file))[1]
+
+
+class WavMap(object):
+    """
+    Memory mapped PCM WAV file. Nothing is read up front besides the RIFF
+    header, the data is paged in by the OS as it gets accessed, so files
+    larger than the available memory can be processed. Attributes are:
+    rate : int
+        The sample rate of the WAV file.
+    sampwidth : int
+        The sample width (i.e. number of bytes per sample) of the WAV file.
+    nchannels : int
+        The number of channels.
+    nframes : int
+        The number of frames (one sample per channel).
+    file_bytes : numpy memmap
+        The whole file as an array of uint8.
+    data_offset, data_size : int
+        Position and size in bytes of the samples within the file.
+    data : numpy array
+        A view of shape (nframes, nchannels) over the samples, without any
+        copy. 8, 16 and 32 bit samples are viewed as uint8, int16 and int32.
+        24 bit samples are viewed as int16 holding their 16 most
+        significant bits; use `blocks` to read them at full resolution.
+    """
+
+    def __init__(self, file):
+        file_size = _os.path.getsize(file)
+        with open(file, 'rb') as f:
+            (self.nchannels, self.rate, self.sampwidth, self.block_align,
+             self.data_offset, data_size) = _parse_riff(f, file_size)
+
+        self.nframes = data_size // self.block_align
+        self.data_size = self.nframes * self.block_align
+        self.file_bytes = _np.memmap(file, dtype=_np.uint8, mode='r')
+
+        dtype, byte_offset = _mmap_dtypes[self.sampwidth]
+        self.data = _np.ndarray(shape=(self.nframes, self.nchannels), dtype=dtype, buffer=self.file_bytes,
+                                offset=self.data_offset + byte_offset,
+                                strides=(self.block_align, self.sampwidth))
+
+    def channel(self, channel):
+        """Strided view (no copy) over the samples of one channel."""
+        return self.data[:, channel]
+
+    def blocks(self, block_frames, start=0, stop=None):
+        """
+        Yield the samples at full resolution as arrays of shape
+        (frames, nchannels), `block_frames` frames at a time. 24 bit
+        samples are sign extended into int32 arrays one block at a time,
+        other widths are yielded as views.
+        """
+        stop = self.nframes if stop is None else min(stop, self.nframes)
+        for begin in range(start, stop, block_frames):
+            end = min(begin + block_frames, stop)
+            if self.sampwidth != 3:
+                yield self.data[begin:end]
+                continue
+
+            raw = self.file_bytes[self.data_offset + begin * self.block_align:self.data_offset + end * self.block_align]
+            raw = raw.reshape(-1, self.block_align)[:, :self.nchannels * 3]
+            yield _wav2array(self.nchannels, 3, _np.ascontiguousarray(raw).ravel())
+
+    def __repr__(self):
+        return (f"WavMap(nframes={self.nframes}, nchannels={self.nchannels}, "
+                f"rate={self.rate}, sampwidth={self.sampwidth})")
+
+
 _sampwidth_dtypes = {1: _np.uint8,
                      2: _np.int16,
                      3: _np.int32,
@@ -0,0 +1,57 @@
+import argparse
+import json
+import sys
+from argparse import RawTextHelpFormatter
+
+from dejavu.base_classes.base_database import BaseDatabase, get_database
+from dejavu.config.settings import FINGERPRINT_FORMAT, RESHARD_BATCH_SIZE
+from dejavu.database_handler.sharded_database import reshard
+
+
+def init(configpath: str) -> BaseDatabase:
+    """
+    Load the database of a config JSON file
+    """
+    try:
+        with open(configpath) as f:
+            config = json.load(f)
+    except IOError as err:
+        print(f"Cannot open configuration: {str(err)}. Exiting")
+        sys.exit(1)
+
+    db = get_database(config.get("database_type", "mysql").lower())(**config.get("database", {}))
+    db.set_fingerprint_format(config.get("fingerprint_format", FINGERPRINT_FORMAT))
+    return db
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Dejavu: copies the fingerprints of a database to another one,\n"
+                    "e.g. to change the amount of shards of a sharded database.",
+        formatter_class=RawTextHelpFormatter)
+    parser.add_argument('-s', '--source', required=True,
+                        help='Path to the configuration file of the database read\n')
+    parser.add_argument('-t', '--target', required=True,
+                        help='Path to the configuration file of the database written,\n'
+                             'it must use the same fingerprint format as the source\n')
+    parser.add_argument('-b', '--batch-size', type=int, default=RESHARD_BATCH_SIZE,
+                        help='Number of fingerprints read at a time\n')
+    parser.add_argument('-i', '--initial-build', action='store_true',
+                        help='Build the target indexes once all the fingerprints are copied,\n'
+                             'the target must have no fingerprints\n')
+    args = parser.parse_args()
+
+    source = init(args.source)
+    target = init(args.target)
+    target.setup()
+
+    if args.initial_build:
+        target.begin_initial_build()
+        try:
+            copied = reshard(source, target, args.batch_size)
+        finally:
+            target.finish_initial_build()
+    else:
+        copied = reshard(source, target, args.batch_size)
+
+    print(f"Copied {copied} fingerprints of {target.get_num_songs()} songs")
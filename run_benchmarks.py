@@ -0,0 +1,79 @@
+import argparse
+
+from dejavu.tests.dejavu_benchmark import (benchmark_alignment,
+                                           benchmark_channel_strategies,
+                                           benchmark_expansion,
+                                           benchmark_peak_detection)
+
+
+def print_results(title: str, results: list) -> None:
+    print(title)
+    print(f"{'matches':>12} {'reference (s)':>15} {'vectorized (s)':>15} {'speedup':>9}")
+    for result in results:
+        print(f"{result['matches']:>12} {result['reference']:>15.4f} {result['vectorized']:>15.4f} "
+              f"{result['speedup']:>8.1f}x")
+    print()
+
+
+def print_channel_results(title: str, results: list) -> None:
+    print(title)
+    print(f"{'strategy':>10} {'fingerprint (s)':>16} {'hashes/s audio':>15} {'recognize (s)':>14} "
+          f"{'hashes/query':>13} {'accuracy':>9}")
+    for result in results:
+        print(f"{result['strategy']:>10} {result['fingerprint_cpu']:>16.2f} {result['hashes_per_second']:>15.1f} "
+              f"{result['recognize_cpu']:>14.2f} {result['hashes_per_query']:>13.1f} {result['accuracy']:>9.2%}")
+    print()
+
+
+def print_peak_results(title: str, results: list) -> None:
+    print(title)
+    print(f"{'file':>32} {'minutes':>8} {'reference (s/min)':>18} {'detect_peaks (s/min)':>21} {'speedup':>9}")
+    for result in results:
+        print(f"{result['file'][-32:]:>32} {result['minutes']:>8.2f} {result['reference']:>18.4f} "
+              f"{result['detection']:>21.4f} {result['speedup']:>8.1f}x")
+    print()
+
+
+def main(match_counts: list, topn: int, repeat: int, audio_paths: list, seconds: int, clips: int,
+         peak_paths: list):
+    print_results("Rows expansion (return_matches)", benchmark_expansion(match_counts, repeat=repeat))
+    print_results("Offsets alignment (align_matches)", benchmark_alignment(match_counts, topn=topn, repeat=repeat))
+    if audio_paths:
+        print_channel_results(f"Channel strategies ({clips} clips of {seconds}s per file, CPU time)",
+                              benchmark_channel_strategies(audio_paths, seconds=seconds, clips=clips))
+    if peak_paths:
+        print_peak_results("Peak detection (detect_peaks), seconds per minute of audio",
+                           benchmark_peak_detection(peak_paths, repeat=repeat))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the vectorized match alignment against the previous list based one, "
+                    "checking both give the same results.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("-m", "--matches", type=int, nargs="+", default=[10000, 100000, 1000000],
+                        help="Amounts of matches to benchmark.")
+    parser.add_argument("-t", "--topn", type=int, default=2, help="Number of songs kept.")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Calls timed per implementation, the best one is kept.")
+    parser.add_argument("-c", "--channel-strategies", nargs="*", metavar="DIRECTORY", default=None,
+                        help="Also compares the channel strategies fingerprinting and recognizing the audio files "
+                             "of these directories (./mp3 and ./test if none is given).")
+    parser.add_argument("-p", "--peaks", nargs="*", metavar="DIRECTORY", default=None,
+                        help="Also times the previous peak detection against the current one over the spectrograms "
+                             "of the audio files of these directories (./mp3 and ./test if none is given).")
+    parser.add_argument("-s", "--secs", type=int, default=5, help="Length of the clips recognized.")
+    parser.add_argument("-n", "--clips", type=int, default=10, help="Clips recognized per audio file.")
+
+    args = parser.parse_args()
+
+    audio_paths = args.channel_strategies
+    if audio_paths is not None and not audio_paths:
+        audio_paths = ["./mp3", "./test"]
+
+    peak_paths = args.peaks
+    if peak_paths is not None and not peak_paths:
+        peak_paths = ["./mp3", "./test"]
+
+    main(args.matches, args.topn, args.repeat, audio_paths, args.secs, args.clips, peak_paths)